@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+# bench-revbits.py
+# Micro benchmark for DSF bit reversal (LSB first -> MSB first)
+# Compares the per-byte revbits() function with the table driven revbytes()
+# from dsdlib.py
+# License: GPLv2
+#
+# v0.1 18-Oct-2026
+# Initial version
+
+import os
+import sys
+import time
+
+import dsdlib
+
+#-- Functions
+
+# Reverse a buffer one byte at a time, the way playdsd.py used to do it
+def revbits_loop(data):
+    out = bytearray(len(data))
+    revbits = dsdlib.revbits
+    for i in range(0, len(data)):
+        out[i] = revbits(data[i])
+    return out
+
+# Run func on data until at least mintime seconds have passed
+# Returns: throughput in MB/s
+def bench(func, data, mintime):
+    loops = 0
+    start = time.perf_counter()
+    while True:
+        func(data)
+        loops += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= mintime:
+            break
+    return (len(data) * loops) / elapsed / 1e6
+
+#-- Main
+if __name__ == "__main__":
+    size = 1 << 20
+    if len(sys.argv) > 1:
+        size = int(sys.argv[1])
+
+    data = os.urandom(size)
+
+    if revbits_loop(data) != dsdlib.revbytes(bytearray(data)):
+        print("revbytes() output differs from revbits()")
+        sys.exit(1)
+
+    slow = bench(revbits_loop, data, 1.0)
+    fast = bench(dsdlib.revbytes, data, 1.0)
+
+    print("Buffer size\t\t: %d bytes" % size)
+    print("revbits() per byte\t: %10.2f MB/s" % slow)
+    print("revbytes() table\t: %10.2f MB/s" % fast)
+    print("Speedup\t\t\t: %10.1fx" % (fast / slow))
+    sys.exit(0)
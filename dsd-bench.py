@@ -0,0 +1,439 @@
+#!/usr/bin/env python
+
+# dsd-bench.py
+# Reproducible benchmark of the DSD parsing and conversion code, no audio
+# hardware needed. Generates a synthetic corpus of valid DSF and DSDIFF files
+# at every DSD rate (44k1 and 48k based, DSD64 - DSD1024) in mono, stereo and
+# 5.1, with and without ID3 tag, and times header parsing, bit reversal, the
+# playdsd.py converters and playback pipeline (to its null output, no
+# alsaaudio needed) and the dsdlib DSD to PCM converter on it.
+# Results are printed as MB/s and real time factor per DSD rate, and can be
+# written to a JSON file and compared against the results of an earlier run.
+# Uses dsdlib.py and playdsd.py
+# License: GPLv2
+#
+# v0.1 18-Oct-2026
+# Initial version
+# v0.2 18-Oct-2026
+# Time the playback converters for mono and 5.1 as well
+# v0.3 18-Oct-2026
+# Time the byte copy packers for little endian native DSD formats
+# Time the whole playback pipeline to the null output of playdsd.py
+
+import contextlib
+import getopt
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+import dsdlib
+
+# The playback converters and pipeline live in playdsd.py
+try:
+    import playdsd
+except SystemExit:
+    playdsd = None
+
+#-- Functions
+
+# ratename
+# Short name for a DSD rate, e.g. "DSD64" or "DSD128-48k"
+def ratename(rate):
+    if rate % 48000 == 0:
+        return "DSD%d-48k" % (rate // 48000)
+    return "DSD%d" % (rate // 44100)
+
+# id3tag
+# Minimal ID3v2.3 tag with a title frame, padded to 1024 bytes
+def id3tag(title):
+    text = b'\x00' + title.encode("latin-1")
+    frames = struct.pack('>4sLH', b'TIT2', len(text), 0) + text
+    size = 1024 - 10
+    frames += bytes(size - len(frames))
+    syncsafe = bytes([(size >> 21) & 0x7f, (size >> 14) & 0x7f,
+                      (size >> 7) & 0x7f, size & 0x7f])
+    return b'ID3\x03\x00\x00' + syncsafe + frames
+
+# writedsf
+# Write a DSF file with pseudo random DSD data, the same for every run
+def writedsf(filename, rate, channels, samples, tag):
+    rnd = random.Random(rate * 10 + channels)
+    perchan = (samples + 7) // 8
+    groups = (perchan + 4095) // 4096
+    data = bytearray(rnd.randbytes(groups * 4096 * channels))
+    # Zero padding after the last sample of every channel
+    last = perchan - (groups - 1) * 4096
+    for c in range(0, channels):
+        off = ((groups - 1) * channels + c) * 4096
+        data[off + last:off + 4096] = bytes(4096 - last)
+    with open(filename, 'wb') as f:
+        f.write(dsdlib.dsfheader(rate, channels, samples, len(tag)))
+        f.write(data)
+        f.write(tag)
+
+# writedsdiff
+# Write a DSDIFF file with pseudo random DSD data, the same for every run
+def writedsdiff(filename, rate, channels, samples, tag):
+    rnd = random.Random(rate * 10 + channels)
+    datasize = samples // 8 * channels
+    trailer = b''
+    if tag:
+        trailer = dsdlib.dsdiffchunk('ID3 ', tag)
+    with open(filename, 'wb') as f:
+        f.write(dsdlib.dsdiffheader(rate, channels, datasize, len(trailer)))
+        f.write(rnd.randbytes(datasize))
+        if datasize & 1:
+            f.write(b'\0')
+        f.write(trailer)
+
+# makecorpus
+# Generate the synthetic corpus
+# Input: directory, nr of seconds of audio per file
+# Returns: list of (filename, type, rate, channels, id3) tuples
+def makecorpus(topdir, seconds):
+    corpus = []
+    for base in (44100, 48000):
+        for rate in dsdlib.get_dsd_rates(dsdlib.getmaxdsd(), base):
+            # Whole bytes per channel
+            samples = int(rate * seconds) // 8 * 8
+            for channels in (1, 2, 6):
+                for id3 in (False, True):
+                    tag = b''
+                    if id3:
+                        tag = id3tag("%s %dch" % (ratename(rate), channels))
+                    name = "%s-%dch%s" % (ratename(rate).lower(), channels,
+                                          "-id3" if id3 else "")
+                    filename = os.path.join(topdir, name + ".dsf")
+                    writedsf(filename, rate, channels, samples, tag)
+                    corpus.append((filename, 'dsf', rate, channels, id3))
+                    filename = os.path.join(topdir, name + ".dff")
+                    writedsdiff(filename, rate, channels, samples, tag)
+                    corpus.append((filename, 'dsdiff', rate, channels, id3))
+    return corpus
+
+# bench
+# Run func until at least mintime seconds have passed (at least twice)
+# Returns: best time of a single run in seconds
+def bench(func, mintime):
+    best = None
+    total = 0.0
+    runs = 0
+    while total < mintime or runs < 2:
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        total += elapsed
+        runs += 1
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+# readdata
+# Read the DSD data of a corpus file into memory
+# Returns: dsdfile, DSD data (whole blocks for DSF)
+def readdata(filename):
+    info = dsdlib.dsdfile()
+    dsdlib.checkdsdfile(filename, info)
+    with dsdlib.dsdmap(filename, info, dsdlib.mapsize(info)) as dsd:
+        data = bytes(dsd.data)
+    return info, data
+
+# Benchmarks, every function returns a dict with the results
+
+# Header parsing of all corpus files of one type
+def bench_parse(corpus, dsdtype, mintime):
+    files = [entry[0] for entry in corpus if entry[1] == dsdtype]
+
+    def run():
+        for filename in files:
+            dsdlib.checkdsdfile(filename, dsdlib.dsdfile())
+
+    elapsed = bench(run, mintime)
+    return { 'files_per_s' : len(files) / elapsed }
+
+# Bit reversal of a 1 MiB buffer, per byte (revbits) and table driven
+def bench_revbits(mintime):
+    data = bytes(random.Random(1).randbytes(1 << 20))
+    out = bytearray(len(data))
+    revbits = dsdlib.revbits
+    small = data[0:1 << 16]
+
+    def run_loop():
+        for i in range(0, len(small)):
+            out[i] = revbits(small[i])
+
+    def run_table():
+        dsdlib.revbytes(data, out)
+
+    results = {}
+    results['revbits'] = { 'mbps' : len(small) / bench(run_loop, mintime) / 1e6 }
+    results['revbytes'] = { 'mbps' : len(data) / bench(run_table, mintime) / 1e6 }
+    return results
+
+# rtfresult
+# Result dict for nr of DSD data bytes converted in elapsed seconds
+def rtfresult(size, info, elapsed):
+    seconds = size * 8 / info.channels / info.rate
+    return { 'mbps' : size / elapsed / 1e6, 'rtf' : seconds / elapsed }
+
+# The playdsd.py DSF converters, per period (dsfblocks, to DSD_U32_BE and
+# DSD_U32_LE) and for stereo also per DSF block (dsfxmos, as playdsd.py used
+# to do it)
+def bench_dsf(info, data, mintime):
+    out = bytearray(len(data))
+    channels = info.channels
+    group = info.blocksize * channels
+    periodsize = playdsd.periodframes(info.rate)
+    nblocks = periodsize * 4 // info.blocksize
+    src = memoryview(data)
+
+    def run_blocks():
+        for pos in range(0, len(data), 8192):
+            playdsd.dsfxmos(8192, data[pos:pos + 8192], out, info.lsbfirst)
+
+    def run_periods(le=False):
+        for pos in range(0, len(data), nblocks * group):
+            playdsd.dsfblocks(src[pos:pos + nblocks * group], out, info.lsbfirst,
+                              info.blocksize, 0, channels, info.blocksize, 4, le)
+
+    results = {}
+    if channels == 2:
+        results['dsfxmos'] = rtfresult(len(data), info, bench(run_blocks, mintime))
+    results['dsfblocks'] = rtfresult(len(data), info, bench(run_periods, mintime))
+    results['dsfblocks-u32le'] = rtfresult(len(data), info,
+                                           bench(lambda: run_periods(True), mintime))
+    return results
+
+# The playdsd.py DSDIFF converters (to DSD_U32_BE and DSD_U16_LE) and DoP
+# packer, per period
+def bench_dsdiff(info, data, mintime):
+    channels = info.channels
+    frame = 4 * channels
+    periodsize = playdsd.periodframes(info.rate)
+    size = periodsize * frame
+    out = bytearray(size)
+    scratch = bytearray(size)
+    dop = bytearray(size * 2)
+    playdsd.dopmarkers(dop, channels, 4)
+    src = memoryview(data)
+    frames = bytearray((len(data) + frame - 1) // frame * frame)
+    playdsd.dsdxmos(len(data), data, frames, None, channels)
+    u32 = memoryview(frames)
+
+    def run_xmos():
+        for pos in range(0, len(data), size):
+            chunk = src[pos:pos + size]
+            playdsd.dsdxmos(len(chunk), chunk, out, scratch, channels)
+
+    def run_pack():
+        for pos in range(0, len(data), size):
+            chunk = src[pos:pos + size]
+            playdsd.dsdiffpack(len(chunk), chunk, out, channels, 2, True)
+
+    def run_dop():
+        for pos in range(0, len(frames), size):
+            playdsd.doppack(u32[pos:pos + size], min(size, len(frames) - pos), dop,
+                            channels, 4)
+
+    return {
+        'dsdxmos' : rtfresult(len(data), info, bench(run_xmos, mintime)),
+        'dsdiffpack-u16le' : rtfresult(len(data), info, bench(run_pack, mintime)),
+        'doppack' : rtfresult(len(data), info, bench(run_dop, mintime))
+    }
+
+# The whole playdsd.py pipeline (file check, reader and writer threads,
+# conversion to the native DSD format picked for the file) to the null output
+def bench_pipeline(filename, info, mintime):
+    output = playdsd.dsdoutput('null')
+    formats = set(playdsd.dsdformats)
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            playlist = playdsd.dsdplaylist([filename])
+            playdsd.playtracks('', playlist, playlist.pop(), 0, 500,
+                               playdsd.dsdstats(), formats, output)
+
+    return rtfresult(info.datasize, info, bench(run, mintime))
+
+# DSD to PCM conversion with dsdpcm, to 88.2 or 96 kHz
+def bench_pcm(filename, info, mintime):
+    base = 48000 if info.rate % 48000 == 0 else 44100
+    with dsdlib.dsdmap(filename, info, dsdlib.mapsize(info)) as dsd:
+        chunks = list(dsdlib.dsdchannels(dsd, info, info.rate // 8 // 10))
+    pcm = dsdlib.dsdpcm(info.rate, base * 2, info.channels)
+
+    def run():
+        for chans in chunks:
+            pcm.convert(chans)
+
+    size = sum(chans.size for chans in chunks)
+    return rtfresult(size, info, bench(run, mintime))
+
+# runbench
+# Run all benchmarks on the corpus
+# Returns: dict with the results per benchmark name
+def runbench(corpus, mintime):
+    results = {}
+    for dsdtype in ('dsf', 'dsdiff'):
+        results['parse/' + dsdtype] = bench_parse(corpus, dsdtype, mintime)
+    results.update(bench_revbits(mintime))
+
+    for filename, dsdtype, rate, channels, id3 in corpus:
+        if id3:
+            continue
+        name = ratename(rate)
+        info, data = readdata(filename)
+        if playdsd is not None:
+            if dsdtype == 'dsf':
+                found = bench_dsf(info, data, mintime)
+            else:
+                found = bench_dsdiff(info, data, mintime)
+            # Stereo results have no channel suffix
+            suffix = "" if channels == 2 else "-%dch" % channels
+            for engine in found:
+                results["%s%s/%s" % (engine, suffix, name)] = found[engine]
+            if channels == 2:
+                results["pipeline-%s/%s" % (dsdtype, name)] = bench_pipeline(filename, info,
+                                                                            mintime)
+        if dsdlib.numpy is not None:
+            engine = "dsdpcm-%s-%dch" % (dsdtype, channels)
+            results["%s/%s" % (engine, name)] = bench_pcm(filename, info, mintime)
+
+    return results
+
+# score
+# The figure of merit of a result, higher is better
+def score(result):
+    if 'mbps' in result:
+        return result['mbps']
+    return result['files_per_s']
+
+# compare
+# Compare results against a baseline
+# Returns: nr of results that are more than threshold % slower
+def compare(results, baseline, threshold):
+    regressions = 0
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        old = score(baseline[name])
+        new = score(results[name])
+        change = (new - old) / old * 100.0
+        if change < -threshold:
+            print("REGRESSION %-28s %10.2f -> %10.2f (%+.1f%%)" % (name, old, new, change))
+            regressions += 1
+    return regressions
+
+def commitid():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def usage(errstring):
+    if errstring != "":
+        print(errstring)
+    print("\nUsage:\n")
+    print("\tdsd-bench.py [-s <seconds>] [-t <min time>] [-d <corpus dir>]")
+    print("\t             [-o <results.json>] [-c <baseline.json>] [-r <percent>]")
+    print("\n\t-s\tseconds of audio per corpus file (default 0.1)")
+    print("\t-t\tminimum time per benchmark in seconds (default 0.2)")
+    print("\t-d\tkeep the corpus in this directory (default: temporary)")
+    print("\t-o\twrite the results as JSON")
+    print("\t-c\tcompare against earlier JSON results, exit 1 on regressions")
+    print("\t-r\tslowdown in percent counted as regression (default 10)\n")
+
+#-- Main
+if __name__ == "__main__":
+    seconds = 0.1
+    mintime = 0.2
+    corpusdir = None
+    outfile = None
+    basefile = None
+    threshold = 10.0
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hs:t:d:o:c:r:")
+    except getopt.GetoptError:
+        usage("Wrong arguments given")
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            usage("")
+            sys.exit(1)
+        elif opt == '-s':
+            seconds = float(arg)
+        elif opt == '-t':
+            mintime = float(arg)
+        elif opt == '-d':
+            corpusdir = arg
+        elif opt == '-o':
+            outfile = arg
+        elif opt == '-c':
+            basefile = arg
+        elif opt == '-r':
+            threshold = float(arg)
+
+    dsdlib.debug = False
+    if playdsd is None:
+        print("playdsd.py cannot be loaded, skipping the playback converters")
+    if dsdlib.numpy is None:
+        print("NumPy not available, skipping DSD to PCM conversion")
+
+    tmpdir = None
+    if corpusdir is None:
+        tmpdir = tempfile.mkdtemp(prefix="dsd-bench-")
+        corpusdir = tmpdir
+    else:
+        os.makedirs(corpusdir, exist_ok=True)
+
+    try:
+        start = time.time()
+        corpus = makecorpus(corpusdir, seconds)
+        print("Corpus: %d files in %.1f s" % (len(corpus), time.time() - start))
+        results = runbench(corpus, mintime)
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
+
+    print("\n%-28s %12s %12s" % ("Benchmark", "MB/s", "x realtime"))
+    for name in sorted(results):
+        result = results[name]
+        if 'files_per_s' in result:
+            print("%-28s %12.0f files/s" % (name, result['files_per_s']))
+        elif 'rtf' in result:
+            print("%-28s %12.2f %12.1f" % (name, result['mbps'], result['rtf']))
+        else:
+            print("%-28s %12.2f" % (name, result['mbps']))
+
+    if outfile is not None:
+        report = {
+            'commit' : commitid(),
+            'python' : platform.python_version(),
+            'numpy' : dsdlib.numpy.__version__ if dsdlib.numpy is not None else None,
+            'seconds' : seconds,
+            'results' : results
+        }
+        with open(outfile, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+
+    if basefile is not None:
+        with open(basefile, 'r') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, threshold)
+        print("\n%d regressions (threshold %.0f%%)" % (regressions, threshold))
+        if regressions:
+            sys.exit(1)
+
+    sys.exit(0)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+# dsd-split.py
+# Split DSDIFF edited masters into tracks at their markers, or extract
+# clips by time, as DSDIFF or DSF files
+# DSDIFF output is copied by the kernel (copy_file_range/sendfile)
+# Uses dsdlib.py
+# License: GPLv2
+#
+# v0.1 18-Oct-2026
+# Initial version
+
+import getopt
+import os
+import sys
+import time
+
+import dsdlib
+
+def usage(errstring):
+    if errstring != "":
+        print(errstring)
+    print("\nUsage:\n")
+    print("\tdsd-split.py [-l] [-F dff|dsf] [-d <directory>] [-t <start>-<end>] ... [-j <workers>] <DSDIFF file>")
+    print("\n\t-l: list the tracks only")
+    print("\t-F: output format, default dff")
+    print("\t-d: output directory, default the current directory")
+    print("\t-t: extract a clip instead of the tracks, times as [[hh:]mm:]ss[.fff],")
+    print("\t    an empty end is the end of the file")
+    print("\t-j: nr of worker processes for DSF output\n")
+
+# Output file name for a track
+def trackname(directory, nr, text, ext):
+    text = "".join(c if c.isprintable() and c not in '/\\' else '_' for c in text).strip()
+    if text == "":
+        return os.path.join(directory, "%02d.%s" % (nr, ext))
+    return os.path.join(directory, "%02d - %s.%s" % (nr, text, ext))
+
+#-- Main
+if __name__ == "__main__":
+    outtype = 'dsdiff'
+    directory = "."
+    clips = []
+    listonly = False
+    workers = 1
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hlF:d:t:j:")
+    except getopt.GetoptError:
+        usage("Wrong arguments given")
+        sys.exit(2)
+
+    try:
+        for opt, arg in opts:
+            if opt == '-h':
+                usage("")
+                sys.exit(1)
+            elif opt == '-l':
+                listonly = True
+            elif opt == '-F':
+                if arg.lower() not in ('dff', 'dsf'):
+                    usage("Unknown output format '%s'" % arg)
+                    sys.exit(2)
+                outtype = 'dsf' if arg.lower() == 'dsf' else 'dsdiff'
+            elif opt == '-d':
+                directory = arg
+            elif opt == '-t':
+                start, sep, end = arg.partition('-')
+                clips.append((dsdlib.parsetime(start or "0"),
+                              dsdlib.parsetime(end) if end else None))
+            elif opt == '-j':
+                workers = int(arg)
+    except ValueError:
+        usage("Wrong time or number given")
+        sys.exit(2)
+
+    if len(args) != 1:
+        usage("Missing DSDIFF file")
+        sys.exit(2)
+    filename = args[0]
+
+    info, reason = dsdlib.quietcheck(filename)
+    if info.valid != 1 or info.type != b'dsdiff' or info.compress:
+        print("'%s' is not an uncompressed DSDIFF file %s" % (filename, reason))
+        sys.exit(1)
+
+    ext = 'dsf' if outtype == 'dsf' else 'dff'
+    if clips:
+        base = os.path.splitext(os.path.basename(filename))[0]
+        tracks = []
+        for nr, (start, end) in enumerate(clips, 1):
+            end = info.samples if end is None else int(round(end * info.rate))
+            tracks.append((int(round(start * info.rate)), end, "",
+                           os.path.join(directory, "%s-clip%02d.%s" % (base, nr, ext))))
+    else:
+        tracks = [(start, end, text, trackname(directory, nr, text, ext))
+                  for nr, (start, end, text) in
+                  enumerate(dsdlib.dsdifftracks(filename, info), 1)]
+        if not tracks:
+            print("'%s' has no markers, use -t to extract clips" % filename)
+            sys.exit(1)
+
+    total = 0
+    begin = time.perf_counter()
+    for start, end, text, outfile in tracks:
+        print("%-40s: %10.3f - %10.3f s" % (os.path.basename(outfile),
+                                             start / info.rate, end / info.rate))
+        if listonly:
+            continue
+        try:
+            total += dsdlib.extract(filename, outfile, start, end, outtype, text,
+                                    workers, info=info)
+        except (OSError, ValueError) as e:
+            print("Cannot write '%s': %s" % (outfile, e))
+            sys.exit(1)
+
+    if not listonly:
+        elapsed = time.perf_counter() - begin
+        print("Wrote %d files, %d bytes of DSD data in %.2f s (%.0f MB/s)" %
+              (len(tracks), total, elapsed, total / max(elapsed, 1e-9) / 1e6))
+    sys.exit(0)
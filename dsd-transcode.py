@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+# dsd-transcode.py
+# Lossless conversion of DSF files to DSDIFF and of DSDIFF files to DSF
+# Uses dsdlib.py
+# License: GPLv2
+#
+# v0.1 18-Oct-2026
+# Initial version
+
+import getopt
+import sys
+import time
+
+import dsdlib
+
+def usage(errstring):
+    if errstring != "":
+        print(errstring)
+    print("\nUsage:\n")
+    print("\tdsd-transcode.py [-j <workers>] [-s <segment MB>] <input file> <output file>")
+    print("\n\tConverts a DSF file to DSDIFF (.dff) or a DSDIFF file to DSF (.dsf),")
+    print("\tthe ID3v2 tag is carried over\n")
+
+#-- Main
+if __name__ == "__main__":
+    workers = None
+    segsize = 16
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hj:s:", ["jobs=", "segment="])
+    except getopt.GetoptError:
+        usage("Wrong arguments given")
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            usage("")
+            sys.exit(1)
+        elif opt in ("-j", "--jobs"):
+            workers = int(arg)
+        elif opt in ("-s", "--segment"):
+            segsize = int(arg)
+
+    if len(args) != 2:
+        usage("Missing input or output file")
+        sys.exit(2)
+
+    outtype = None
+    if args[1].lower().endswith('.dsf'):
+        outtype = 'dsf'
+    elif args[1].lower().endswith('.dff'):
+        outtype = 'dsdiff'
+
+    start = time.perf_counter()
+    try:
+        size = dsdlib.transcode(args[0], args[1], outtype, workers, segsize << 20)
+    except (OSError, ValueError) as e:
+        print("Cannot convert '%s': %s" % (args[0], e))
+        sys.exit(1)
+    elapsed = time.perf_counter() - start
+
+    print("Converted %d bytes of DSD data in %.2f s (%.0f MB/s)" %
+          (size, elapsed, size / max(elapsed, 1e-9) / 1e6))
+    sys.exit(0)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+# dsd-validate.py
+# Validate whole DSD (DSF and DSDIFF) libraries using multiple processes
+# Prints one JSON line per file while the scan runs
+# Uses dsdlib.py
+# License: GPLv2
+#
+# v0.1 18-Oct-2026
+# Initial version
+
+import getopt
+import sys
+
+import dsdlib
+
+def usage(errstring):
+    if errstring != "":
+        print(errstring)
+    print("\nUsage:\n")
+    print("\tdsd-validate.py [-j <workers>] [-c <chunk size>] <file or directory> ...")
+    print("\n\tPrints a JSON line per file with the fields path, type, valid,")
+    print("\tconfidence, reason and mpdhang\n")
+
+#-- Main
+if __name__ == "__main__":
+    workers = None
+    chunksize = 32
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hj:c:", ["jobs=", "chunk="])
+    except getopt.GetoptError:
+        usage("Wrong arguments given")
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            usage("")
+            sys.exit(1)
+        elif opt in ("-j", "--jobs"):
+            workers = int(arg)
+        elif opt in ("-c", "--chunk"):
+            chunksize = int(arg)
+
+    if len(args) == 0:
+        usage("Missing files or directories to validate")
+        sys.exit(2)
+
+    results = dsdlib.validate_files(dsdlib.finddsdfiles(args), workers, chunksize)
+    files, bad = dsdlib.writeinfo(results, 'json')
+
+    print("Validated %d files, %d not valid" % (files, bad), file=sys.stderr)
+    sys.exit(1 if bad else 0)
@@ -3,7 +3,7 @@
 # dsdiff-check-all-chunks.py
 # Test DSDIFF DSD files (.dff) loop through all chunks
 # prints out all DSDIFF chunk data structure info
-# Standalone version, does not use dsdlib.py
+# Uses dsdlib.py
 # (c) 2014 Jurgen Kramer
 # License: GPLv2
 #
@@ -25,322 +25,177 @@
 # - Use dictionary for rate to text conversion
 # v0.7 24-Feb-24 Jurgen Kramer
 # - Update for Python3
-
-import struct
+# v0.8 18-Oct-2026
+# - Use the dsdlib.py parser instead of a copy of it
+# - Bulk mode: many files or directories, JSON lines or CSV output, continues
+#   past bad files, optional pool of worker processes
+# - List all chunks and sub chunks (dsdlib.dsdifftree)
+# - Show the fields and pictures of an unofficial ID3v2 tag
+
+import getopt
 import sys
 
-# Form DSD Chunk
-struct_frm8_fmt = '>4s1Q4s'
-struct_frm8_len = struct.calcsize(struct_frm8_fmt)
-struct_unpack_frm8 = struct.Struct(struct_frm8_fmt).unpack_from
-
-# Format Version Chunk
-struct_fver_fmt = '>1L'
-struct_fver_len = struct.calcsize(struct_fver_fmt)
-struct_unpack_fver = struct.Struct(struct_fver_fmt).unpack_from
-
-# Property Chunk
-struct_prop_fmt = '>4s'
-struct_prop_len = struct.calcsize(struct_prop_fmt)
-struct_unpack_prop = struct.Struct(struct_prop_fmt).unpack_from
-
-# Sample Rate Chunk
-struct_rate_fmt = '>1L'
-struct_rate_len = struct.calcsize(struct_rate_fmt)
-struct_unpack_rate = struct.Struct(struct_rate_fmt).unpack_from
-
-# Channels Chunk
-struct_chan_fmt = '>1H'
-struct_chan_len = struct.calcsize(struct_chan_fmt)
-struct_unpack_chan = struct.Struct(struct_chan_fmt).unpack_from
-
-# Channel descriptions
-struct_chandes_fmt = '>4s'
-struct_chandes_len = struct.calcsize(struct_chandes_fmt)
-struct_unpack_chandes = struct.Struct(struct_chandes_fmt).unpack_from
-
-# Compression Type Chunk
-struct_cmp_fmt = '>4s1B'
-struct_cmp_len = struct.calcsize(struct_cmp_fmt)
-struct_unpack_cmp = struct.Struct(struct_cmp_fmt).unpack_from
-
-# Compression name
-struct_cmpstr_fmt = '>1s'
-struct_cmpstr_len = struct.calcsize(struct_cmpstr_fmt)
-struct_unpack_cmpstr = struct.Struct(struct_cmpstr_fmt).unpack_from
-
-# Absolute Start Time Chunk
-struct_abbs_fmt = '>1H1B1B1L'
-struct_abbs_len = struct.calcsize(struct_abbs_fmt)
-struct_unpack_abbs = struct.Struct(struct_abbs_fmt).unpack_from
-
-# Loudspeaker Configuration Chunk
-struct_spkr_fmt = '>1H'
-struct_spkr_len = struct.calcsize(struct_spkr_fmt)
-struct_unpack_spkr = struct.Struct(struct_spkr_fmt).unpack_from
-
-# DSD Sound Data Chunk
-struct_dsd_fmt = '>4s1Q'
-struct_dsd_len = struct.calcsize(struct_dsd_fmt)
-struct_unpack_dsd = struct.Struct(struct_dsd_fmt).unpack_from
-
-# Basis chunk, ID + chunk_size only
-struct_dsd_chunk = '>4s1Q'
-struct_dsd_chunk_len = struct.calcsize(struct_dsd_chunk)
-struct_unpack_dsd_chunk = struct.Struct(struct_dsd_chunk).unpack_from
-
-dsd_rate_to_text = {
-    2822400 : "DSD64",
-    5644800 : "DSD128",
-    11289600 : "DSD256",
-    22579200 : "DSD512",
-    3072000 : "DSD64,",
-    6144000 : "DSD128",
-    12288000 : "DSD256",
-    24576000 : "DSD512"
-    }
-
+import dsdlib
 
 #-- Functions
-def wrongfile(marker):
-    print("Not a DSDIFF file! Error at '%s' marker" % marker)
-    sys.exit(1)
-
-# Handle local chunks of property chunk
-def handle_prop_local_chunks(size):
-    ret = 0
-    curpos = f.tell()
-    maxpos = curpos + size
-    #print "Property local chunks, total size is %d , cur pos = %d" % (size, curpos)
-    props = []
-    propdata = f.read(struct_prop_len)
-    s = struct_unpack_prop(propdata)
-    props.append(s)
-    chunk_id = props[0][0].decode("UTF-8")  # Should be 'SND '
-    if chunk_id == 'SND ':
-
-        while curpos < maxpos:
-            # Read next chunk ID + chunk size
-            propdata = f.read(struct_dsd_len)
-            s = struct_unpack_dsd_chunk(propdata)
-            props.append(s)
-
-            chunk_id = props[1][0].decode("UTF-8")
-            chunk_size = props[1][1]
-
-            # Sample Rate Chunk
-            if chunk_id == 'FS  ':
-                print("Sample Rate Chunk")
-                props = []
-                propdata = f.read(struct_rate_len)
-                s = struct_unpack_rate(propdata)
-                props.append(s)
-                rate = props[0][0]
-                if rate in dsd_rate_to_text:
-                    print("Sample rate: %s Hz [%s]" %(rate,dsd_rate_to_text[rate]))
-                else:
-                    print("Sample rate: %d Hz" % rate)
-                ret += 1
-                curpos = f.tell()
-                continue
-
-            # Channels Chunk
-            if chunk_id == 'CHNL':
-                print("Channels Chunk")
-                props = []
-                propdata = f.read(struct_chan_len)
-                s = struct_unpack_chan(propdata)
-                props.append(s)
-                channels = props[0][0]
-                print( "File has %d channels" % channels)
-                for i in range(0, channels):
-                    props = []
-                    propdata = f.read(struct_chandes_len)
-                    s = struct_unpack_chandes(propdata)
-                    props.append(s)
-                    chandes = props[0][0]
-                    print("Channel: %s" % chandes)
-                ret += 1
-                curpos = f.tell()
-                continue
-
-            # Compression Type Chunk
-            if chunk_id == 'CMPR':
-                print("Compression Type Chunk")
-                props = []
-                propdata = f.read(struct_cmp_len)
-                s = struct_unpack_cmp(propdata)
-                props.append(s)
-                cmptype = props[0][0]
-                cmplen = props[0][1]
-                compressed = "Not compressed"
-                if cmptype != 'DSD ':
-                    compressed = " Compressed"
-                print("Compression type: '%s' (%s)" % (cmptype, compressed))
-                print("Compression string length: %d" % cmplen)
-                for i in range(0, cmplen+1):
-                    propdata = f.read(struct_cmpstr_len)
-                    s = struct_unpack_cmpstr(propdata)
-                    #print "%s" % s,
-
-                ret += 1
-                curpos = f.tell()
-                #print "POS is %d" % curpos
-                continue
-
-            if chunk_id == 'ABSS':                # Optional
-                print("Absolute Start Time Chunk")
-                print("Size %d" % chunk_size)
-                props = []
-                propdata = f.read(struct_abbs_len)
-                s = struct_unpack_abbs(propdata)
-                props.append(s)
-                hrs = props[0][0]
-                mins = props[0][1]
-                secs = props[0][2]
-                samples = props[0][3]
-                print("Offset: %d hrs, %d mins, %d secs and %d samples " %(hrs, mins, secs, samples))
-
-                curpos = f.tell()
-                continue
-
-            if chunk_id == 'LSCO':                # Optional
-                print("Loudspeaker Configuration Chunk")
-                if chunk_size != 2:
-                    print("Illegal chunk size %d" % chunk_size)
-                    ret = -1
-                    return ret
-
-                props = []
-                propdata = f.read(struct_spkr_len)
-                s = struct_unpack_spkr(propdata)
-                props.append(s)
-                spkrcfg = props[0][0]
-                print("Speaker config is: %d" % spkrcfg)
-                curpos = f.tell()
-                continue
-
-        return ret
-
+def usage(errstring):
+    if errstring != "":
+        print(errstring)
+    print("\nUsage:\n")
+    print("\tdsdiff-info.py [-j <workers>] [--json|--csv] <file or directory> ...")
+    print("\n\tWithout --json or --csv the info is printed as text\n")
+
+# Short text for the decoded data of a chunk
+def chunkvalue(node):
+    value = node.value
+    if value is None:
+        return ""
+    if node.id == 'FVER':
+        return "0x%06x" % value
+    if node.id == 'CHNL':
+        return " ".join(value)
+    if node.id == 'CMPR':
+        return "'%s' %s" % value
+    if node.id == 'ABSS':
+        return "%d:%02d:%02d + %d samples" % value
+    if node.id == 'MARK':
+        return "%d:%02d:%02d + %d samples, type %d, '%s'" % (value[0:4] + (value[5], value[8]))
+    if node.id == 'COMT':
+        return "%d comments" % len(value)
+    if node.id == 'FRTE':
+        return "%d frames, %d frames/s" % value
+    if node.id == 'DSTI':
+        return "%d index entries" % len(value)
+    if node.id == 'ID3 ':
+        return ""
+    return str(value)
+
+# Print all chunks and sub chunks of a DSDIFF file
+def printchunks(filename):
+    try:
+        tree = dsdlib.dsdifftree(filename)
+    except OSError as e:
+        print("Cannot read chunks: %s" % e)
+        return
+
+    print("\n%-24s: offset, size" % "Chunks")
+    for depth, node in tree.walk():
+        name = "'%s'" % node.id
+        if node.kind != '':
+            name += " '%s'" % node.kind
+        line = "%-24s: %d, %d" % ("  " * depth + name, node.offset, node.size)
+        value = chunkvalue(node)
+        if value != "":
+            line += " [%s]" % value
+        print(line)
+
+# Print the common ID3v2 fields and the pictures of a file
+def printtags(filename):
+    try:
+        tag = dsdlib.readid3(filename)
+    except OSError as e:
+        print("Cannot read ID3 tag: %s" % e)
+        return
+    if tag is None:
+        return
+    with tag:
+        print("\n%-24s: 2.%d" % ("ID3 tag version", tag.version))
+        tags = tag.tags()
+    for name, value in tags.items():
+        if name != 'pictures':
+            print("%-24s: %s" % (name.capitalize(), value))
+    for picture in tags['pictures']:
+        print("%-24s: %s, type %d, %d bytes" % ("Picture", picture['mime'], picture['type'], picture['length']))
+
+# Print the info of a single file
+def printinfo(info):
+    print("\nResults for file\t: %s\n" % info['path'])
+
+    if info['type'] != 'dsdiff':
+        if info['type'] == 'dsf':
+            print("Not a DSDIFF file! This is a DSF file, use dsf-info.py")
+        else:
+            print("Not a DSDIFF file! %s" % info['reason'])
+        return
+
+    if info['fsize'] != 0:
+        print("Total file size\t\t: %d" % info['fsize'])
+    if info['version'] != 0:
+        print("Version\t\t\t: 0x%06x" % info['version'])
+    if info['rate'] != 0:
+        print("Sample rate\t\t: %d Hz [%s]" % (info['rate'], info['ratename']))
+    if info['channels'] != 0:
+        print("Channels\t\t: %d" % info['channels'])
+    if info['compress']:
+        print("Compression type\t: 'DST ' (Compressed)")
     else:
-        ret = -1
-        return ret
+        print("Compression type\t: 'DSD ' (Not compressed)")
+    if info['abss'] != 0:
+        print("Absolute start time\t: %d samples" % info['abss'])
+    if info['datastart'] != 0:
+        print("DSD sample data starts at: %d" % info['datastart'])
+        print("DSD sample data size\t: %d" % info['datasize'])
+    if info['samples'] != 0:
+        print("Duration\t\t: %.3f s" % info['seconds'])
+    printchunks(info['path'])
+    if info['id3tag'] != 0:
+        printtags(info['path'])
+
+    print("\nConclusion\t\t: ", end='')
+    if not info['valid']:
+        print(">>This is not a properly DSDIFF formatted file<<")
+        print("\t\t\t  %s, confedence = %d, needs to be 4" % (info['reason'], info['confidence']))
+        return
+
+    if info['id3tag'] == 0:
+        print("This is a properly formatted DSDIFF file")
+    else:
+        print("This is a properly formatted DSDIFF file with unofficial ID3 tag")
+    if info['mpdhang']:
+        print("Warning\t\t\t: !!This file could hang MPD at the end of the song!!")
 
 
 #-- Main
 if __name__ == "__main__":
+    workers = 1
+    fmt = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hj:", ["jobs=", "json", "csv"])
+    except getopt.GetoptError:
+        usage("Wrong arguments given")
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            usage("")
+            sys.exit(1)
+        elif opt in ("-j", "--jobs"):
+            workers = int(arg)
+        elif opt == "--json":
+            fmt = 'json'
+        elif opt == "--csv":
+            fmt = 'csv'
+
     # Check command line arguments
-    if len(sys.argv) <= 1:
-        print("Missing filename to test on")
+    if len(args) == 0:
+        usage("Missing filename to test on")
         sys.exit(1)
 
-    filename = sys.argv[1]
-
-    print("\nResults for file\t: %s\n" % filename)
-
-    results = []
-    confedence = 0
-    neededconf = 4
-    id3tag = 0
-    could_trigger_mpd_hang = False
-
-
-    with open(filename, "rb") as f:
-
-        # Read header of the file and check for the needed DSDIFF ID's
-        data = f.read(struct_frm8_len)
-        s = struct_unpack_frm8(data)
-        results.append(s)
-        chunk_id = results[0][0].decode("UTF-8")    # Should be 'FRM8'
-        dsd_file_size = results[0][1]
-        dsd_id = results[0][2].decode("UTF-8")      # Should be 'DSD '
-
-        if chunk_id != 'FRM8':
-            wrongfile('FRM8')
-
-        if dsd_id != 'DSD ':
-            wrongfile('DSD ')
-
-        confedence += 1
-
-        print("Found start chunk\t: '%s'" % chunk_id)
-        print("Total file size\t\t: %d" % dsd_file_size)
-
-        print("\nFile pos now at\t\t: %d" % f.tell())
-
-        # Loop through all the remaining chunks
-        while True:
-            results = []
-            data = f.read(struct_dsd_chunk_len)
-            if not data: break
-            s = struct_unpack_dsd_chunk(data)
-            results.append(s)
-            chunk_id = results[0][0].decode("UTF-8")
-            chunk_size = results[0][1]
-
-            print("Found chunk with id\t: '%s'" % chunk_id)
-            print("Chunk size\t\t: %d" % chunk_size)
-
-            if chunk_id == 'FVER':
-                results = []
-                data = f.read(struct_fver_len)
-                s = struct_unpack_fver(data)
-                results.append(s)
-                version = results[0][0]
-                #print "FVER: version 0x%06x " % version
-                if version != 0x1050000 and version != 0x1040000:
-                    print("Illegal/unsupported version 0x%06x" % version)
-                    break
-                confedence += 1
-
-                pos = f.tell()
-                seekpos = pos
-                #print "POS is: %d" % pos
-                continue
-
-            if chunk_id == 'DSD ' or chunk_id == 'DST ':
-                print("DSD sample data starts at: %d" % f.tell() )
-                confedence += 1
-                # Test if this file can trigger MPD hang bug
-                if chunk_id == 'DSD ' and chunk_size % 4 != 0:
-                    could_trigger_mpd_hang = True
-
-            if chunk_id == 'PROP':
-                ret = handle_prop_local_chunks(chunk_size)
-                if ret == -1:
-                    print("Problems with property chunk")
-                    break
-                if ret != 3:
-                    print("Missing required local chunks in property chunk")
-                    break
-
-                confedence += 1
-                pos = f.tell()
-                seekpos = pos
-            else:
-                # Seek to next chunk
-                pos = f.tell()
-                seekpos = pos + chunk_size
-                # Check if this was the last chunk
-                if seekpos > dsd_file_size:
-                    break
-            f.seek(seekpos)
-            print("\nFile pos now at\t\t: %d" % f.tell())
-
-
-        f.close()
-        print("\nConclusion\t\t: ", end='')
-        if confedence < neededconf:
-            print(">>This is not a properly DSDIFF formatted file<<")
-            print("\t\t\t\tConfedence = %d, needs to be %d" % (confedence, neededconf))
-        else:
-            if id3tag == 0:
-                print("This is a properly formatted DSDIFF file")
-            else:
-                print("This is a properly formatted DSDIFF file with unofficial ID3 tag")
-            if could_trigger_mpd_hang:
-                print("Warning\t\t\t: !!This file could hang MPD at the end of the song!!")
+    results = dsdlib.checkfiles(dsdlib.fileinfo, dsdlib.finddsdfiles(args, ('.dff',)), workers)
 
+    if fmt is not None:
+        files, bad = dsdlib.writeinfo(results, fmt, ftype='dsdiff')
+    else:
+        files = 0
+        bad = 0
+        for info in results:
+            files += 1
+            if not dsdlib.infook(info, 'dsdiff'):
+                bad += 1
+            printinfo(info)
         print("")
-        sys.exit(0)
 
+    if files > 1:
+        print("Checked %d files, %d not valid" % (files, bad), file=sys.stderr)
+    sys.exit(1 if bad else 0)
@@ -24,11 +24,44 @@
 # Updates and fixes for Python3
 # Fix 'dsf_data' data packing
 # Convert tabs to spaces to conform to playdsd.py
-
+# v0.8 18-Oct-2026
+# Table driven bit reversal shared by playback and conversion code
+# Memory mapped DSD data reader
+# Optional in place bit reversal using NumPy
+# Incremental SQLite library index, debug output can be switched off
+# Parallel batch validation with failure reasons
+# Parse headers from a single read of the file head (dsdprobe)
+# DSD to PCM conversion using NumPy
+# Seek map (dsdseek) and DSDIFF marker (MARK/ABSS) positions
+# DSF and DSDIFF header writers
+# dsdmap.readinto() for DSD data that is played as is
+# fileinfo() and JSON/CSV output for bulk runs of the info scripts
+# Lazy DSDIFF chunk tree with all sub chunks (dsdifftree)
+# ID3v2 tag reader (readid3) with a tag cache
+# In place DSF tag writer (writeid3, settags) with a journal
+# Parallel DSF <-> DSDIFF transcoder
+# Track splitting and clip extraction of DSDIFF masters (dsdifftracks, extract)
+
+import csv
+import errno
+import mmap
+import concurrent.futures
+import json
+import os
+import sqlite3
 import struct
 import sys
+import threading
+import zlib
 from ctypes import *
 
+# NumPy is optional, it allows in place conversions without allocating
+# temporary buffers
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 dsdiff_data = {
     'basic' : '>4s',
     'frm8' : '>4s1Q4s',
@@ -40,6 +73,7 @@ dsdiff_data = {
     'cmp' : '>4s1B',
     'cmpstr' : '>1s',
     'abbs' : '>1H1B1B1L',
+    'mark' : '>1H1B1B1L1l1H1H1H1L',
     'spkr' : '>1H',
     'data' : '>4s1Q',
     'dsd_chunk' : '>4s1Q'
@@ -67,6 +101,25 @@ for x in dsf_data:
     dsf_length[x] = struct.calcsize(dsf_data[x])
     dsf_unpacked[x] = struct.Struct(dsf_data[x]).unpack_from
 
+# DSF channel type for a nr of channels, the layout used when a file has
+# none that DSF knows
+dsf_chantype = { 1 : 1, 2 : 2, 3 : 3, 4 : 4, 5 : 6, 6 : 7 }
+
+# DSDIFF channel ID's for a DSF channel type, both formats store the
+# channels in this order
+dsdiff_chanids = {
+    1 : ['C   '],
+    2 : ['SLFT', 'SRGT'],
+    3 : ['MLFT', 'MRGT', 'C   '],
+    4 : ['MLFT', 'MRGT', 'LS  ', 'RS  '],
+    5 : ['MLFT', 'MRGT', 'C   ', 'LFE '],
+    6 : ['MLFT', 'MRGT', 'C   ', 'LS  ', 'RS  '],
+    7 : ['MLFT', 'MRGT', 'C   ', 'LFE ', 'LS  ', 'RS  ']
+}
+
+# DSF channel type for DSDIFF channel ID's
+dsf_chantypes = dict((tuple(ids), chantype) for chantype, ids in dsdiff_chanids.items())
+
 # dsdfile, store useful info of a DSD file
 #
 # dsdinfo.type          - "dsdiff" or "dsf"
@@ -82,6 +135,12 @@ for x in dsf_data:
 # dsdfile.id3len        -
 # dsdfile.lsbfirst      - 1 = LSB first, bit reverse needed
 # dsdfile.curpos        -
+# dsdfile.reason        - why the file is not valid, empty for a valid file
+# dsdfile.blocksize     - bytes per channel per block, 4096 for DSF, 1 for DSDIFF
+# dsdfile.samples       - nr of DSD samples per channel
+# dsdfile.abss          - DSDIFF absolute start time (ABSS) in samples
+# dsdfile.chantype      - channel layout as DSF channel type, for DSDIFF the
+#                         one of the CHNL channel ID's, 0 if DSF has none
 
 class dsdfile(Structure):
     _fields_ = [
@@ -98,44 +157,164 @@ class dsdfile(Structure):
             ('id3tag', c_longlong),
             ('id3len', c_longlong),
             ('lsbfirst', c_ushort,),
-            ('curpos', c_longlong)
+            ('curpos', c_longlong),
+            ('reason', 48*c_char),
+            ('blocksize', c_ulong),
+            ('samples', c_ulonglong),
+            ('abss', c_ulonglong),
+            ('chantype', c_byte)
         ]
 
+# Print debug messages, set dsdlib.debug = False to silence them, the check
+# functions also take quiet=True to silence a single check
+debug = True
+
 #-- Functions
+def debugprint(msg, quiet=False):
+    if debug and not quiet:
+        print(msg)
+
 def wrongfile(marker):
     print("Not a DSDIFF file! Error at '%s' marker" % marker)
     sys.exit(1)
 
+# invalid
+# Mark the given dsdfile as invalid and store the reason
+# Returns: dsdfile
+def invalid(dsdfile, confedence, reason, quiet=False):
+    dsdfile.valid = 0
+    dsdfile.confedence = confedence
+    dsdfile.reason = reason.encode("UTF-8")[0:47]
+    debugprint("DEBUG: invalid file: %s" % reason, quiet)
+    return dsdfile
+
+# revbits
+# Reverse the bit order of a single byte, LSB first <-> MSB first
+def revbits(x):
+    x = ((x & 0x55) << 1) | ((x & 0xaa) >> 1)
+    x = ((x & 0x33) << 2) | ((x & 0xcc) >> 2)
+    x = ((x & 0x0f) << 4) | ((x & 0xf0) >> 4)
+    return x
+
+# Bit reverse lookup table, for use with translate()
+revtable = bytes(revbits(x) for x in range(256))
+if numpy is not None:
+    nprevtable = numpy.frombuffer(revtable, dtype=numpy.uint8)
+
+# revbytes
+# Reverse the bit order of every byte of the given buffer in one call
+# Input: bytes, bytearray or memoryview, optional output buffer which may be
+# the input buffer itself
+# Returns: bytes (bytearray for bytearray input) or the output buffer
+def revbytes(data, out=None):
+    if out is None:
+        if not isinstance(data, (bytes, bytearray)):
+            data = bytes(data)
+        return data.translate(revtable)
+
+    if numpy is not None:
+        src = numpy.frombuffer(data, dtype=numpy.uint8)
+        dst = numpy.frombuffer(out, dtype=numpy.uint8, count=len(src))
+        # mode 'clip' writes straight into out, no temporary copy
+        numpy.take(nprevtable, src, out=dst, mode='clip')
+    else:
+        # translate() needs bytes, only copy a memoryview first
+        if not isinstance(data, (bytes, bytearray)):
+            data = bytes(data)
+        memoryview(out)[0:len(data)] = data.translate(revtable)
+    return out
+
+# dsdprobe
+# Reads the head of a file with a single positioned read and serves header
+# fields from that buffer with unpack_from. Only data beyond the buffer costs
+# another (positioned) read.
+#
+# dsdprobe.fd           - file descriptor of the probed file
+# dsdprobe.size         - file size
+# dsdprobe.head         - first headsize bytes of the file, a smaller head
+#                         can be given when only the headers are needed
+# dsdprobe.reads        - nr of reads done
+class dsdprobe(object):
+
+    headsize = 65536
+
+    def __init__(self, filename, headsize=0):
+        self.fd = os.open(filename, os.O_RDONLY)
+        try:
+            self.size = os.fstat(self.fd).st_size
+            self.head = os.pread(self.fd, headsize or self.headsize, 0)
+        except OSError:
+            os.close(self.fd)
+            raise
+        self.reads = 1
+
+    # Get size bytes at offset, returns None if the file is too short
+    def get(self, offset, size):
+        if offset + size <= len(self.head):
+            return self.head[offset:offset + size]
+        if offset + size > self.size:
+            return None
+        self.reads += 1
+        return os.pread(self.fd, size, offset)
+
+    # Unpack a DSDIFF (big endian) structure at offset
+    def dsdiff(self, name, offset):
+        if offset + length[name] <= len(self.head):
+            return unpacked[name](self.head, offset)
+        data = self.get(offset, length[name])
+        if data is None:
+            return None
+        return unpacked[name](data)
+
+    # Unpack a DSF (little endian) structure at offset
+    def dsf(self, name, offset):
+        if offset + dsf_length[name] <= len(self.head):
+            return dsf_unpacked[name](self.head, offset)
+        data = self.get(offset, dsf_length[name])
+        if data is None:
+            return None
+        return dsf_unpacked[name](data)
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
 # getfiletype
-def getfiletype(filename, dsdfile):
+def getfiletype(filename, dsdfile, probe=None, quiet=False):
 
     # Mark file as non DSD file by default
     dsdfile.valid = 2
     dsdfile.type = 'none'.encode('UTF-8')
+    dsdfile.reason = b'not a DSD file'
+    dsdfile.confedence = 0
 
-    results = []
-    with open(filename, "rb") as f:
+    if probe is None:
+        with dsdprobe(filename) as probe:
+            return getfiletype(filename, dsdfile, probe, quiet)
 
-        data = f.read(length['basic'])
-        s = unpacked['basic'](data)
-        results.append(s)
-        chunk_id = results[0][0].decode("UTF-8")    # Should be 'FRM8' or 'DSD '
-        print("DEBUG: getfiletype: chunk_id: '%s'" % chunk_id)
-    f.close()
-
-    print("DEBUG: chunk_id: %s - valid: %s" % (chunk_id, dsdfile.valid))
+    results = probe.dsdiff('basic', 0)
+    if results is None:
+        return dsdfile
+    chunk_id = results[0].decode("UTF-8", "replace")    # Should be 'FRM8' or 'DSD '
+    debugprint("DEBUG: getfiletype: chunk_id: '%s'" % chunk_id, quiet)
 
     if chunk_id == 'FRM8':
-        print("DEBUG: marking as dsdiff")
+        debugprint("DEBUG: marking as dsdiff", quiet)
         # Mark file as potential DSDIFF
         dsdfile.valid = 0
         dsdfile.type = 'dsdiff'.encode("UTF-8")
-        print("DEBUG: chunk_id: %s - valid: %s" % (chunk_id, dsdfile.valid))
         return dsdfile
 
     if chunk_id == 'DSD ':
         # Mark file as potential DSF
-        print("DEBUG: marking as DSF")
+        debugprint("DEBUG: marking as DSF", quiet)
         dsdfile.valid = 0
         dsdfile.type = 'dsf'.encode("UTF-8")
         return dsdfile
@@ -229,435 +408,2149 @@ def rate_to_string(rate):
     else:
         return "DSD??"
 
+# chunkid
+# Decode a 4 character chunk ID
+def chunkid(data):
+    return data.decode("latin-1")
+
+# id3size
+# Size of the ID3v2 tag starting at offset, including header and footer
+# Returns: 0 if there is no ID3v2 tag at offset
+def id3size(probe, offset):
+    hdr = probe.get(offset, 10)
+    if hdr is None or hdr[0:3] != b'ID3':
+        return 0
+    size = 0
+    for x in hdr[6:10]:
+        size = (size << 7) | (x & 0x7f)
+    if hdr[5] & 0x10:
+        size += 10      # Footer present
+    return size + 10
+
 # DSDIFF Handle local chunks of property chunk
-def handle_prop_local_chunks(size, handle, dsdfile):
+# Input: size of the property chunk, probe of the file, offset of the chunk
+# data, dsdfile
+# Returns: nr of required local chunks found (3) or -1 on errors
+def handle_prop_local_chunks(size, probe, pos, dsdfile):
     ret = 0
-    curpos = handle.tell()
-    maxpos = curpos + size
-    #print "Property local chunks, total size is %d , cur pos = %d" % (size, curpos)
-    props = []
-    propdata = handle.read(length['prop'])
-    s = unpacked['prop'](propdata)
-    props.append(s)
-    chunk_id = props[0][0].decode("UTF-8")  # Should be 'SND '
-    if chunk_id == 'SND ':
-
-        while curpos < maxpos:
-            # Read next chunk ID + chunk size
-            propdata = handle.read(length['data'])
-            s = unpacked['data'](propdata)
-            props.append(s)
-
-            chunk_id = props[1][0].decode("UTF-8")
-            chunk_size = props[1][1]
-
-            # Sample Rate Chunk
-            if chunk_id == 'FS  ':
-                #print "Sample Rate Chunk"
-                props = []
-                propdata = handle.read(length['rate'])
-                s = unpacked['rate'](propdata)
-                props.append(s)
-                rate = props[0][0]
-                #print "Sample rate: %d Hz" % rate
-                if not dsd_valid_rate(rate):
-                    return -1
-                dsdfile.rate = rate
-                ret += 1
-                curpos = handle.tell()
-                continue
-
-            # Channels Chunk
-            if chunk_id == 'CHNL':
-                #print "Channels Chunk"
-                props = []
-                propdata = handle.read(length['chan'])
-                s = unpacked['chan'](propdata)
-                props.append(s)
-                channels = props[0][0]
-                #print "File has %d channels" % channels
-                dsdfile.channels = channels
-                for i in range(0, channels):
-                    props = []
-                    propdata = handle.read(length['chandes'])
-                    s = unpacked['chandes'](propdata)
-                    props.append(s)
-                    chandes = props[0][0]
-                    #print "Channel: %s" % chandes
-                ret += 1
-                curpos = handle.tell()
-                continue
-                    
-            # Compression Type Chunk
-            if chunk_id == 'CMPR':
-                #print("Compression Type Chunk")
-                props = []
-                propdata = handle.read(length['cmp'])
-                s = unpacked['cmp'](propdata)
-                props.append(s)
-                cmptype = props[0][0].decode("UTF-8")
-                cmplen = props[0][1]
-                #print "Compression type: '%s'" % cmptype
-                if cmptype == 'DSD ':
-                    dsdfile.compress = 0
-                else:
-                    dsdfile.compress = 1
-
-                #print "Compression string length: %d" % cmplen
-                for i in range(0, cmplen+1):
-                    propdata = handle.read(length['cmpstr'])
-                    s = unpacked['cmpstr'](propdata)
-                    #print "%s" % s,
-                    
-                ret += 1
-                curpos = handle.tell()
-                #print "POS is %d" % curpos
-                continue
-
-            if chunk_id == 'ABSS':              # Optional
-                #print "Absolute Start Time Chunk"
-                #print "Size %d" % chunk_size
-                props = []
-                propdata = handle.read(length['abbs'])
-                s = unpacked['abbs'](propdata)
-                props.append(s)
-                hrs = props[0][0]
-                mins = props[0][1]
-                secs = props[0][2]
-                samples = props[0][3]
-                #print "Offset: %d hrs, %d mins, %d secs and %d samples " %(hrs, mins, secs, samples)
-
-                curpos = handle.tell()
-                continue
-
-            if chunk_id == 'LSCO':              # Optional
-                #print "Loudspeaker Configuration Chunk"
-                if chunk_size != 2:
-                    #print "Illegal chunk size %d" % chunk_size
-                    ret = -1
-                    return ret
-
-                props = []
-                propdata = handle.read(length['spkr'])
-                s = unpacked['spkr'](propdata)
-                props.append(s)
-                spkrcfg = props[0][0]
-                #print "Speaker config is: %d" % spkrcfg
-                curpos = handle.tell()
-                continue
-
-        #print "Done with while loop, ret = %d" % ret
-        # Save current position in the DSD file
-        dsdfile.curpos = curpos
-        return ret
-
-    else:
-        #print "Illegal/wrong chunk id '%s' " % chunk_id
-        ret = -1
-        return ret
+    maxpos = pos + size
+    #print "Property local chunks, total size is %d , cur pos = %d" % (size, pos)
+    props = probe.dsdiff('prop', pos)
+    if props is None or chunkid(props[0]) != 'SND ':
+        #print "Illegal/wrong chunk id"
+        return -1
+
+    curpos = pos + length['prop']
+    while curpos < maxpos:
+        # Next chunk ID + chunk size
+        props = probe.dsdiff('data', curpos)
+        if props is None:
+            break
+        chunk_id = chunkid(props[0])
+        chunk_size = props[1]
+        datapos = curpos + length['data']
+        # Chunks are padded to an even size
+        curpos = datapos + chunk_size + (chunk_size & 1)
+
+        # Sample Rate Chunk
+        if chunk_id == 'FS  ':
+            props = probe.dsdiff('rate', datapos)
+            if props is None:
+                return -1
+            rate = props[0]
+            #print "Sample rate: %d Hz" % rate
+            if not dsd_valid_rate(rate):
+                return -1
+            dsdfile.rate = rate
+            ret += 1
+            continue
+
+        # Channels Chunk
+        if chunk_id == 'CHNL':
+            props = probe.dsdiff('chan', datapos)
+            if props is None:
+                return -1
+            channels = props[0]
+            #print "File has %d channels" % channels
+            dsdfile.channels = channels
+            data = probe.get(datapos + length['chan'], 4 * channels)
+            if data is not None:
+                ids = tuple(chunkid(data[i:i + 4]) for i in range(0, len(data), 4))
+                dsdfile.chantype = dsf_chantypes.get(ids, 0)
+            ret += 1
+            continue
+
+        # Compression Type Chunk
+        if chunk_id == 'CMPR':
+            props = probe.dsdiff('cmp', datapos)
+            if props is None:
+                return -1
+            cmptype = chunkid(props[0])
+            #print "Compression type: '%s'" % cmptype
+            if cmptype == 'DSD ':
+                dsdfile.compress = 0
+            else:
+                dsdfile.compress = 1
+            ret += 1
+            continue
+
+        if chunk_id == 'ABSS':              # Optional
+            #print "Absolute Start Time Chunk"
+            props = probe.dsdiff('abbs', datapos)
+            if props is None:
+                return -1
+            hours, minutes, seconds, samples = props
+            dsdfile.abss = ((hours * 60 + minutes) * 60 + seconds) * dsdfile.rate + samples
+            continue
+
+        if chunk_id == 'LSCO':              # Optional
+            #print "Loudspeaker Configuration Chunk"
+            if chunk_size != 2:
+                #print "Illegal chunk size %d" % chunk_size
+                return -1
+            continue
+
+    # Save current position in the DSD file
+    dsdfile.curpos = curpos
+    return ret
 
 # check_dsdiff
 # Check if the given file is a proper DSDIFF file
-def check_dsdiff(filename, dsdfile):
+def check_dsdiff(filename, dsdfile, probe=None, quiet=False):
+
+    if probe is None:
+        with dsdprobe(filename) as probe:
+            return check_dsdiff(filename, dsdfile, probe, quiet)
 
-    results = []
     confedence = 0
     neededconf = 4
-    id3tag = 0
-
-    with open(filename, "rb") as f:
-
-        # Read header of the file and check for the needed DSDIFF ID's
-        data = f.read(length['frm8'])
-        s = unpacked['frm8'](data)
-        results.append(s)
-        chunk_id = results[0][0].decode("UTF-8")    # Should be 'FRM8'
-        dsd_file_size = results[0][1]
-        dsd_id = results[0][2].decode("UTF-8")      # Should be 'DSD '
-        print("DEBUG: chunk_id: %s, dsd_id: %s" % (chunk_id, dsd_id))
-        if chunk_id != 'FRM8':
-            # Mark file as invalid
-            dsdfile.valid = 0
-            return dsdfile
-            #wrongfile('FRM8')
-
-        if dsd_id != 'DSD ':
-            # Mark file as invalid
-            dsdfile.valid = 0
-            return dsdfile
-            #wrongfile('DSD ')
-
-        confedence += 1
-        print("DEBUG: 1 confedence: %d" % confedence)
-        dsdfile.fsize = dsd_file_size
-
-        # Loop through all the remaining chunks
-        while True:
-            results = []
-            data = f.read(length['dsd_chunk'])
-            if not data: break
-            s = unpacked['dsd_chunk'](data)
-            results.append(s)
-            chunk_id = results[0][0].decode("UTF-8")
-            chunk_size = results[0][1]
-
-            if chunk_id == 'FVER':
-                results = []
-                data = f.read(length['fver'])
-                s = unpacked['fver'](data)
-                results.append(s)
-                version = results[0][0]
-                if version != 0x1050000 and version != 0x1040000:
-                    #print("Illegal/unsupported version 0x%06x" % version)
-                    dsdfile.valid = 0
-                    break
-                confedence += 1
-                print("DEBUG: 2 confedence: %d" % confedence)
-                pos = f.tell()
-                seekpos = pos
-                continue
+    dsdfile.id3tag = 0
+    dsdfile.id3len = 0
+    dsdfile.abss = 0
+    dsdfile.chantype = 0
+
+    # Check the header of the file for the needed DSDIFF ID's
+    results = probe.dsdiff('frm8', 0)
+    if results is None:
+        return invalid(dsdfile, confedence, "file too short", quiet)
+    chunk_id = chunkid(results[0])      # Should be 'FRM8'
+    dsd_file_size = results[1]
+    dsd_id = chunkid(results[2])        # Should be 'DSD '
+    debugprint("DEBUG: chunk_id: %s, dsd_id: %s" % (chunk_id, dsd_id), quiet)
+    if chunk_id != 'FRM8':
+        return invalid(dsdfile, confedence, "no 'FRM8' chunk", quiet)
+
+    if dsd_id != 'DSD ':
+        return invalid(dsdfile, confedence, "no 'DSD ' form type", quiet)
+
+    confedence += 1
+    debugprint("DEBUG: 1 confedence: %d" % confedence, quiet)
+    dsdfile.fsize = dsd_file_size
+
+    # Loop through all the remaining chunks
+    pos = length['frm8']
+    endpos = length['data'] + dsd_file_size
+    while pos < endpos:
+        results = probe.dsdiff('dsd_chunk', pos)
+        if results is None:
+            break
+        chunk_id = chunkid(results[0])
+        chunk_size = results[1]
+        datapos = pos + length['dsd_chunk']
+        # Chunks are padded to an even size
+        pos = datapos + chunk_size + (chunk_size & 1)
+
+        if chunk_id == 'FVER':
+            results = probe.dsdiff('fver', datapos)
+            if results is None:
+                break
+            version = results[0]
+            if version != 0x1050000 and version != 0x1040000:
+                #print("Illegal/unsupported version 0x%06x" % version)
+                return invalid(dsdfile, confedence,
+                               "unsupported version 0x%06x" % version, quiet)
+            dsdfile.version = version
+            confedence += 1
+            debugprint("DEBUG: 2 confedence: %d" % confedence, quiet)
+            continue
+
+        if chunk_id == 'DSD ' or chunk_id == 'DST ':
+            dsdfile.datastart = datapos
+            dsdfile.datasize = chunk_size
+            confedence += 1
+            debugprint("DEBUG: 3 confedence: %d" % confedence, quiet)
+            continue
+
+        if chunk_id == 'PROP':
+            ret = handle_prop_local_chunks(chunk_size, probe, datapos, dsdfile)
+            if ret == -1:
+                return invalid(dsdfile, confedence,
+                               "problems with property chunk", quiet)
+            if ret != 3:
+                #print "Missing required local chunks in property chunk"
+                return invalid(dsdfile, confedence,
+                               "missing chunks in property chunk", quiet)
+
+            confedence += 1
+            debugprint("DEBUG: 4 confedence: %d" % confedence, quiet)
+            continue
+
+        # Unofficial ID3 tag chunk
+        if chunk_id == 'ID3 ':
+            dsdfile.id3tag = datapos
+            dsdfile.id3len = chunk_size
 
-            if chunk_id == 'DSD ' or chunk_id == 'DST ':
-                dsdfile.datastart = f.tell()
-                dsdfile.datasize = chunk_size
-                confedence += 1
-                print("DEBUG: 3 confedence: %d" % confedence)
-            if chunk_id == 'PROP':
-                ret = handle_prop_local_chunks(chunk_size, f,dsdfile)
-
-                if ret == -1:
-                    # Mark file as invalid
-                    dsdfile.valid = 0
-                    break
-                if ret != 3:
-                    #print "Missing required local chunks in property chunk"
-                    # Mark file as invalid
-                    dsdfile.valid = 0
-                    break
-
-                confedence += 1
-                print("DEBUG: 4 confedence: %d" % confedence)
-                #pos = f.tell()
-                seekpos = dsdfile.curpos
-                
-            else:
-                # Seek to next chunk
-                pos = f.tell()
-                seekpos = pos + chunk_size
-                # Check if this was the last chunk
-                if seekpos > dsd_file_size:
-                    break
-            
-            f.seek(seekpos)
-            #print "\nFile pos now at\t\t: %d" % f.tell()
-
-        f.close()
-        dsdfile.confedence = confedence
-
-        if confedence < neededconf:
-            # Mark file as invalid
-            print("DEBUG: failed to get desired confedence")
-            dsdfile.valid = 0
-        else:
-            # Mark file as valid
-            dsdfile.valid = 1
-            #if id3tag == 0:
-            #   print "This is a properly formatted DSDIFF file"
-            #else:
-            #   print "This is a properly formatted DSDIFF file with unofficial ID3 tag"
-
-            # TODO: store id3tag length
-        
-        return dsdfile
+    dsdfile.confedence = confedence
+
+    # Byte interleaved data, one byte per channel per frame. The nr of
+    # samples of DST compressed data is not known from the chunk size.
+    dsdfile.blocksize = 1
+    dsdfile.samples = 0
+    if dsdfile.channels > 0 and dsdfile.compress == 0:
+        dsdfile.samples = dsdfile.datasize // dsdfile.channels * 8
+
+    if confedence < neededconf:
+        # Mark file as invalid
+        debugprint("DEBUG: failed to get desired confedence", quiet)
+        invalid(dsdfile, confedence, "missing required chunks", quiet)
+    else:
+        # Mark file as valid
+        dsdfile.valid = 1
+        dsdfile.reason = b''
+
+    return dsdfile
 
 # check_dsf
 # Check if the given file is a proper DSD DSF formatted file
-def check_dsf(filename, dsdfile):
+def check_dsf(filename, dsdfile, probe=None, quiet=False):
+
+    if probe is None:
+        with dsdprobe(filename) as probe:
+            return check_dsf(filename, dsdfile, probe, quiet)
 
-    results = []
     dsdfile.valid = 0
     confedence = 0
     dsdfile.lsbfirst = 0
     dsdfile.id3tag = 0
+    dsdfile.id3len = 0
+
+    # Check the header of the file for the needed DSF ID
+    results = probe.dsf('hdr', 0)
+    if results is None:
+        return invalid(dsdfile, confedence, "file too short", quiet)
+    chunk_id = chunkid(results[0])      # Should be 'DSD '
+
+    if chunk_id != 'DSD ':
+        return invalid(dsdfile, confedence, "no 'DSD ' chunk", quiet)
 
-    with open(filename, "rb") as f:
+    chunk_size = results[1]     # Size should be 28
+    if chunk_size != 28:
+        #print "Wrong chunk size: %d" % chunk_size
+        return invalid(dsdfile, confedence,
+                       "wrong 'DSD ' chunk size %d" % chunk_size, quiet)
 
-        # Read header of the file and check for the needed DSF ID
-        data = f.read(dsf_length['hdr'])
-        s = dsf_unpacked['hdr'](data)
-        results.append(s)
-        chunk_id = results[0][0].decode("UTF-8")    # Should be 'DSD '
+    confedence += 1
+    debugprint("DEBUG: DSF 1 confedence: %d" % confedence, quiet)
 
-        if chunk_id != 'DSD ':
-            return dsdfile
+    file_size = results[2]
+    dsdfile.fsize = file_size
+    #print "Total file size\t\t\t: %d" % file_size
 
-        chunk_size = results[0][1]      # Size should be 28
-        if chunk_size != 28:
-            #print "Wrong chunk size: %d" % chunk_size
-            return dsdfile
+    id3_chunk_offset = results[3]
 
-        confedence += 1
-        print("DEBUG: DSF 1 confedence: %d" % confedence)
+    # The fmt chunk
+    pos = dsf_length['hdr']
+    results = probe.dsf('fmt', pos)
+    if results is None:
+        return invalid(dsdfile, confedence, "file too short", quiet)
 
-        file_size = results[0][2]
-        dsdfile.fsize = file_size
-        #print "Total file size\t\t\t: %d" % file_size
-
-        id3_chunk_offset = results[0][3]
-        if id3_chunk_offset != 0:
-            dsdfile.id3tag = id3_chunk_offset
+    chunk_id = chunkid(results[0])      # Should be 'fmt '
+    if chunk_id != 'fmt ':
+        return invalid(dsdfile, confedence, "no 'fmt ' chunk", quiet)
 
-        # Read the fmt chunk
-        results = []
-        data = f.read(dsf_length['fmt'])
-        s = dsf_unpacked['fmt'](data)
-        results.append(s)
+    chunk_size = results[1]     # Size should be 52
+    if chunk_size != 52:
+        return invalid(dsdfile, confedence,
+                       "wrong 'fmt ' chunk size %d" % chunk_size, quiet)
 
-        chunk_id = results[0][0].decode("UTF-8")    # Should be 'fmt '
-        if chunk_id != 'fmt ':
-            return dsdfile
+    confedence += 1
+    debugprint("DEBUG: DSF 2 confedence: %d" % confedence, quiet)
 
-        chunk_size = results[0][1]      # Size should be 52
-        if chunk_size != 52:
-            return dsdfile
+    dsf_version = results[2]        # Should be 1
+    if dsf_version != 1:
+        return invalid(dsdfile, confedence,
+                       "unknown DSF version %d" % dsf_version, quiet)
+    dsdfile.version = dsf_version
 
-        confedence += 1
-        print("DEBUG: DSF 2 confedence: %d" % confedence)
+    dsf_format_id = results[3]      # Should be 0
+    if dsf_format_id != 0:
+        return invalid(dsdfile, confedence,
+                       "unsupported format ID %d" % dsf_format_id, quiet)
 
-        dsf_version = results[0][2]     # Should be 1
-        if dsf_version != 1:
-            return dsdfile
+    confedence += 1
+    debugprint("DEBUG: DSF 3 confedence: %d" % confedence, quiet)
 
-        dsf_format_id = results[0][3]       # Should be 0
-        if dsf_format_id != 0:
-            return dsdfile
-
-        confedence += 1
-        print("DEBUG: DSF 3 confedence: %d" % confedence)
-
-        dsf_chan_type = results[0][4]
-        if dsf_chan_type == 0 or dsf_chan_type > 7:
-            return dsdfile
-        else:
-            if dsf_chan_type == 1:
-                spkr_setup = "Mono"
-            if dsf_chan_type == 2:
-                spkr_setup = "Stereo"
-            if dsf_chan_type == 3:
-                spkr_setup = "3 channels"
-            if dsf_chan_type == 4:
-                spkr_setup = "Quad"
-            if dsf_chan_type == 5:
-                spkr_setup = "4 channels"
-            if dsf_chan_type == 6:
-                sprk_setup = "5 channels"
-            if dsf_chan_type == 7:
-                spkr_setup == "5.1 channels"
+    dsf_chan_type = results[4]
+    if dsf_chan_type == 0 or dsf_chan_type > 7:
+        return invalid(dsdfile, confedence,
+                       "unsupported channel type %d" % dsf_chan_type, quiet)
 
-        dsf_chan_num = results[0][5]
-        if dsf_chan_num == 0 or dsf_chan_num > 7:
-            return dsdfile
+    dsf_chan_num = results[5]
+    if dsf_chan_num == 0 or dsf_chan_num > 7:
+        return invalid(dsdfile, confedence,
+                       "unsupported nr of channels %d" % dsf_chan_num, quiet)
 
-        dsdfile.channels = dsf_chan_num
+    dsdfile.channels = dsf_chan_num
+    dsdfile.chantype = dsf_chan_type
 
-        print("DSF: got here")
+    dsf_rate = results[6]
+    if not dsd_valid_rate(dsf_rate):
+        return invalid(dsdfile, confedence,
+                       "invalid DSD rate %d" % dsf_rate, quiet)
+    dsdfile.rate = dsf_rate
 
-        dsf_rate = results[0][6]
-        if not dsd_valid_rate(dsf_rate):
-            return dsdfile
-        dsdfile.rate = dsf_rate
+    debugprint("DSF: rate: %d" % dsdfile.rate, quiet)
 
-        print("DSF: rate: %d" % dsdfile.rate)
+    dsf_sample_bits = results[7]
+    if dsf_sample_bits == 1:
+        dsdfile.lsbfirst = 1
 
-        dsf_sample_bits = results[0][7]
-        if dsf_sample_bits == 1:
-            dsdfile.lsbfirst = 1
+    dsf_sample_count = results[8]
+    dsdfile.samples = dsf_sample_count
 
-        dsf_sample_count = results[0][8]
+    debugprint("DSF: sample count: %d" % dsf_sample_count, quiet)
 
-        print("DSF: sample count: %d" % dsf_sample_count)
+    dsf_block_size = results[9]
+    debugprint("DSF: block size: %d" % dsf_block_size, quiet)
+    if dsf_block_size == 0:
+        return invalid(dsdfile, confedence,
+                       "invalid block size %d" % dsf_block_size, quiet)
+    dsdfile.blocksize = dsf_block_size
 
-        dsf_block_size = results[0][9]
-        print("DSF: block size: %d" % dsf_block_size)
-        if dsf_block_size != 4096:
-            return dsdfile
+    confedence += 1
+    debugprint("DEBUG: DSF 4 confedence: %d" % confedence, quiet)
 
-#       dsf_reserved = results[0][10]
-#       if dsf_reserved != 0:
-#           print "Reserved\t\t\t: %d [Should be 0]" % dsf_reserved
+    # Chunk header of 'data' chunk
+    pos += dsf_length['fmt']
+    results = probe.dsf('data', pos)
+    if results is None:
+        return invalid(dsdfile, confedence, "file too short", quiet)
 
-        confedence += 1
-        print("DEBUG: DSF 4 confedence: %d" % confedence)
+    chunk_id = chunkid(results[0])
+    if chunk_id != 'data':
+        return invalid(dsdfile, confedence, "no 'data' chunk", quiet)
 
-        # Read chunk header of 'data' chunk
-        results = []
-        data = f.read(dsf_length['data'])
-        s = dsf_unpacked['data'](data)
-        results.append(s)
+    dsdfile.datastart = pos + dsf_length['data']
 
-        chunk_id = results[0][0].decode("UTF-8")
-        if chunk_id != 'data':
-            print("DSF: oh oh?")
-            return dsdfile
-
-        dsdfile.datastart = f.tell()
-
-        chunk_size = results[0][1]
-        chunk_size -= 12
-        #print "Chunk size (samples)\t\t: %d" % chunk_size
-
-        playable_size = dsf_chan_num * dsf_sample_count // 8
-
-        if chunk_size > playable_size:
-            dsdfile.datasize = playable_size
-        else:
-            dsdfile.datasize = chunk_size
+    chunk_size = results[1]
+    chunk_size -= 12
+    #print "Chunk size (samples)\t\t: %d" % chunk_size
 
-        # Read metadata chunk
-        if id3_chunk_offset != 0:
-            f.seek(id3_chunk_offset)
+    playable_size = dsf_chan_num * dsf_sample_count // 8
 
-        results = []
-        data = f.read(dsf_length['meta'])
-        s = dsf_unpacked['meta'](data)
-        results.append(s)
-
-        chunk_id = results[0][0]
-        if chunk_id != 'ID3':
-            dsdfile.id3tag = 0
-
-        # TODO: store id3tag length
+    if chunk_size > playable_size:
+        dsdfile.datasize = playable_size
+    else:
+        dsdfile.datasize = chunk_size
 
-        confedence += 1
-        print("DEBUG: DSF 5 confedence: %d" % confedence)
+    # Metadata chunk, an ID3v2 tag
+    if id3_chunk_offset != 0:
+        dsdfile.id3len = id3size(probe, id3_chunk_offset)
+        if dsdfile.id3len != 0:
+            dsdfile.id3tag = id3_chunk_offset
 
-    f.close()
+    confedence += 1
+    debugprint("DEBUG: DSF 5 confedence: %d" % confedence, quiet)
 
     # Mark DSF file as valid
     dsdfile.valid = 1
     dsdfile.confedence = confedence
+    dsdfile.reason = b''
 
     return dsdfile
 
 # checkdsdfile()
-# Input: filename to test on
+# Input: filename to test on, optional probe of the file, quiet to leave
+#        out the debug messages
 # Return: structure
-def checkdsdfile(filename, dsdfile):
+def checkdsdfile(filename, dsdfile, probe=None, quiet=False):
 
-    # Test readability of given filename
+    if probe is None:
+        with dsdprobe(filename) as probe:
+            return checkdsdfile(filename, dsdfile, probe, quiet)
 
-    # Read first basic header to determine if it is potentially a DSD file
-    getfiletype(filename, dsdfile)
-    if dsdfile.type == 'none':
+    # Check the basic header to determine if it is potentially a DSD file
+    getfiletype(filename, dsdfile, probe, quiet)
+    if dsdfile.type == b'none':
         #print ">>>> Not a DSD file"
         return dsdfile
     if dsdfile.type == b'dsf':
-        check_dsf(filename, dsdfile)
+        check_dsf(filename, dsdfile, probe, quiet)
     else:
         # File is potentially a DSDIFF file
-        print("DEBUG: potential DSDDIFF")
-        check_dsdiff(filename, dsdfile)
-    
+        debugprint("DEBUG: potential DSDDIFF", quiet)
+        check_dsdiff(filename, dsdfile, probe, quiet)
+
     return dsdfile
 
+# chanlayout
+# Channel layout of a checked file as DSF channel type, the default layout
+# for its nr of channels if it has none that fits
+def chanlayout(dsdfile):
+    chantype = dsdfile.chantype
+    if chantype in dsdiff_chanids and len(dsdiff_chanids[chantype]) == dsdfile.channels:
+        return chantype
+    return dsf_chantype[dsdfile.channels]
+
+# dsfheader
+# Build the header of a DSF file: the 'DSD ', 'fmt ' and 'data' chunk headers
+# Input: DSD rate, channels, nr of samples per channel, ID3 tag size (0 for
+# none), lsbfirst, block size per channel, channel type (0 for the default
+# for the nr of channels)
+# Returns: header bytes, the data (whole blocks for all channels) and the
+# ID3 tag follow it
+def dsfheader(rate, channels, samples, id3len=0, lsbfirst=1, blocksize=4096,
+              chantype=0):
+    perchan = (samples + 7) // 8
+    datasize = (perchan + blocksize - 1) // blocksize * blocksize * channels
+    hdrsize = dsf_length['hdr'] + dsf_length['fmt'] + dsf_length['data']
+    total = hdrsize + datasize + id3len
+    id3pos = hdrsize + datasize if id3len else 0
+    sample_bits = 1 if lsbfirst else 8
+
+    header = struct.pack(dsf_data['hdr'], b'DSD ', dsf_length['hdr'], total, id3pos)
+    header += struct.pack(dsf_data['fmt'], b'fmt ', dsf_length['fmt'], 1, 0,
+                          chantype or dsf_chantype[channels], channels, rate, sample_bits,
+                          samples, blocksize, 0)
+    header += struct.pack(dsf_data['data'], b'data', dsf_length['data'] + datasize)
+    return header
+
+# dsdiffchunk
+# Build a DSDIFF chunk, padded to an even size
+def dsdiffchunk(chunk_id, body):
+    chunk = struct.pack(dsdiff_data['data'], chunk_id.encode("latin-1"), len(body)) + body
+    if len(body) & 1:
+        chunk += b'\0'
+    return chunk
+
+# dsdiffheader
+# Build the header of an uncompressed DSDIFF file up to and including the
+# 'DSD ' chunk header
+# Input: DSD rate, channels, nr of DSD data bytes, nr of bytes of the chunks
+# after the DSD data (e.g. an 'ID3 ' chunk), channel layout as DSF channel
+# type (0 for the default for the nr of channels)
+# Returns: header bytes, the (byte interleaved) data and trailing chunks
+# follow it, the data is padded to an even size
+def dsdiffheader(rate, channels, datasize, trailer=0, chantype=0):
+    chnl = struct.pack(dsdiff_data['chan'], channels)
+    chnl += "".join(dsdiff_chanids[chantype or dsf_chantype[channels]]).encode("latin-1")
+    # The compression name is a pstring, padded to an even size itself
+    cmpr = struct.pack(dsdiff_data['cmp'], b'DSD ', 14) + b'not compressed\0'
+    prop = b'SND '
+    prop += dsdiffchunk('FS  ', struct.pack(dsdiff_data['rate'], rate))
+    prop += dsdiffchunk('CHNL', chnl)
+    prop += dsdiffchunk('CMPR', cmpr)
+
+    header = b'DSD '
+    header += dsdiffchunk('FVER', struct.pack(dsdiff_data['fver'], 0x1050000))
+    header += dsdiffchunk('PROP', prop)
+    header += struct.pack(dsdiff_data['dsd_chunk'], b'DSD ', datasize)
+    form_size = len(header) + datasize + (datasize & 1) + trailer
+    return struct.pack(dsdiff_data['frm8'], b'FRM8', form_size, b'DSD ') + header[4:]
+
+# DSDIFF chunks holding sub chunks. The FRM8 and PROP chunk data starts with
+# a 4 byte form/property type. Of the DST chunk only the leading FRTE chunk
+# is listed, the DST frames are found through the DST sound index (DSTI).
+dsdiff_containers = { 'FRM8' : 4, 'PROP' : 4, 'DIIN' : 0, 'DST ' : 0 }
+
+# dsdiffnode
+# A chunk of a DSDIFF file in a dsdifftree. Only the chunk headers are read
+# while the tree is built, the chunk data is read and decoded on the first
+# access of value.
+#
+# dsdiffnode.id         - chunk ID, e.g. 'PROP'
+# dsdiffnode.offset     - file offset of the chunk header
+# dsdiffnode.datapos    - file offset of the chunk data
+# dsdiffnode.size       - size of the chunk data (without the pad byte)
+# dsdiffnode.kind       - form/property type of FRM8 and PROP chunks
+# dsdiffnode.children   - sub chunks, empty if the chunk has none
+class dsdiffnode(object):
+
+    def __init__(self, tree, chunk_id, offset, size):
+        self.tree = tree
+        self.id = chunk_id
+        self.offset = offset
+        self.datapos = offset + length['dsd_chunk']
+        self.size = size
+        self.kind = ''
+        self.children = []
+        self.decoded = False
+        self.cached = None
+
+    def __repr__(self):
+        return "dsdiffnode(%r, offset=%d, size=%d)" % (self.id, self.offset,
+                                                      self.size)
+
+    # Read the raw chunk data, or size bytes of it from offset
+    def read(self, offset=0, size=-1):
+        if size < 0 or offset + size > self.size:
+            size = self.size - offset
+        return self.tree.read(self.datapos + offset, size)
+
+    # First sub chunk with the given ID, None if there is none
+    def find(self, chunk_id):
+        for child in self.children:
+            if child.id == chunk_id:
+                return child
+        return None
+
+    # The decoded chunk data, see dsdiff_decoders. None for the sound data
+    # and chunks without a decoder.
+    @property
+    def value(self):
+        if not self.decoded:
+            decoder = dsdiff_decoders.get(self.id)
+            if decoder is not None:
+                try:
+                    self.cached = decoder(self.read())
+                except (struct.error, IndexError):
+                    self.cached = None
+            self.decoded = True
+        return self.cached
+
+# Chunk data decoders, used by dsdiffnode.value
+def dsdiff_text(data, offset, count):
+    return data[offset:offset + count].decode("latin-1")
+
+def dsdiff_chnl(data):
+    channels = struct.unpack_from('>H', data)[0]
+    return [chunkid(data[2 + 4 * i:6 + 4 * i]) for i in range(channels)]
+
+def dsdiff_cmpr(data):
+    return chunkid(data[0:4]), dsdiff_text(data, 5, data[4])
+
+def dsdiff_mark(data):
+    mark = unpacked['mark'](data)
+    return mark[0:8] + (dsdiff_text(data, length['mark'], mark[8]),)
+
+def dsdiff_comt(data):
+    comments = []
+    pos = 2
+    for i in range(struct.unpack_from('>H', data)[0]):
+        year, month, day, hour, minute, cmttype, cmtref, count = \
+            struct.unpack_from('>HBBBBHHL', data, pos)
+        pos += 14
+        comments.append(((year, month, day, hour, minute), cmttype, cmtref,
+                         dsdiff_text(data, pos, count)))
+        pos += count + (count & 1)
+    return comments
+
+def dsdiff_dsti(data):
+    return list(struct.iter_unpack('>QL', data[0:len(data) - len(data) % 12]))
+
+dsdiff_decoders = {
+    'FVER' : lambda data: unpacked['fver'](data)[0],
+    'FS  ' : lambda data: unpacked['rate'](data)[0],
+    'CHNL' : dsdiff_chnl,
+    'CMPR' : dsdiff_cmpr,
+    'ABSS' : unpacked['abbs'],
+    'LSCO' : lambda data: unpacked['spkr'](data)[0],
+    'FRTE' : lambda data: struct.unpack_from('>LH', data),
+    'DSTI' : dsdiff_dsti,
+    'EMID' : lambda data: data.decode("latin-1"),
+    'MARK' : dsdiff_mark,
+    'DIAR' : lambda data: dsdiff_text(data, 4, struct.unpack_from('>L', data)[0]),
+    'DITI' : lambda data: dsdiff_text(data, 4, struct.unpack_from('>L', data)[0]),
+    'COMT' : dsdiff_comt,
+    'ID3 ' : bytes
+}
+
+# dsdifftree
+# Offset only tree of all chunks and sub chunks of a DSDIFF file. Reads the
+# 12 byte chunk headers only, from the probed file head or with small reads
+# of the chunks behind the sound data. A truncated file gives a tree up to
+# the last complete chunk header.
+#
+# Usage:
+#   tree = dsdifftree("album.dff")
+#   for depth, node in tree.walk():
+#       print("  " * depth + node.id, node.offset, node.size)
+#   rate = tree.root.find('PROP').find('FS  ').value
+#
+# dsdifftree.root       - the FRM8 chunk, None if this is no DSDIFF file
+# dsdifftree.reads      - nr of reads done for the headers
+class dsdifftree(object):
+
+    window = 4096
+
+    def __init__(self, filename, probe=None):
+        self.filename = filename
+        self.root = None
+        self.buf = b''
+        self.bufpos = 0
+
+        if probe is None:
+            with dsdprobe(filename) as probe:
+                self.build(probe)
+        else:
+            self.build(probe)
+
+    def build(self, probe):
+        self.reads = probe.reads
+        self.probe = probe
+        results = probe.dsdiff('frm8', 0)
+        if results is not None and chunkid(results[0]) == 'FRM8':
+            self.root = self.node('FRM8', 0, results[1])
+        self.reads = probe.reads - self.reads
+        self.probe = None
+
+    # Chunk ID and size of the chunk header at offset, from the file head
+    # or a window read behind it, which holds the next headers as well
+    def header(self, offset, endpos):
+        if offset + length['dsd_chunk'] <= len(self.probe.head):
+            return self.probe.dsdiff('dsd_chunk', offset)
+        if not (self.bufpos <= offset and
+                offset + length['dsd_chunk'] <= self.bufpos + len(self.buf)):
+            size = max(min(self.window, endpos - offset), length['dsd_chunk'])
+            self.buf = self.probe.get(offset, size) or b''
+            self.bufpos = offset
+            if len(self.buf) < length['dsd_chunk']:
+                return None
+        return unpacked['dsd_chunk'](self.buf, offset - self.bufpos)
+
+    # Create the node of a chunk and the nodes of its sub chunks
+    def node(self, chunk_id, offset, size):
+        node = dsdiffnode(self, chunk_id, offset, size)
+        if chunk_id not in dsdiff_containers:
+            return node
+
+        pos = node.datapos
+        endpos = min(node.datapos + size, self.probe.size)
+        if dsdiff_containers[chunk_id]:
+            kind = self.probe.get(pos, 4)
+            if kind is None:
+                return node
+            node.kind = chunkid(kind)
+            pos += 4
+
+        while pos + length['dsd_chunk'] <= endpos:
+            results = self.header(pos, endpos)
+            if results is None:
+                break
+            child = self.node(chunkid(results[0]), pos, results[1])
+            node.children.append(child)
+            pos = child.datapos + child.size + (child.size & 1)
+            # The sound data frames are not listed
+            if chunk_id == 'DST ':
+                break
+        return node
+
+    # Read size bytes of chunk data at offset
+    def read(self, offset, size):
+        fd = os.open(self.filename, os.O_RDONLY)
+        try:
+            return os.pread(fd, size, offset)
+        finally:
+            os.close(fd)
+
+    # All nodes, depth first
+    # Yields: (depth, node)
+    def walk(self):
+        nodes = [(0, self.root)] if self.root is not None else []
+        while nodes:
+            depth, node = nodes.pop()
+            yield depth, node
+            nodes.extend((depth + 1, child) for child in reversed(node.children))
+
+    # All nodes with the given chunk ID
+    def findall(self, chunk_id):
+        return [node for depth, node in self.walk() if node.id == chunk_id]
+
+# dsdiffmarks
+# Get the markers (MARK chunks in the DIIN chunk) of a DSDIFF file. Marker
+# times are absolute, the start time of the file (ABSS) is subtracted.
+# Input: filename, checked dsdfile, optional probe of the file
+# Returns: list of (sample position, mark type, text) tuples sorted by
+# position, empty if the file has no markers
+def dsdiffmarks(filename, dsdfile, probe=None):
+
+    marks = []
+    for node in dsdifftree(filename, probe).findall('MARK'):
+        if node.size < length['mark'] or node.value is None:
+            continue
+        hours, minutes, seconds, samples, offset, marktype = node.value[0:6]
+        sample = ((hours * 60 + minutes) * 60 + seconds) * dsdfile.rate
+        sample += samples + offset - dsdfile.abss
+        marks.append((max(sample, 0), marktype, node.value[8]))
+
+    marks.sort(key=lambda mark: mark[0])
+    return marks
+
+# ID3v2 text frames returned by id3tag.tags() and their names
+id3_fields = {
+    'TIT2' : 'title',
+    'TPE1' : 'artist',
+    'TPE2' : 'albumartist',
+    'TALB' : 'album',
+    'TCOM' : 'composer',
+    'TCON' : 'genre',
+    'TRCK' : 'track',
+    'TPOS' : 'disc',
+    'TYER' : 'date',
+    'TDRC' : 'date'
+}
+
+# ID3v2 text encodings
+id3_encodings = { 0 : 'latin-1', 1 : 'utf-16', 2 : 'utf-16-be', 3 : 'utf-8' }
+
+# synchsafe
+# Decode a 4 byte ID3v2 synchsafe integer (7 bits per byte)
+def synchsafe(data, offset=0):
+    size = 0
+    for x in data[offset:offset + 4]:
+        size = (size << 7) | (x & 0x7f)
+    return size
+
+# tosynchsafe
+# Encode a 4 byte ID3v2 synchsafe integer
+def tosynchsafe(size):
+    return bytes((size >> shift) & 0x7f for shift in (21, 14, 7, 0))
+
+# id3split
+# Split ID3v2 encoded text at the first terminator
+# Returns: decoded text, offset behind the terminator
+def id3split(data, offset, encoding):
+    if encoding in (1, 2):
+        end = offset
+        while True:
+            end = data.find(b'\0\0', end)
+            if end < 0 or (end - offset) % 2 == 0:
+                break
+            end += 1
+        width = 2
+    else:
+        end = data.find(b'\0', offset)
+        width = 1
+    if end < 0:
+        end = len(data)
+    text = bytes(data[offset:end]).decode(id3_encodings.get(encoding, 'latin-1'),
+                                           'replace')
+    return text, end + width
+
+# id3text
+# Decode ID3v2 text (all values, ID3v2.4 separates them with a 0)
+def id3text(data, encoding):
+    values = []
+    pos = 0
+    while pos < len(data):
+        text, pos = id3split(data, pos, encoding)
+        if text != '':
+            values.append(text)
+    return "; ".join(values)
+
+# id3tag
+# ID3v2.3/2.4 tag of a DSF or DSDIFF file. The tag is read with a single
+# positioned read of up to window bytes, which holds the text frames of
+# almost every tag. Only the frame headers are indexed, frame data is decoded
+# on first access. Frames behind the window, usually artwork, are indexed with
+# small reads of their headers and are not loaded.
+#
+# Usage:
+#   tag = readid3("track.dsf")
+#   title = tag.get('TIT2')
+#   for picture in tag.pictures():
+#       image = tag.readpicture(picture)
+#
+# id3tag.offset         - file offset of the tag
+# id3tag.size           - tag size including the header
+# id3tag.version        - ID3v2 major version (3 or 4)
+# id3tag.frames         - list of (frame ID, file offset of the frame data,
+#                         size, frame flags)
+# id3tag.reads          - nr of reads done for the frame index
+class id3tag(object):
+
+    window = 65536
+
+    def __init__(self, fd, offset, size):
+        self.fd = fd
+        self.offset = offset
+        self.frames = []
+        self.decoded = {}
+        self.version = 0
+        self.unsync = False
+        self.reads = 1
+
+        self.buf = os.pread(fd, min(size, self.window), offset)
+        if len(self.buf) < 10 or self.buf[0:3] != b'ID3':
+            self.size = 0
+            return
+        self.version = self.buf[3]
+        flags = self.buf[5]
+        self.size = min(size, synchsafe(self.buf, 6) + 10)
+        if self.version not in (3, 4):
+            return
+
+        # An unsynchronised ID3v2.3 tag has no frame offsets in the file,
+        # it is read and decoded as a whole
+        self.unsync = self.version == 3 and flags & 0x80
+        if self.unsync:
+            if len(self.buf) < self.size:
+                self.buf = os.pread(fd, self.size, offset)
+                self.reads += 1
+            self.buf = self.buf[0:10] + self.buf[10:self.size].replace(b'\xff\0', b'\xff')
+
+        pos = 10
+        if flags & 0x40:            # Extended header
+            if self.version == 3:
+                pos += struct.unpack_from('>L', self.buf, pos)[0] + 4
+            else:
+                pos += synchsafe(self.buf, pos)
+        self.index(pos)
+
+    # Index the frame headers from pos on
+    def index(self, pos):
+        end = self.size if not self.unsync else len(self.buf)
+        while pos + 10 <= end:
+            hdr = self.fetch(pos, 10)
+            if hdr is None or hdr[0:1] == b'\0':
+                break           # Padding
+            frame_id = hdr[0:4].decode("latin-1")
+            if self.version == 4:
+                size = synchsafe(hdr, 4)
+            else:
+                size = struct.unpack_from('>L', hdr, 4)[0]
+            if pos + 10 + size > end:
+                break
+            self.frames.append((frame_id, self.offset + pos + 10, size,
+                                struct.unpack_from('>H', hdr, 8)[0]))
+            pos += 10 + size
+
+    # size bytes at pos in the tag, from the buffer or with a positioned read
+    def fetch(self, pos, size):
+        if pos + size <= len(self.buf):
+            return self.buf[pos:pos + size]
+        if self.unsync:
+            return None
+        self.reads += 1
+        data = os.pread(self.fd, size, self.offset + pos)
+        return data if len(data) == size else None
+
+    # The data of a frame, with the frame flags (grouping, compression,
+    # unsynchronisation, data length) undone. None for encrypted frames.
+    def framedata(self, frame, size=-1):
+        frame_id, datapos, framesize, flags = frame
+        if size < 0 or size > framesize:
+            size = framesize
+        data = self.fetch(datapos - self.offset, size)
+        if data is None:
+            return None
+        if self.version == 3:
+            grouping, compressed, encrypted = flags & 0x20, flags & 0x80, flags & 0x40
+            unsync = lengthind = 0
+        else:
+            grouping, compressed, encrypted = flags & 0x40, flags & 0x08, flags & 0x04
+            unsync, lengthind = flags & 0x02, flags & 0x01
+        if encrypted:
+            return None
+        # Extra header data in front of the frame data: v2.3 has the
+        # decompressed size before the group ID, v2.4 the group ID before the
+        # data length indicator
+        if self.version == 3:
+            if compressed:
+                data = data[4:]
+            if grouping:
+                data = data[1:]
+        else:
+            if grouping:
+                data = data[1:]
+            if lengthind:
+                data = data[4:]
+        if unsync:
+            data = data.replace(b'\xff\0', b'\xff')
+        if compressed:
+            data = zlib.decompressobj().decompress(data)
+        return data
+
+    # The decoded data of all frames with the given ID, cached
+    # Text frames (T...) decode to a string, TXXX to (description, text),
+    # COMM to (language, description, text), APIC to a picture dict (see
+    # pictures()) and other frames to their data
+    def getall(self, frame_id):
+        if frame_id in self.decoded:
+            return self.decoded[frame_id]
+        values = []
+        for frame in self.frames:
+            if frame[0] != frame_id:
+                continue
+            if frame_id == 'APIC':
+                value = self.picture(frame)
+            else:
+                value = self.framedata(frame)
+                if value is not None and len(value) > 0:
+                    value = self.decode(frame_id, value)
+            if value is not None:
+                values.append(value)
+        self.decoded[frame_id] = values
+        return values
+
+    # The decoded data of the first frame with the given ID, None if there
+    # is no such frame
+    def get(self, frame_id):
+        values = self.getall(frame_id)
+        return values[0] if values else None
+
+    # Decode the data of a (non APIC) frame
+    def decode(self, frame_id, data):
+        encoding = data[0]
+        if frame_id == 'TXXX':
+            description, pos = id3split(data, 1, encoding)
+            return description, id3text(data[pos:], encoding)
+        if frame_id == 'COMM':
+            language = bytes(data[1:4]).decode("latin-1")
+            description, pos = id3split(data, 4, encoding)
+            return language, description, id3text(data[pos:], encoding)
+        if frame_id[0] == 'T':
+            return id3text(data[1:], encoding)
+        return bytes(data)
+
+    # Picture dict of an APIC frame: mime, type, description and the file
+    # offset and length of the image data. Only the start of the frame is
+    # read. The offset is None if the image is not stored as is
+    # (unsynchronised or compressed), use readpicture() for those.
+    def picture(self, frame):
+        frame_id, datapos, framesize, flags = frame
+        mask = 0xe0 if self.version == 3 else 0x4f
+        asis = not self.unsync and flags & mask == 0
+        data = self.framedata(frame, min(framesize, 1024) if asis else -1)
+        if data is None or len(data) < 4:
+            return None
+        encoding = data[0]
+        mime, pos = id3split(data, 1, 0)
+        if pos >= len(data):
+            return None
+        pictype = data[pos]
+        description, pos = id3split(data, pos + 1, encoding)
+        return {
+            'mime' : mime,
+            'type' : pictype,
+            'description' : description,
+            'offset' : datapos + pos if asis else None,
+            'length' : (framesize if asis else len(data)) - pos,
+            'frame' : frame
+        }
+
+    # All pictures (APIC frames) of the tag
+    def pictures(self):
+        return self.getall('APIC')
+
+    # Read the image data of a picture
+    def readpicture(self, picture):
+        if picture['offset'] is not None:
+            return os.pread(self.fd, picture['length'], picture['offset'])
+        data = self.framedata(picture['frame'])
+        return data[-picture['length']:] if data is not None else b''
+
+    # The common text fields (see id3_fields) and the pictures without the
+    # frame references, e.g. for caching
+    def tags(self):
+        tags = {}
+        for frame_id, name in id3_fields.items():
+            value = self.get(frame_id)
+            if value is not None and name not in tags:
+                tags[name] = value
+        tags['pictures'] = [{key : value for key, value in picture.items()
+                             if key != 'frame'} for picture in self.pictures()]
+        return tags
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+# readid3
+# Read the ID3v2 tag of a DSF or DSDIFF file without reading the DSD data
+# Input: filename
+# Returns: id3tag (to be closed by the caller), None if the file has no
+# ID3v2.3/2.4 tag
+def readid3(filename):
+    with dsdprobe(filename, 1024) as probe:
+        info, reason = quietcheck(filename, probe)
+        if info.valid != 1 or info.id3len == 0:
+            return None
+        tag = id3tag(os.dup(probe.fd), info.id3tag, info.id3len)
+    if tag.version not in (3, 4):
+        tag.close()
+        return None
+    return tag
+
+# tagcache
+# Parsed tags (id3tag.tags()) of many files, keyed by the file identity:
+# device, inode, size and modification time. A changed file is parsed again.
+#
+# Usage:
+#   cache = tagcache()
+#   title = cache.get("track.dsf").get('title', '')
+class tagcache(object):
+
+    def __init__(self):
+        self.files = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    # Returns: tags of the file, empty if it has none or cannot be read
+    def get(self, filename):
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return {}
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        with self.lock:
+            tags = self.files.get(key)
+            if tags is not None:
+                self.hits += 1
+                return tags
+
+        tags = {}
+        try:
+            tag = readid3(filename)
+            if tag is not None:
+                with tag:
+                    tags = tag.tags()
+        except (OSError, ValueError, IndexError, struct.error, zlib.error):
+            pass
+        with self.lock:
+            self.files[key] = tags
+            self.misses += 1
+        return tags
+
+# id3frameid
+# Frame ID of a tag name of id3_fields (or a frame ID) for an ID3v2 version
+def id3frameid(name, version):
+    if name == 'date':
+        return 'TDRC' if version == 4 else 'TYER'
+    for frame_id, field in id3_fields.items():
+        if field == name:
+            return frame_id
+    return name
+
+# id3frame
+# Build an ID3v2.3/2.4 frame, text frames are built from a string
+def id3frame(frame_id, value, version=4):
+    if isinstance(value, str):
+        if version == 4:
+            data = b'\3' + value.encode("UTF-8")
+        else:
+            try:
+                data = b'\0' + value.encode("latin-1")
+            except UnicodeEncodeError:
+                data = b'\1' + value.encode("UTF-16")
+    else:
+        data = bytes(value)
+    if version == 4:
+        size = tosynchsafe(len(data))
+    else:
+        size = struct.pack('>L', len(data))
+    return frame_id.encode("latin-1") + size + b'\0\0' + data
+
+# buildid3
+# Build an ID3v2.3/2.4 tag from complete frames
+def buildid3(frames, version=4):
+    body = b''.join(frames)
+    return b'ID3' + bytes((version, 0, 0)) + tosynchsafe(len(body)) + body
+
+# dsfid3pos
+# Position of the ID3v2 tag of a DSF file: the end of the 'data' chunk
+# Returns: DSD chunk header fields, tag position
+def dsfid3pos(filename):
+    with dsdprobe(filename, 1024) as probe:
+        info, reason = quietcheck(filename, probe)
+        if info.type != b'dsf' or info.valid != 1:
+            raise ValueError("'%s' is not a valid DSF file" % filename)
+        hdr = probe.dsf('hdr', 0)
+        datapos = dsf_length['hdr'] + dsf_length['fmt']
+        tagpos = datapos + probe.dsf('data', datapos)[1]
+        if tagpos > probe.size:
+            raise ValueError("'%s' is truncated" % filename)
+    return hdr, tagpos
+
+# DSF tag journal: magic, old file size, nr of saved ranges, the old 'DSD '
+# chunk, the saved ranges (offset, size, old bytes) and a CRC32 of all of it
+id3journal_fmt = struct.Struct('<8sQQ')
+id3journal_range = struct.Struct('<QQ')
+id3journal_magic = b'DSFID3J2'
+
+def id3journal(filename):
+    return filename + ".id3journal"
+
+# recoverid3
+# Undo an interrupted writeid3(): restore the old header and tail of the
+# file from a complete journal. An incomplete journal is written before the
+# file is changed, it is removed.
+# Returns: True if the file was restored
+def recoverid3(filename):
+    journal = id3journal(filename)
+    try:
+        with open(journal, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return False
+
+    restored = False
+    if (len(data) >= id3journal_fmt.size + 4 and
+            zlib.crc32(data[:-4]) == struct.unpack('<L', data[-4:])[0]):
+        magic, oldsize, nranges = id3journal_fmt.unpack_from(data)
+        if magic == id3journal_magic:
+            pos = id3journal_fmt.size
+            header = data[pos:pos + dsf_length['hdr']]
+            pos += dsf_length['hdr']
+            fd = os.open(filename, os.O_RDWR)
+            try:
+                for i in range(nranges):
+                    offset, size = id3journal_range.unpack_from(data, pos)
+                    pos += id3journal_range.size
+                    os.pwrite(fd, data[pos:pos + size], offset)
+                    pos += size
+                os.ftruncate(fd, oldsize)
+                os.pwrite(fd, header, 0)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            restored = True
+
+    os.unlink(journal)
+    syncdir(journal)
+    return restored
+
+# syncdir
+# Make a create or unlink of a file in a directory durable
+def syncdir(filename):
+    fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# writeid3
+# Replace the ID3v2 tag of a DSF file in place, without touching the DSD
+# data. The tag behind the 'data' chunk is compared with the new tag in
+# pages of 4 KB, only changed pages are written. The file is truncated or
+# extended and the file size and tag offset in the 'DSD ' chunk are patched.
+# The old header and the old bytes of the changed pages are journaled
+# first, after a crash recoverid3() (called by the next writeid3())
+# restores the old file.
+# Input: filename, complete ID3v2 tag (empty to remove the tag)
+# Returns: nr of bytes written, including the journal
+def writeid3(filename, tag, pagesize=4096):
+    recoverid3(filename)
+    hdr, tagpos = dsfid3pos(filename)
+
+    fd = os.open(filename, os.O_RDWR)
+    try:
+        oldsize = os.fstat(fd).st_size
+        tail = os.pread(fd, oldsize - tagpos, tagpos)
+        newsize = tagpos + len(tag)
+        pages = [offset for offset in range(0, len(tag), pagesize)
+                 if tag[offset:offset + pagesize] != tail[offset:offset + pagesize]]
+
+        # The old bytes of changed pages and of pages cut off by truncation
+        saved = set(pages)
+        saved.update(range(len(tag) - len(tag) % pagesize, len(tail), pagesize))
+        ranges = [(offset, tail[offset:offset + pagesize])
+                  for offset in sorted(saved) if offset < len(tail)]
+        journal = id3journal_fmt.pack(id3journal_magic, oldsize, len(ranges))
+        journal += os.pread(fd, dsf_length['hdr'], 0)
+        for offset, old in ranges:
+            journal += id3journal_range.pack(tagpos + offset, len(old)) + old
+        journal += struct.pack('<L', zlib.crc32(journal))
+        with open(id3journal(filename), "wb") as f:
+            f.write(journal)
+            f.flush()
+            os.fsync(f.fileno())
+        syncdir(filename)
+
+        written = len(journal)
+        for offset in pages:
+            written += os.pwrite(fd, tag[offset:offset + pagesize], tagpos + offset)
+        if newsize != oldsize:
+            os.ftruncate(fd, newsize)
+        header = struct.pack(dsf_data['hdr'], b'DSD ', hdr[1], newsize,
+                             tagpos if tag else 0)
+        written += os.pwrite(fd, header, 0)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    os.unlink(id3journal(filename))
+    syncdir(filename)
+    return written
+
+# id3rawframes
+# The complete frames of the ID3v2 tag of a file, to build a changed tag
+# Returns: ID3v2 version (4 if the file has no tag), list of (frame ID,
+# frame) tuples
+def id3rawframes(filename):
+    version = 4
+    frames = []
+    tag = readid3(filename)
+    if tag is not None:
+        with tag:
+            version = tag.version
+            for frame in tag.frames:
+                frames.append((frame[0], tag.fetch(frame[1] - tag.offset - 10,
+                                                   frame[2] + 10)))
+    return version, frames
+
+# settags
+# Change tags of a DSF file in place (writeid3()). Other frames, e.g.
+# pictures, are kept as they are. Large frames are put in front, so that
+# later changes of the text frames behind them only rewrite a few pages.
+# A new tag is an ID3v2.4 tag.
+# Input: filename, dict of id3_fields names (or frame IDs) and text values,
+# None removes a field
+# Returns: nr of bytes written
+def settags(filename, tags, pagesize=4096):
+    version, frames = id3rawframes(filename)
+    changed = {}
+    for name, value in tags.items():
+        changed[id3frameid(name, version)] = value
+    frames = [data for frame_id, data in frames if frame_id not in changed]
+    frames.sort(key=lambda data: len(data) < pagesize)
+    for frame_id, value in changed.items():
+        if value is not None:
+            frames.append(id3frame(frame_id, value, version))
+    return writeid3(filename, buildid3(frames, version) if frames else b'',
+                    pagesize)
+
+# dsdseek
+# Seek map of the DSD data of a file, built from the parsed header. DSF data
+# is stored in groups of one block per channel, DSDIFF data in frames of one
+# byte per channel. Positions map in O(1) to the byte offset of the group
+# (frame) holding the sample plus the phase, the nr of samples per channel
+# into that group.
+#
+# dsdseek.unit          - samples per channel per group
+# dsdseek.groupsize     - bytes per group (all channels)
+class dsdseek(object):
+
+    def __init__(self, dsdfile):
+        self.rate = dsdfile.rate
+        self.samples = dsdfile.samples
+        self.unit = dsdfile.blocksize * 8
+        self.groupsize = dsdfile.blocksize * dsdfile.channels
+
+    # Input: sample position per channel
+    # Returns: (byte offset in the DSD data, phase in samples)
+    def sample(self, sample):
+        sample = min(max(sample, 0), self.samples)
+        group = sample // self.unit
+        return group * self.groupsize, sample - group * self.unit
+
+    # Input: time in seconds
+    # Returns: (byte offset in the DSD data, phase in samples)
+    def time(self, seconds):
+        return self.sample(int(round(seconds * self.rate)))
+
+# parsetime
+# Convert a "[[hh:]mm:]ss[.fff]" string to seconds
+def parsetime(timestr):
+    seconds = 0.0
+    for part in timestr.split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+# dsdmap
+# Memory mapped, zero copy access to the DSD sample data of a file.
+# Maps the file from dsdfile.datastart for dsdfile.datasize bytes (or the
+# given size) and hands out memoryview slices of the page cache.
+# An already open file descriptor (e.g. dsdprobe.fd) can be passed to avoid
+# opening the file again.
+#
+# dsdmap.size           - nr of mapped DSD data bytes
+# dsdmap.pos            - current read position, relative to datastart
+# dsdmap.data           - memoryview of all mapped DSD data
+class dsdmap(object):
+
+    def __init__(self, filename, dsdfile, size=0, fd=-1):
+        if size == 0:
+            size = dsdfile.datasize
+
+        if fd >= 0:
+            self.fd = os.dup(fd)
+        else:
+            self.fd = os.open(filename, os.O_RDONLY)
+        start = dsdfile.datastart
+        filesize = os.fstat(self.fd).st_size
+        if start + size > filesize:
+            size = filesize - start
+        if size <= 0:
+            os.close(self.fd)
+            raise ValueError("No DSD data to map in '%s'" % filename)
+
+        # mmap offsets need to be aligned to the allocation granularity
+        self.base = start - start % mmap.ALLOCATIONGRANULARITY
+        self.skip = start - self.base
+        self.map = mmap.mmap(self.fd, self.skip + size,
+                             access=mmap.ACCESS_READ, offset=self.base)
+        self.data = memoryview(self.map)[self.skip:self.skip + size]
+        self.size = size
+        self.pos = 0
+        self.released = 0
+
+    # Give the kernel read-ahead hints for the remaining data
+    def advise(self, sequential=True):
+        if sequential:
+            advice = getattr(mmap, 'MADV_SEQUENTIAL', None)
+            fadvice = getattr(os, 'POSIX_FADV_SEQUENTIAL', None)
+        else:
+            advice = getattr(mmap, 'MADV_RANDOM', None)
+            fadvice = getattr(os, 'POSIX_FADV_RANDOM', None)
+        if advice is not None and hasattr(self.map, 'madvise'):
+            self.map.madvise(advice)
+        if fadvice is not None:
+            os.posix_fadvise(self.fd, self.base + self.skip, self.size, fadvice)
+
+    # Have the kernel start reading size bytes from pos (relative to the
+    # start of the DSD data) into the page cache, without waiting for it
+    def willneed(self, pos, size):
+        pos = min(max(pos, 0), self.size)
+        size = min(size, self.size - pos)
+        if size <= 0:
+            return
+        start = (self.skip + pos) // mmap.PAGESIZE * mmap.PAGESIZE
+        advice = getattr(mmap, 'MADV_WILLNEED', None)
+        if advice is not None and hasattr(self.map, 'madvise'):
+            self.map.madvise(advice, start, self.skip + pos + size - start)
+        if hasattr(os, 'POSIX_FADV_WILLNEED'):
+            os.posix_fadvise(self.fd, self.base + self.skip + pos, size,
+                             os.POSIX_FADV_WILLNEED)
+
+    # Move the read position, relative to the start of the DSD data
+    def seek(self, pos):
+        self.pos = min(max(pos, 0), self.size)
+
+    # Return a memoryview of the next size bytes, shorter at the end of the
+    # data and empty when all data has been read
+    def read(self, size):
+        pos = self.pos
+        self.pos = min(pos + size, self.size)
+        return self.data[pos:self.pos]
+
+    # Copy the next size bytes into buf with a single pread (falls back to a
+    # copy from the mapping), for data that needs no conversion
+    # Returns: nr of bytes copied, 0 when all data has been read
+    def readinto(self, buf, size):
+        size = min(size, self.size - self.pos)
+        if size <= 0:
+            return 0
+        dst = memoryview(buf)[0:size]
+        if hasattr(os, 'preadv'):
+            size = os.preadv(self.fd, [dst], self.base + self.skip + self.pos)
+        else:
+            dst[:] = self.data[self.pos:self.pos + size]
+        self.pos += size
+        return size
+
+    # Fault in the pages of a memoryview returned by read(), so waiting for
+    # the disk is done here and not in the code using the data
+    def fault(self, data):
+        if len(data) > 0:
+            data[::mmap.PAGESIZE].tobytes()
+
+    # Generator handing out memoryviews of size bytes until all data is read
+    def blocks(self, size):
+        while self.pos < self.size:
+            yield self.read(size)
+
+    # Drop the pages before the given position (default: read position)
+    # from memory, they will not be needed again
+    def release(self, pos=-1):
+        if pos < 0:
+            pos = self.pos
+        end = (self.skip + pos) // mmap.PAGESIZE * mmap.PAGESIZE
+        if end <= self.released:
+            return
+        advice = getattr(mmap, 'MADV_DONTNEED', None)
+        if advice is not None and hasattr(self.map, 'madvise'):
+            self.map.madvise(advice, self.released, end - self.released)
+        if hasattr(os, 'POSIX_FADV_DONTNEED'):
+            os.posix_fadvise(self.fd, self.base + self.released,
+                             end - self.released, os.POSIX_FADV_DONTNEED)
+        self.released = end
+
+    def close(self):
+        if self.map is None:
+            return
+        self.data.release()
+        try:
+            self.map.close()
+        except BufferError:
+            # Memoryviews handed out are still alive, the mapping is
+            # closed once they are garbage collected
+            pass
+        os.close(self.fd)
+        self.map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+# mapsize
+# Nr of bytes of DSD data to map or read for a file, DSF data is stored in
+# whole blocks per channel so the last block group is included completely
+def mapsize(dsdfile):
+    if dsdfile.type != b'dsf':
+        return dsdfile.datasize
+    blocksize = dsdfile.blocksize
+    group = blocksize * dsdfile.channels
+    perchan = dsdfile.datasize // dsdfile.channels
+    return (perchan + blocksize - 1) // blocksize * group
+
+# dsdchannels
+# Generator reading DSD data as per channel NumPy arrays, MSB first. Handles
+# DSF block planar and DSDIFF byte interleaved data. Needs NumPy.
+# Input: dsdmap of the file, dsdfile, nr of bytes per channel per chunk
+# (rounded to whole blocks for DSF)
+# Yields: uint8 arrays of shape (channels, nbytes)
+def dsdchannels(dsd, dsdfile, size):
+    channels = dsdfile.channels
+
+    if dsdfile.type != b'dsf':
+        for data in dsd.blocks(size * channels):
+            frames = len(data) // channels
+            arr = numpy.frombuffer(data, dtype=numpy.uint8, count=frames * channels)
+            yield arr.reshape(frames, channels).T.copy()
+        return
+
+    blocksize = dsdfile.blocksize
+    nblocks = max(1, size // blocksize)
+    remain = dsdfile.datasize // channels
+    while remain > 0:
+        data = dsd.read(nblocks * blocksize * channels)
+        n = len(data) // (blocksize * channels)
+        if n == 0:
+            break
+        arr = numpy.frombuffer(data, dtype=numpy.uint8, count=n * blocksize * channels)
+        arr = arr.reshape(n, channels, blocksize).transpose(1, 0, 2).reshape(channels, -1)
+        # Drop the padding of the last block
+        if arr.shape[1] > remain:
+            arr = arr[:, 0:remain]
+        remain -= arr.shape[1]
+        if dsdfile.lsbfirst == 1:
+            arr = nprevtable[arr]
+        else:
+            arr = arr.copy()
+        yield arr
+
+# lowpass
+# Windowed sinc (Blackman) low pass FIR filter
+# Input: nr of taps, cutoff frequency relative to the sample rate
+def lowpass(ntaps, cutoff):
+    n = numpy.arange(ntaps) - (ntaps - 1) / 2.0
+    h = numpy.sinc(2 * cutoff * n) * numpy.blackman(ntaps)
+    return h / h.sum()
+
+# dsdpcm
+# Streaming DSD to PCM converter (decimator). Needs NumPy.
+# The first stage is a 64 tap FIR filter decimating by 8, evaluated with
+# one 256 entry lookup table per DSD byte of the filter. It is followed by
+# FIR stages decimating by 2 until the PCM rate is reached. All filter
+# state is carried over between calls to convert().
+#
+# Usage:
+#   pcm = dsdpcm(2822400, 88200, 2)
+#   frames = pcm.convert(chans)     # chans from dsdchannels()
+#   frames = pcm.flush()
+class dsdpcm(object):
+
+    lutbytes = 8        # Length of the first stage filter in DSD bytes
+
+    def __init__(self, dsdrate, pcmrate, channels):
+        if numpy is None:
+            raise ImportError("DSD to PCM conversion needs NumPy")
+
+        ratio = dsdrate // pcmrate
+        stages = 0
+        while ratio > 8 and ratio % 2 == 0:
+            ratio //= 2
+            stages += 1
+        if ratio != 8 or dsdrate % pcmrate != 0:
+            raise ValueError("Cannot convert %d Hz DSD to %d Hz PCM" % (dsdrate, pcmrate))
+
+        self.dsdrate = dsdrate
+        self.pcmrate = pcmrate
+        self.channels = channels
+
+        # First stage lookup tables, filter taps for the oldest byte first
+        # and the bits of every byte MSB (= oldest sample) first
+        h = lowpass(8 * self.lutbytes, 0.5 / 8 * 0.9)
+        bits = ((numpy.arange(256)[:, None] >> (7 - numpy.arange(8))) & 1) * 2.0 - 1.0
+        self.tables = numpy.stack([bits.dot(h[8*k:8*k+8])
+                                   for k in range(0, self.lutbytes)]).astype(numpy.float32)
+        self.lut_state = numpy.full((channels, self.lutbytes - 1), 0x69, dtype=numpy.uint8)
+
+        # Decimate by 2 stages, the last one has the steepest filter
+        self.filters = []
+        self.state = []
+        for i in range(0, stages):
+            if i == stages - 1:
+                h = lowpass(127, 0.5 / 2 * 0.9)
+            else:
+                h = lowpass(47, 0.5 / 2 * 0.8)
+            h = h[::-1].astype(numpy.float32)
+            self.filters.append(h)
+            self.state.append(numpy.zeros((channels, len(h) - 1), dtype=numpy.float32))
+
+        self.inbytes = 0
+        self.outframes = 0
+
+    # Convert DSD bytes to PCM
+    # Input: uint8 array (channels, nbytes), MSB first
+    # Returns: float32 array (frames, channels)
+    def convert(self, chans):
+        n = chans.shape[1]
+        self.inbytes += n
+
+        x = numpy.concatenate((self.lut_state, chans), axis=1)
+        self.lut_state = x[:, n:]
+        y = numpy.zeros((self.channels, n), dtype=numpy.float32)
+        for k in range(0, self.lutbytes):
+            y += self.tables[k][x[:, k:k+n]]
+
+        for i in range(0, len(self.filters)):
+            h = self.filters[i]
+            x = numpy.concatenate((self.state[i], y), axis=1)
+            nout = (x.shape[1] - len(h)) // 2 + 1
+            if nout <= 0:
+                self.state[i] = x
+                y = numpy.zeros((self.channels, 0), dtype=numpy.float32)
+                continue
+            windows = numpy.lib.stride_tricks.sliding_window_view(x, len(h), axis=1)
+            y = numpy.einsum('cnk,k->cn', windows[:, 0:2*nout:2, :], h)
+            self.state[i] = x[:, 2*nout:]
+
+        self.outframes += y.shape[1]
+        return numpy.ascontiguousarray(y.T)
+
+    # Push the data still in the filters out with DSD silence
+    # Returns: float32 array (frames, channels)
+    def flush(self):
+        total = self.inbytes * 8 * self.pcmrate // self.dsdrate
+        ratio = self.dsdrate // self.pcmrate // 8
+        pad = self.lutbytes + sum(len(h) for h in self.filters) * ratio
+        frames = self.convert(numpy.full((self.channels, pad), 0x69, dtype=numpy.uint8))
+        keep = max(0, total - (self.outframes - frames.shape[0]))
+        self.outframes -= frames.shape[0] - keep
+        return frames[0:keep]
+
+# pcm_s24le
+# Convert float PCM frames (full scale = 1.0) to packed 24 bit little endian
+# Returns: bytes
+def pcm_s24le(frames):
+    x = numpy.clip(numpy.rint(frames * 8388607.0), -8388608, 8388607).astype('<i4')
+    return x.view(numpy.uint8).reshape(-1, 4)[:, 0:3].tobytes()
+
+# dsdtopcm
+# Generator converting a DSD file to PCM. Needs NumPy.
+# Input: file name, PCM rate (e.g. 88200, 176400 or 352800 for 44k1 based
+# DSD rates and 96000, 192000 or 384000 for 48k based rates), nr of
+# seconds per chunk
+# Yields: float32 arrays (frames, channels)
+def dsdtopcm(filename, pcmrate, seconds=1.0):
+    info = dsdfile()
+    with dsdprobe(filename) as probe:
+        checkdsdfile(filename, info, probe)
+        if info.valid != 1:
+            raise ValueError("'%s' is not a valid DSD file" % filename)
+        if info.compress:
+            raise ValueError("'%s' uses compressed DSD data" % filename)
+        dsd = dsdmap(filename, info, mapsize(info), probe.fd)
+
+    with dsd:
+        pcm = dsdpcm(info.rate, pcmrate, info.channels)
+        size = int(info.rate // 8 * seconds)
+        for chans in dsdchannels(dsd, info, size):
+            yield pcm.convert(chans)
+            dsd.release()
+        yield pcm.flush()
+
+# dsf_deinterleave
+# Convert whole DSF block groups (one block per channel) to DSDIFF byte
+# interleaved frames. The bit order is reversed on the contiguous data, the
+# interleaving is done with one strided copy per channel (per block without
+# NumPy).
+# Input: block groups, channels, block size, nr of bytes per channel to
+# keep (the rest is padding), reverse the bit order
+# Returns: interleaved frames
+def dsf_deinterleave(data, channels, blocksize, size, reverse):
+    groups = len(data) // (blocksize * channels)
+    if reverse:
+        data = bytes(data).translate(revtable)
+    if numpy is not None:
+        arr = numpy.frombuffer(data, dtype=numpy.uint8, count=groups * blocksize * channels)
+        arr = arr.reshape(groups, channels, blocksize)
+        out = numpy.empty((groups, blocksize, channels), dtype=numpy.uint8)
+        for channel in range(channels):
+            out[:, :, channel] = arr[:, channel, :]
+        return memoryview(out.reshape(-1)[0:size * channels])
+
+    data = memoryview(data)
+    out = bytearray(size * channels)
+    for group in range(groups):
+        n = min(blocksize, size - group * blocksize)
+        if n <= 0:
+            break
+        pos = group * blocksize * channels
+        for channel in range(channels):
+            block = pos + channel * blocksize
+            out[pos + channel:pos + n * channels:channels] = data[block:block + n]
+    return out
+
+# dsf_interleave
+# Convert DSDIFF byte interleaved frames to DSF block groups, the last
+# block group is padded with zeros
+# Input: frames, channels, block size, reverse the bit order
+# Returns: block groups
+def dsf_interleave(data, channels, blocksize, reverse):
+    size = len(data) // channels
+    groups = (size + blocksize - 1) // blocksize
+    if reverse:
+        data = bytes(data).translate(revtable)
+    if numpy is not None:
+        arr = numpy.zeros((groups * blocksize, channels), dtype=numpy.uint8)
+        arr[0:size] = numpy.frombuffer(data, dtype=numpy.uint8,
+                                       count=size * channels).reshape(size, channels)
+        arr = arr.reshape(groups, blocksize, channels)
+        out = numpy.empty((groups, channels, blocksize), dtype=numpy.uint8)
+        for channel in range(channels):
+            out[:, channel, :] = arr[:, :, channel]
+        return memoryview(out.reshape(-1))
+
+    data = memoryview(data)
+    out = bytearray(groups * blocksize * channels)
+    for group in range(groups):
+        n = min(blocksize, size - group * blocksize)
+        pos = group * blocksize * channels
+        for channel in range(channels):
+            block = pos + channel * blocksize
+            out[block:block + n] = data[pos + channel:pos + n * channels:channels]
+    return out
+
+# transcode_segment
+# Convert one segment of DSD data of a transcode() job, run by the workers
+# Input: (source type, input file, input data start, output file, output
+# data start, channels, DSF block size, bytes per channel, reverse the bit
+# order, first block group, end block group)
+# Returns: nr of bytes written
+def transcode_segment(job):
+    (intype, infile, instart, outfile, outstart, channels, blocksize, perchan,
+     reverse, first, end) = job
+    groupsize = blocksize * channels
+    size = min(perchan, end * blocksize) - first * blocksize
+
+    infd = os.open(infile, os.O_RDONLY)
+    try:
+        if intype == 'dsf':
+            ingroups = (end - first) * groupsize
+            data = os.pread(infd, ingroups, instart + first * groupsize)
+            data += bytes(ingroups - len(data))
+            out = dsf_deinterleave(data, channels, blocksize, size, reverse)
+        else:
+            data = os.pread(infd, size * channels, instart + first * groupsize)
+            data += bytes(size * channels - len(data))
+            out = dsf_interleave(data, channels, blocksize, reverse)
+    finally:
+        os.close(infd)
+
+    # A block group holds as many bytes as blocksize DSDIFF frames, both
+    # segments start at the same data offset
+    outfd = os.open(outfile, os.O_WRONLY)
+    try:
+        return os.pwrite(outfd, out, outstart + first * groupsize)
+    finally:
+        os.close(outfd)
+
+# transcode
+# Lossless DSF <-> DSDIFF conversion. The output file is created with its
+# final size, the DSD data is split in segments of whole DSF block groups
+# which are converted by a pool of worker processes and written with pwrite
+# at their offset. The ID3v2 tag is carried over ('ID3 ' chunk in DSDIFF).
+# DSF files are written LSB first with 4096 byte blocks. DSDIFF holds whole
+# bytes per channel, a DSF sample count that is not a multiple of 8 is
+# rounded up.
+# Input: input file, output file, output type ('dsf' or 'dsdiff', default:
+# the other type), nr of workers (default: nr of CPUs), segment size
+# Returns: nr of DSD data bytes written
+def transcode(infile, outfile, outtype=None, workers=None, segsize=1 << 24):
+    info, reason = quietcheck(infile)
+    if info.valid != 1:
+        raise ValueError("'%s' is not a valid DSD file: %s" % (infile, reason))
+    intype = info.type.decode("UTF-8")
+    if outtype is None:
+        outtype = 'dsdiff' if intype == 'dsf' else 'dsf'
+    if outtype == intype or outtype not in ('dsf', 'dsdiff'):
+        raise ValueError("cannot convert %s to %s" % (intype, outtype))
+    if info.compress:
+        raise ValueError("'%s' uses compressed DSD data" % infile)
+    channels = info.channels
+    if channels not in dsf_chantype:
+        raise ValueError("unsupported nr of channels %d" % channels)
+    chantype = chanlayout(info)
+
+    tag = b''
+    if info.id3len:
+        with open(infile, "rb") as f:
+            f.seek(info.id3tag)
+            tag = f.read(info.id3len)
+
+    perchan = (info.samples + 7) // 8
+    if intype == 'dsf':
+        blocksize = info.blocksize
+        reverse = info.lsbfirst == 1
+        trailer = dsdiffchunk('ID3 ', tag) if tag else b''
+        datasize = perchan * channels
+        header = dsdiffheader(info.rate, channels, datasize, len(trailer), chantype)
+        total = len(header) + datasize + (datasize & 1) + len(trailer)
+    else:
+        blocksize = 4096
+        reverse = True
+        trailer = tag
+        header = dsfheader(info.rate, channels, perchan * 8, len(tag), chantype=chantype)
+        total = struct.unpack_from('<Q', header, 12)[0]
+
+    with open(outfile, "wb") as f:
+        f.write(header)
+        f.truncate(total)
+        if trailer:
+            f.seek(total - len(trailer))
+            f.write(trailer)
+
+    groups = (perchan + blocksize - 1) // blocksize
+    step = max(1, segsize // (blocksize * channels))
+    jobs = [(intype, infile, info.datastart, outfile, len(header), channels,
+             blocksize, perchan, reverse, first, min(first + step, groups))
+            for first in range(0, groups, step)]
+
+    return runsegments(jobs, workers)
+
+# runsegments
+# Run transcode_segment() jobs, in a pool of worker processes if there is
+# more than one job
+# Returns: nr of bytes written
+def runsegments(jobs, workers=None):
+    written = 0
+    if workers == 1 or len(jobs) <= 1:
+        for job in jobs:
+            written += transcode_segment(job)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            for size in pool.map(transcode_segment, jobs):
+                written += size
+    return written
+
+# copyrange
+# Copy size bytes between files in the kernel, with copy_file_range or
+# (e.g. across file systems) sendfile. The data is not copied to user space.
+# Input: input fd, offset, size, output fd, offset
+# Returns: nr of bytes copied
+def copyrange(infd, inpos, size, outfd, outpos):
+    copy = getattr(os, 'copy_file_range', None)
+    copied = 0
+    while copied < size:
+        if copy is not None:
+            try:
+                n = copy(infd, outfd, size - copied, inpos + copied, outpos + copied)
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                   errno.EOPNOTSUPP):
+                    raise
+                copy = None
+                continue
+        else:
+            os.lseek(outfd, outpos + copied, os.SEEK_SET)
+            n = os.sendfile(outfd, infd, inpos + copied, size - copied)
+        if n == 0:
+            break           # Input file too short
+        copied += n
+    return copied
+
+# dsdifftracks
+# Tracks of a DSDIFF edited master from its markers. A track starts at a
+# TrackStart marker (any marker if there are none) and ends at the next
+# TrackStart, a TrackStop or the end of the data.
+# Input: filename, checked dsdfile, optional probe of the file
+# Returns: list of (start sample, end sample, marker text) tuples
+def dsdifftracks(filename, dsdfile, probe=None):
+    marks = dsdiffmarks(filename, dsdfile, probe)
+    starts = [mark for mark in marks if mark[1] == 0] or marks
+    stops = [mark[0] for mark in marks if mark[1] == 1]
+
+    tracks = []
+    for i in range(len(starts)):
+        start, marktype, text = starts[i]
+        end = dsdfile.samples
+        if i + 1 < len(starts):
+            end = starts[i + 1][0]
+        for stop in stops:
+            if start < stop < end:
+                end = stop
+                break
+        if start < min(end, dsdfile.samples):
+            tracks.append((start, min(end, dsdfile.samples), text))
+    return tracks
+
+# extract
+# Write samples start to end of an uncompressed DSDIFF file as a DSDIFF or
+# DSF file. Positions are rounded down to 4 bytes (32 samples) per channel,
+# so the DSD data holds whole 4 byte words per channel, and the tracks of a
+# master split at consecutive positions join up without gaps. A track up to
+# the end of the master is padded with DSD silence to a whole word in DSDIFF
+# files. DSDIFF data is copied by the kernel (copyrange()), DSF data
+# is converted by transcode_segment() jobs. The ID3v2 tag of the master is
+# carried over with the title as TIT2 frame, a master without a tag gives a
+# tag with just the title. DSDIFF files also get the title in a DIIN/DITI
+# chunk.
+# Input: input file, output file, start and end sample, output type ('dsf'
+# or 'dsdiff'), title, nr of workers, segment size, optional checked
+# dsdfile of the input file
+# Returns: nr of DSD data bytes copied from the input file, the padding of
+# the last word (DSDIFF) or block (DSF) not included
+def extract(infile, outfile, start, end, outtype='dsdiff', title='',
+            workers=1, segsize=1 << 24, info=None):
+    if info is None:
+        info, reason = quietcheck(infile)
+        if info.valid != 1:
+            raise ValueError("'%s' is not a valid DSD file: %s" % (infile, reason))
+    if info.type != b'dsdiff' or info.compress:
+        raise ValueError("'%s' is not an uncompressed DSDIFF file" % infile)
+    channels = info.channels
+    if channels not in dsf_chantype:
+        raise ValueError("unsupported nr of channels %d" % channels)
+    chantype = chanlayout(info)
+
+    first = min(max(start, 0), info.samples) // 32 * 4
+    last = info.samples // 8 if end >= info.samples else max(end, 0) // 32 * 4
+    perchan = max(last - first, 0)
+    pad = -perchan % 4 if outtype != 'dsf' else 0
+    instart = info.datastart + first * channels
+
+    tag = b''
+    if info.id3len:
+        with open(infile, "rb") as f:
+            f.seek(info.id3tag)
+            tag = f.read(info.id3len)
+
+    if title != '':
+        version, frames = id3rawframes(infile) if tag else (4, [])
+        frames = [data for frame_id, data in frames if frame_id != 'TIT2']
+        tag = buildid3([id3frame('TIT2', title, version)] + frames, version)
+
+    if outtype == 'dsf':
+        header = dsfheader(info.rate, channels, perchan * 8, len(tag), chantype=chantype)
+        total = struct.unpack_from('<Q', header, 12)[0]
+        trailer = tag
+    else:
+        trailer = b''
+        if title != '':
+            text = title.encode("latin-1", "replace")
+            trailer += dsdiffchunk('DIIN', dsdiffchunk('DITI', struct.pack('>L', len(text)) + text))
+        if tag:
+            trailer += dsdiffchunk('ID3 ', tag)
+        datasize = (perchan + pad) * channels
+        header = dsdiffheader(info.rate, channels, datasize, len(trailer), chantype)
+        total = len(header) + datasize + (datasize & 1) + len(trailer)
+
+    with open(outfile, "wb") as f:
+        f.write(header)
+        f.truncate(total)
+        if trailer:
+            f.seek(total - len(trailer))
+            f.write(trailer)
+
+    if outtype == 'dsf':
+        step = max(1, segsize // (4096 * channels))
+        groups = (perchan + 4095) // 4096
+        jobs = [('dsdiff', infile, instart, outfile, len(header), channels, 4096,
+                 perchan, True, group, min(group + step, groups))
+                for group in range(0, groups, step)]
+        runsegments(jobs, workers)
+        return perchan * channels
+
+    infd = os.open(infile, os.O_RDONLY)
+    try:
+        outfd = os.open(outfile, os.O_WRONLY)
+        try:
+            done = copyrange(infd, instart, perchan * channels, outfd, len(header))
+            if pad:
+                os.pwrite(outfd, b'\x69' * (pad * channels),
+                          len(header) + perchan * channels)
+            return done
+        finally:
+            os.close(outfd)
+    finally:
+        os.close(infd)
+
+
+# walkdsd
+# Walk the directory tree below topdir
+# Input: directory, file name extensions to look for
+# Yields: (path, size, mtime, inode) for every DSF/DSDIFF file
+def walkdsd(topdir, exts=('.dsf', '.dff')):
+    dirs = [topdir]
+    while dirs:
+        try:
+            entries = os.scandir(dirs.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                        continue
+                    if not entry.name.lower().endswith(exts):
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    continue
+                yield entry.path, st.st_size, st.st_mtime_ns, st.st_ino
+
+# finddsdfiles
+# Expand a list of files and directories, directories are searched for
+# DSF/DSDIFF files with the given extensions. Files named in the list are
+# always kept.
+# Yields: file names
+def finddsdfiles(paths, exts=('.dsf', '.dff')):
+    for path in paths:
+        if os.path.isdir(path):
+            for found in walkdsd(path, exts):
+                yield found[0]
+        else:
+            yield path
+
+# quietcheck
+# Check a single file without debug output, read errors make the file invalid
+# Input: filename, optional probe of the file
+# Returns: dsdfile, reason why the file is not valid (empty if it is)
+def quietcheck(filename, probe=None):
+    info = dsdfile()
+    try:
+        checkdsdfile(filename, info, probe, quiet=True)
+        reason = info.reason.decode("UTF-8", "replace")
+    except (OSError, ValueError, struct.error) as e:
+        info.valid = 0
+        reason = str(e)
+
+    return info, reason
+
+# mpdhang
+# The DSDIFF sample data size is not a multiple of 4, which could hang MPD at
+# the end of the song
+def mpdhang(info):
+    return (info.type == b'dsdiff' and info.valid == 1 and not info.compress
+            and info.datasize % 4 != 0)
+
+# checkresult
+# Returns: dict with path, type, valid, confidence, reason and mpdhang of a
+# checked file
+def checkresult(filename, info, reason):
+    return {
+        'path' : filename,
+        'type' : info.type.decode("UTF-8"),
+        'valid' : info.valid == 1,
+        'confidence' : info.confedence,
+        'reason' : reason,
+        'mpdhang' : mpdhang(info)
+    }
+
+# validate
+# Validate a single file, without debug output
+# Returns: checkresult() dict
+def validate(filename):
+    info, reason = quietcheck(filename)
+    return checkresult(filename, info, reason)
+
+# fileinfo
+# All header info of a single file, without debug output
+# Returns: checkresult() dict extended with the info_fields
+info_fields = ['version', 'channels', 'rate', 'ratename', 'samples',
+               'seconds', 'blocksize', 'lsbfirst', 'compress', 'abss',
+               'fsize', 'datastart', 'datasize', 'id3tag', 'id3len']
+
+def fileinfo(filename):
+    info, reason = quietcheck(filename)
+    result = checkresult(filename, info, reason)
+    for field in info_fields:
+        if field == 'ratename':
+            result[field] = rate_to_string(info.rate) if info.rate else ''
+        elif field == 'seconds':
+            result[field] = (round(info.samples / info.rate, 3)
+                             if info.rate else 0)
+        elif field in ('lsbfirst', 'compress'):
+            result[field] = bool(getattr(info, field))
+        else:
+            result[field] = getattr(info, field)
+    return result
+
+# checkfiles
+# Run func (validate, fileinfo) on many files using a pool of worker
+# processes
+# Input: function, iterable of file names, nr of workers (default: nr of
+# CPUs), nr of files handed to a worker at once
+# Yields: func() results, in the order of the input
+def checkfiles(func, paths, workers=None, chunksize=32):
+    if workers == 1:
+        for path in paths:
+            yield func(path)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        for result in pool.map(func, paths, chunksize=chunksize):
+            yield result
+
+# validate_files
+# Validate many files using a pool of worker processes
+# Yields: validate() results, in the order of the input
+def validate_files(paths, workers=None, chunksize=32):
+    return checkfiles(validate, paths, workers, chunksize)
+
+# infook
+# Whether a fileinfo() or validate() result is a valid file of the given
+# type ('dsf' or 'dsdiff', None for either)
+def infook(result, ftype=None):
+    return result['valid'] and (ftype is None or result['type'] == ftype)
+
+# writeinfo
+# Write fileinfo() or validate() results as JSON lines or CSV ('json' or
+# 'csv'), one line per file while the results come in
+# Input: results, format, output file, file type the files should have (None
+# for either, see infook())
+# Returns: nr of files, nr of files that are not valid
+def writeinfo(results, fmt, out=sys.stdout, ftype=None):
+    files = 0
+    bad = 0
+    writer = None
+    for result in results:
+        if fmt == 'csv':
+            if writer is None:
+                writer = csv.DictWriter(out, list(result))
+                writer.writeheader()
+            writer.writerow(result)
+        else:
+            out.write(json.dumps(result) + "\n")
+        out.flush()
+        files += 1
+        if not infook(result, ftype):
+            bad += 1
+    return files, bad
+
+# dsdindex
+# Incremental SQLite backed index of DSD files. Stores the dsdfile fields of
+# every DSF/DSDIFF file below a directory, keyed by path, size, mtime and
+# inode. A re-scan only parses files that are new or have changed.
+# The schema version is kept in the database (PRAGMA user_version), an index
+# written with an older schema is dropped and filled again by the next scan.
+#
+# Usage:
+#   index = dsdindex("library.db")
+#   scanned, parsed, removed = index.scan("/music")
+#   info = index.lookup("/music/album/track.dsf")
+class dsdindex(object):
+
+    fields = ['type', 'valid', 'rate', 'channels', 'datastart', 'datasize',
+              'fsize', 'id3tag', 'lsbfirst', 'compress', 'blocksize', 'samples',
+              'abss', 'id3len', 'chantype']
+
+    # Version of the files table, raise it when the fields change
+    schema = 2
+
+    def __init__(self, dbname):
+        self.db = sqlite3.connect(dbname)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version != self.schema:
+            # The rows lack fields, all files need to be parsed again
+            self.db.execute("DROP TABLE IF EXISTS files")
+        self.db.execute("CREATE TABLE IF NOT EXISTS files ("
+                        "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, "
+                        "inode INTEGER, %s)" %
+                        ", ".join("%s %s" % (field, "TEXT" if field == 'type' else "INTEGER")
+                                  for field in self.fields))
+        self.db.execute("PRAGMA user_version = %d" % self.schema)
+        self.db.commit()
+
+    # Parse a single file, returns the row to store
+    def parse(self, path, size, mtime, inode):
+        info, reason = quietcheck(path)
+        row = [path, size, mtime, inode]
+        for field in self.fields:
+            value = getattr(info, field)
+            if field == 'type':
+                value = value.decode("UTF-8")
+            else:
+                value = int(value)
+            row.append(value)
+        return row
+
+    # Scan topdir, returns nr of DSD files found, parsed and removed
+    def scan(self, topdir):
+        topdir = os.path.abspath(topdir)
+        prefix = os.path.join(topdir, '')
+
+        known = {}
+        cur = self.db.execute("SELECT path, size, mtime, inode FROM files "
+                              "WHERE path = ? OR substr(path, 1, ?) = ?",
+                              (topdir, len(prefix), prefix))
+        for path, size, mtime, inode in cur:
+            known[path] = (size, mtime, inode)
+
+        scanned = 0
+        rows = []
+        for path, size, mtime, inode in walkdsd(topdir):
+            scanned += 1
+            if known.pop(path, None) == (size, mtime, inode):
+                continue
+            rows.append(self.parse(path, size, mtime, inode))
+
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO files VALUES (%s)" %
+                                ",".join("?" * (4 + len(self.fields))), rows)
+            self.db.executemany("DELETE FROM files WHERE path = ?",
+                                [(path,) for path in known])
+
+        return scanned, len(rows), len(known)
+
+    # Look up a file in the index
+    # Returns: dsdfile structure or None if the file is not in the index
+    def lookup(self, path):
+        cur = self.db.execute("SELECT %s FROM files WHERE path = ?" %
+                              ", ".join(self.fields),
+                              (os.path.abspath(path),))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        info = dsdfile()
+        for field, value in zip(self.fields, row):
+            if field == 'type':
+                value = value.encode("UTF-8")
+            setattr(info, field, value)
+        return info
+
+    # Iterate over (path, dsdfile) for all indexed files
+    def files(self):
+        cur = self.db.execute("SELECT path FROM files ORDER BY path")
+        for (path,) in cur.fetchall():
+            yield path, self.lookup(path)
+
+    def close(self):
+        self.db.close()
 
@@ -0,0 +1,572 @@
+#!/usr/bin/env python
+
+# dsdplayd.py
+# DSD playback daemon. Keeps the output open and the headers of played files
+# cached, and takes commands from clients on a local (Unix) socket, one
+# command per line:
+#   play <file>     play a file now, the queue is kept
+#   queue <file>    add a file to the queue, same format files play gapless
+#   pause           pause or resume playback
+#   stop            stop playback and clear the queue
+#   seek <time>     continue the current file at [[hh:]mm:]ss[.fff]
+#   status          state, file, position, queue and timing stats
+# Every command gets a single JSON line as reply.
+# Uses playdsd.py and dsdlib.py
+# License: GPLv2
+#
+# v0.1 18-Oct-2026
+# Initial version
+
+import asyncio
+import collections
+import concurrent.futures
+import getopt
+import json
+import os
+import queue
+import signal
+import socket
+import sys
+import threading
+import time
+
+import dsdlib
+import playdsd
+
+# Seconds of audio per write to the output, commands are handled between
+# writes so this bounds the time until a command is heard
+slicetime = 0.01
+
+#-- Functions
+
+# trackcache
+# Opens files for playback. The checked dsdfile of every file opened before
+# is kept, keyed by path, size and mtime, so opening it again only maps the
+# DSD data. Used from several threads.
+#
+# trackcache.hits       - nr of opens served from the cache
+# trackcache.misses     - nr of opens that parsed the file headers
+class trackcache(object):
+
+    def __init__(self):
+        self.files = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    # Open a file for playback
+    # Returns: dsdtrack and None, or None and the reason it cannot be played
+    def open(self, filename):
+        try:
+            st = os.stat(filename)
+        except OSError as e:
+            return None, "Cannot open '%s', %s" % (filename, e.strerror)
+        key = (os.path.abspath(filename), st.st_size, st.st_mtime_ns)
+        with self.lock:
+            myfile = self.files.get(key)
+
+        if myfile is None:
+            messages = []
+            track = playdsd.opentrack(filename, messages.append)
+            if track is None:
+                return None, messages[-1].strip() if messages else "Cannot play '%s'" % filename
+            with self.lock:
+                self.files[key] = track.myfile
+                self.misses += 1
+            return track, None
+
+        try:
+            dsd = dsdlib.dsdmap(filename, myfile, dsdlib.mapsize(myfile))
+        except Exception as e:
+            return None, "Cannot read DSD data of '%s', %s" % (filename, e)
+        dsd.advise()
+        track = playdsd.dsdtrack(filename, myfile, dsd)
+        track.prefetch()
+        with self.lock:
+            self.hits += 1
+        return track, None
+
+# dsdplayer
+# The audio side of the daemon. A reader thread converts the chunks of the
+# current track, and of queued tracks with the same format, into a bounded
+# queue. The player thread writes them to the output in slices of slicetime
+# seconds and handles commands in between. Every command that changes what
+# is played starts a new generation, chunks of older generations are
+# dropped. The output stays open as long as the DSD rate and nr of channels
+# stay the same.
+# After every slice and command a new status dict is published, clients read
+# it without taking any lock the audio threads use.
+#
+# dsdplayer.status      - latest status dict
+class dsdplayer(object):
+
+    def __init__(self, output, audiodev, dop, formats, bufferms, cache):
+        self.output = output
+        self.audiodev = audiodev
+        self.dop = dop
+        self.formats = formats
+        self.cache = cache
+        self.stats = playdsd.dsdstats()
+        self.depth = max(2, bufferms // 100)
+        self.commands = queue.Queue()
+        self.sources = queue.Queue()
+        self.fifo = queue.Queue(self.depth)
+        self.queue = collections.deque()
+        self.qlock = threading.Lock()
+        self.generation = 0
+        self.sink = None
+        self.pcm = None
+        self.rings = None
+        self.current = None
+        self.track = None
+        self.written = 0
+        self.state = 'stopped'
+        self.requested = 0
+        self.switchms = None
+        self.publish()
+
+    def start(self):
+        for target in (self.reader, self.player):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    # Send a command to the player thread, t is the time it was received
+    # Returns: asyncio future for the reply dict
+    def request(self, name, arg=None, t=None):
+        future = concurrent.futures.Future()
+        self.commands.put((name, arg, future, t or time.perf_counter()))
+        return asyncio.wrap_future(future)
+
+    # Stop playback and close the output, waits for the player thread. A
+    # player thread that does not stop in time (e.g. stuck in a write to the
+    # output) is left behind, the output is closed from here.
+    def shutdown(self):
+        future = concurrent.futures.Future()
+        self.commands.put(('quit', None, future, time.perf_counter()))
+        try:
+            future.result(5)
+        except concurrent.futures.TimeoutError:
+            print("Player thread did not stop, closing the output")
+            if self.sink is not None:
+                try:
+                    self.sink.close()
+                except Exception as e:
+                    print("Cannot close the output, %s" % e)
+
+    def publish(self):
+        position = 0.0
+        duration = 0.0
+        track = self.track
+        if track is not None:
+            rate = track.myfile.rate
+            position = track.start / rate + self.written / (self.pcm.rate * self.pcm.framebytes)
+            duration = track.myfile.samples / rate
+        with self.qlock:
+            queued = [t.filename for t in self.queue]
+        self.status = {
+            'state' : self.state,
+            'file' : track.filename if track is not None else None,
+            'position' : round(position, 3),
+            'duration' : round(duration, 3),
+            'output' : self.pcm.describe()[8:] if self.pcm is not None else None,
+            'queue' : queued,
+            'switch_ms' : self.switchms,
+            'underruns' : self.stats.underruns,
+            'cache' : { 'hits' : self.cache.hits, 'misses' : self.cache.misses }
+        }
+
+    # Reader thread: convert the chunks of the sources handed over by the
+    # player thread
+    def reader(self):
+        while True:
+            gen, track, pcm, rings = self.sources.get()
+            try:
+                self.feed(gen, track, pcm, rings)
+            except Exception as e:
+                print("Error while reading DSD data: %s" % e)
+                self.fifo.put((gen, None, None, 0, None))
+
+    def feed(self, gen, track, pcm, rings):
+        ring, outring = rings
+        join = playdsd.dsdjoin(pcm.fmt)
+        while True:
+            chunks = join.chunks(track, ring, pcm.periodsize, self.stats)
+            if not self.forward(gen, track, chunks, pcm, rings):
+                track.close()
+                return
+            track.close()
+            # The next queued track with the same format follows directly
+            with self.qlock:
+                if (gen != self.generation or len(self.queue) == 0 or
+                    not track.sameformat(self.queue[0])):
+                    break
+                track = self.queue.popleft()
+        # Pad the partial frame left by the last track
+        if not self.forward(gen, track, join.flush(ring, pcm.channels), pcm, rings):
+            return
+        self.fifo.put((gen, None, None, 0, None))
+
+    # Hand the chunks of a track to the player thread
+    # Returns: False if the generation changed while converting
+    def forward(self, gen, track, chunks, pcm, rings):
+        ring, outring = rings
+        if pcm.dop:
+            chunks = playdsd.dopchunks(chunks, ring, outring, pcm.channels, pcm.dop,
+                                       self.stats)
+        for buf, size in chunks:
+            if gen != self.generation:
+                outring.put(buf)
+                return False
+            self.stats.period(size)
+            self.fifo.put((gen, track, buf, size, outring))
+        return True
+
+    # Player thread: handle commands, write slices while playing
+    def player(self):
+        while True:
+            try:
+                if self.state == 'playing':
+                    command = self.commands.get_nowait()
+                else:
+                    command = self.commands.get()
+            except queue.Empty:
+                self.play()
+                continue
+            name, arg, future, t = command
+            if name == 'quit':
+                self.close()
+                future.set_result({ 'ok' : True })
+                return
+            try:
+                reply = self.handle(name, arg, t)
+            except Exception as e:
+                reply = { 'ok' : False, 'error' : str(e) }
+            self.publish()
+            future.set_result(reply)
+
+    # Drop the chunks of older generations
+    def flush(self):
+        if self.current is not None:
+            buf, size, pos, ring = self.current
+            ring.put(buf)
+            self.current = None
+        while True:
+            try:
+                gen, track, buf, size, ring = self.fifo.get_nowait()
+            except queue.Empty:
+                break
+            if buf is not None:
+                ring.put(buf)
+
+    def handle(self, name, arg, t):
+        if name in ('play', 'seek'):
+            error = self.begin(arg, t, True)
+            if error is not None:
+                return error
+        elif name == 'queue':
+            if self.state == 'stopped':
+                error = self.begin(arg, t, True)
+                if error is not None:
+                    return error
+            else:
+                with self.qlock:
+                    self.queue.append(arg)
+        elif name == 'pause':
+            if self.state == 'stopped':
+                return { 'ok' : False, 'error' : "Not playing" }
+            self.sink.pause(self.state == 'playing')
+            if self.state == 'paused':
+                self.state = 'playing'
+                self.stats.begin(self.pcm.rate * self.pcm.framebytes, self.pcm.framebytes)
+            else:
+                self.state = 'paused'
+        elif name == 'stop':
+            self.generation += 1
+            self.flush()
+            with self.qlock:
+                for track in self.queue:
+                    track.close()
+                self.queue.clear()
+            if self.sink is not None:
+                self.sink.drop()
+            self.track = None
+            self.state = 'stopped'
+        return { 'ok' : True, 'state' : self.state }
+
+    # Start playing a track, replacing what is playing when drop is set
+    # Returns: None, an error reply when the output could not be opened
+    def begin(self, track, t, drop):
+        self.generation += 1
+        self.flush()
+        pcm = playdsd.pcmformat(track, self.dop, self.formats)
+        if (self.sink is not None and self.pcm.dsdrate == pcm.dsdrate and
+            self.pcm.channels == pcm.channels):
+            # Keep the output open, the track is converted to its format
+            pcm = self.pcm
+            if drop:
+                self.sink.drop()
+        else:
+            if self.sink is not None:
+                self.sink.close()
+                self.sink = None
+            try:
+                self.sink = self.output.open(self.audiodev, pcm.rate, pcm.channels,
+                                             pcm.period, pcm.name, pcm.framebytes)
+            except Exception as e:
+                # Nothing is playing anymore, the old output is closed
+                self.generation += 1
+                self.track = None
+                self.pcm = None
+                self.state = 'stopped'
+                return { 'ok' : False, 'error' : "Cannot open the output: %s" % e }
+            self.pcm = pcm
+            print(pcm.describe())
+            ring = playdsd.dsdring(self.depth + 2, pcm.periodsize * 4 * pcm.channels)
+            outring = ring
+            if pcm.dop:
+                ring = playdsd.dsdring(2, pcm.periodsize * 4 * pcm.channels)
+                outring = playdsd.dsdring(self.depth + 2,
+                                          pcm.periodsize * 2 * pcm.channels * pcm.dop,
+                                          lambda buf: playdsd.dopmarkers(buf, pcm.channels,
+                                                                         pcm.dop))
+            self.rings = (ring, outring)
+            playdsd.playdsdsilence(self.sink, pcm.dsdrate, 10, pcm.dop, pcm.channels)
+        self.stats.begin(pcm.rate * pcm.framebytes, pcm.framebytes)
+        self.slicebytes = max(1, int(pcm.rate * slicetime)) * pcm.framebytes
+        self.sources.put((self.generation, track, pcm, self.rings))
+        self.track = track
+        self.written = 0
+        self.state = 'playing'
+        self.requested = t
+        self.switchms = None
+
+    # Write the next slice of audio
+    def play(self):
+        if self.current is None:
+            try:
+                gen, track, buf, size, ring = self.fifo.get(timeout=slicetime)
+            except queue.Empty:
+                return
+            if gen != self.generation:
+                if buf is not None:
+                    ring.put(buf)
+                return
+            if track is None:
+                self.next()
+                self.publish()
+                return
+            if track is not self.track:
+                # Next track of a gapless run
+                self.track = track
+                self.written = 0
+            self.current = [buf, size, 0, ring]
+
+        buf, size, pos, ring = self.current
+        n = min(size - pos, self.slicebytes)
+        if self.switchms is None:
+            # Time from the command to its first audio handed to the output
+            self.switchms = round((time.perf_counter() - self.requested) * 1000, 2)
+        t0 = time.perf_counter_ns()
+        ret = self.sink.write(memoryview(buf)[pos:pos + n])
+        self.stats.write(time.perf_counter_ns() - t0, n, ret)
+        pos += n
+        self.written += n
+        if pos == size:
+            ring.put(buf)
+            self.current = None
+        else:
+            self.current[2] = pos
+        self.publish()
+
+    # The reader finished a run of tracks, start the next queued track
+    def next(self):
+        with self.qlock:
+            track = self.queue.popleft() if len(self.queue) else None
+        if track is not None:
+            error = self.begin(track, time.perf_counter(), False)
+            if error is not None:
+                print(error['error'])
+                track.close()
+        else:
+            self.track = None
+            self.state = 'stopped'
+
+    def close(self):
+        self.generation += 1
+        self.flush()
+        if self.sink is not None:
+            self.sink.close()
+
+# handover
+# Hand an opened track to the player thread, the track is closed again when
+# the player did not take it (e.g. the output could not be opened)
+# Returns: reply dict
+async def handover(player, name, track, t):
+    reply = await player.request(name, track, t)
+    if not reply['ok']:
+        track.close()
+    return reply
+
+# command
+# Handle a command line of a client
+# Returns: reply dict
+async def command(player, cache, line):
+    t = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    name, sep, arg = line.strip().partition(' ')
+    arg = arg.strip()
+    if name == 'status':
+        reply = dict(player.status)
+        reply['ok'] = True
+        return reply
+    if name in ('pause', 'stop'):
+        return await player.request(name, None, t)
+    if name in ('play', 'queue'):
+        if arg == '':
+            return { 'ok' : False, 'error' : "Missing file name" }
+        # Opening a file can wait for the disk, keep the event loop free
+        track, error = await loop.run_in_executor(None, cache.open, arg)
+        if track is None:
+            return { 'ok' : False, 'error' : error }
+        return await handover(player, name, track, t)
+    if name == 'seek':
+        try:
+            seconds = dsdlib.parsetime(arg)
+        except ValueError:
+            return { 'ok' : False, 'error' : "Wrong time '%s'" % arg }
+        filename = player.status['file']
+        if filename is None:
+            return { 'ok' : False, 'error' : "Not playing" }
+        track, error = await loop.run_in_executor(None, cache.open, filename)
+        if track is None:
+            return { 'ok' : False, 'error' : error }
+        track.seektime(seconds)
+        return await handover(player, name, track, t)
+    return { 'ok' : False, 'error' : "Unknown command '%s'" % name }
+
+# client
+# Serve one client connection until it closes
+async def client(reader, writer, player, cache):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            reply = await command(player, cache, line.decode("UTF-8", "replace"))
+            writer.write((json.dumps(reply) + "\n").encode("UTF-8"))
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+# serve
+# Run the control socket until SIGINT or SIGTERM
+async def serve(player, cache, path):
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    server = await asyncio.start_unix_server(lambda r, w: client(r, w, player, cache),
+                                             path=path)
+    print("Listening on '%s'" % path)
+    async with server:
+        await stop.wait()
+
+# sendcommand
+# Send a single command to a running daemon
+# Returns: reply line
+def sendcommand(path, line):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path)
+        s.sendall((line + "\n").encode("UTF-8"))
+        with s.makefile('r', encoding="UTF-8") as f:
+            return f.readline().strip()
+
+def usage(errstring):
+    if errstring != "":
+        print(errstring)
+    print("\nUsage:\n")
+    print("\tdsdplayd.py -c <audiocard> | -o <output> [-b <buffer ms>] [-d | -F <format>] [-S <socket>]")
+    print("\n\tStarts the daemon, -o, -d and -F work as for playdsd.py")
+    print("\n\tdsdplayd.py [-S <socket>] -x '<command>'")
+    print("\n\tSends a command to a running daemon and prints the reply:")
+    print("\tplay <file>, queue <file>, pause, stop, seek <time> or status\n")
+
+#-- Main
+if __name__ == "__main__":
+    audiodev = ''
+    output = playdsd.dsdoutput('alsa')
+    bufferms = 500
+    usedop = False
+    forcefmt = None
+    path = os.path.join(os.environ.get('XDG_RUNTIME_DIR', '/tmp'), 'dsdplayd.sock')
+    sendline = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hc:o:b:dF:S:x:",
+                                   ["card=", "output=", "buffer=", "dop", "format=", "socket=",
+                                    "command="])
+    except getopt.GetoptError:
+        usage("Wrong arguments given")
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            usage("")
+            sys.exit(1)
+        elif opt in ("-c", "--card"):
+            audiodev = arg
+        elif opt in ("-o", "--output"):
+            try:
+                output = playdsd.dsdoutput(arg)
+            except ValueError as e:
+                usage(str(e))
+                sys.exit(2)
+        elif opt in ("-b", "--buffer"):
+            bufferms = int(arg)
+        elif opt in ("-d", "--dop"):
+            usedop = True
+        elif opt in ("-F", "--format"):
+            forcefmt = arg.upper()
+            if forcefmt not in playdsd.dsdformats:
+                usage("Unknown DSD sample format '%s'" % arg)
+                sys.exit(2)
+        elif opt in ("-S", "--socket"):
+            path = arg
+        elif opt in ("-x", "--command"):
+            sendline = arg
+
+    if sendline is not None:
+        try:
+            print(sendcommand(path, sendline))
+        except OSError as e:
+            print("Cannot reach dsdplayd on '%s', %s" % (path, e))
+            sys.exit(1)
+        sys.exit(0)
+
+    if output.kind == 'alsa' and playdsd.alsaaudio is None:
+        print("Failed to import 'alsaaudio', only -o file:, null and pipe: outputs can be used")
+        sys.exit(1)
+    if output.kind == 'alsa' and audiodev == "":
+        usage("Missing audio device")
+        sys.exit(1)
+
+    dsdlib.debug = False
+    dop, formats = playdsd.checkoutput(output, audiodev, usedop, forcefmt)
+
+    if os.path.exists(path):
+        os.unlink(path)
+    cache = trackcache()
+    player = dsdplayer(output, audiodev, dop, formats, bufferms, cache)
+    player.start()
+    try:
+        asyncio.run(serve(player, cache, path))
+    finally:
+        try:
+            player.shutdown()
+        finally:
+            if os.path.exists(path):
+                os.unlink(path)
+    sys.exit(0)
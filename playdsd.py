@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 
 # playdsd.py - Native DSD playback for DSD files
-# Uses DSD_U32_BE sample format
+# Uses the native DSD sample format (DSD_U8, DSD_U16_LE/BE or DSD_U32_LE/BE)
+# that needs the least work, or DoP (DSD over PCM) when native DSD is not
+# available
 # (c) 2014 Jurgen Kramer
 # License: GPLv2
 #
@@ -28,18 +30,40 @@
 # v0.82 25-Feb-2024 JK
 # DSF playback restored
 # - DSDIFF playback currently broken
+# v0.9 18-Oct-2026
+# - Convert runs of DSF blocks in one pass using strided copies
+# - Use the bit reverse table from dsdlib
+# - DSDIFF playback fixed, convert large blocks with strided copies
+# - Read DSD data through a memory map, drop played pages
+# - Separate reader/converter and ALSA writer threads with a bounded queue
+# - Preallocated ring of output buffers, no allocations while playing
+# - Open the file only once for header checks and playback
+# - DoP output mode, used when native DSD playback is not available
+# - Gapless playback of multiple files, one ALSA PCM for same rate tracks
+# - Start playback at a time offset (-s) or DSDIFF marker (-m)
+# - Per period read/convert/write timing histograms, underrun detection
+# - Multichannel playback, DSF files with any block size
+# - All native DSD sample formats, DSDIFF to DSD_U8 is played as is
+# - Output to ALSA, a raw or WAV file, a pipe or a null sink (-o), alsaaudio
+#   is only needed for ALSA output
+# - Output pause/drop and a shared PCM format setup, used by dsdplayd.py
 
 import os.path
 import re
 import sys, getopt, struct
 import signal
-
-# Make sure alsaaudio module is available
+import queue
+import threading
+import time
+import tracemalloc
+import json
+import math
+
+# The alsaaudio module is only needed for ALSA output
 try:
  import alsaaudio
 except:
-	print("Failed to import 'alsaudio'")
-	sys.exit (1)
+	alsaaudio = None
 
 # Load dsdlib
 try:
@@ -53,10 +77,29 @@ def signal_handler(signal, frame):
 	print("CTRL-C pressed")
 	sys.exit(0)
 
+# Native DSD sample formats: bytes per channel per frame, little endian.
+# The oldest DSD bit is the most significant bit of a sample word.
+dsdformats = {
+	'DSD_U8' : (1, False),
+	'DSD_U16_LE' : (2, True),
+	'DSD_U16_BE' : (2, False),
+	'DSD_U32_LE' : (4, True),
+	'DSD_U32_BE' : (4, False)
+}
+
+# Native DSD sample formats in order of the work needed to convert to them.
+# DSDIFF data is byte interleaved and is played as DSD_U8 as is. DSF blocks
+# are moved in as large words as possible, little endian formats need byte
+# copies.
+dsdprefer = {
+	'dsdiff' : ['DSD_U8', 'DSD_U32_BE', 'DSD_U16_BE', 'DSD_U16_LE', 'DSD_U32_LE'],
+	'dsf' : ['DSD_U32_BE', 'DSD_U16_BE', 'DSD_U8', 'DSD_U16_LE', 'DSD_U32_LE']
+}
+
 # Test for needed sample format support
-def dsdformat():
+def dsdformat(name='DSD_U32_BE'):
 	try:
-		audiofmt = alsaaudio.PCM_FORMAT_DSD_U32_BE
+		audiofmt = getattr(alsaaudio, 'PCM_FORMAT_' + name)
 		return 0
 	except:
 		return 1
@@ -70,20 +113,20 @@ def checkstream(streamfile):
 	# Loop through lines of stream0 file
 	for line in f:
 		line = line.replace("\n", "")
-		matchObj = re.search( r'DSD_U32_BE', line, re.M|re.I)
+		matchObj = re.search( r'DSD_U(8|16_LE|16_BE|32_LE|32_BE)', line, re.M|re.I)
 		if matchObj:
 			#print "match!", matchObj.group()
 			return 0
 	return 3
 
-# Test card for native DSD support using the DSD_U32_BE sample format, only available for USB sound cards
+# Test card for native DSD support using the DSD sample formats, only available for USB sound cards
 def checkdsd(card):
 	cardpath = "/proc/asound/" + card
 	streampath = cardpath + "/stream0"
 	if os.path.exists(cardpath):
 		#print "path ok for %s" % cardpath
 		if os.path.isfile(streampath):
-			# USB device, check for DSD_U32_BE support
+			# USB device, check for DSD sample format support
 			return checkstream(streampath)
 		else:
 			# Not a USB card"
@@ -93,7 +136,39 @@ def checkdsd(card):
 		return 2
 	return 0
 
-# Walk through available sound cards and check DSD_U32_BE sample format support
+# checkformats
+# Get the sample formats listed in the stream0 file of a (USB) card
+# Returns: set of format names, empty for non USB cards
+def checkformats(card):
+	formats = set()
+	streampath = "/proc/asound/" + card + "/stream0"
+	if not os.path.isfile(streampath):
+		return formats
+	with open(streampath, 'r') as f:
+		for line in f:
+			matchObj = re.match(r'\s*Formats?:\s*(.*)', line)
+			if matchObj:
+				formats.update(re.findall(r'[A-Z0-9_]+', matchObj.group(1)))
+	return formats
+
+# dopwidth
+# Sample width in bytes for DoP playback: 4 for S32_LE, 3 for S24_3LE
+def dopwidth(formats):
+	if 'S32_LE' not in formats and 'S24_3LE' in formats:
+		return 3
+	return 4
+
+# pickformat
+# Pick the native DSD sample format needing the least work for a file type
+# Input: sample formats supported by the output, 'dsf' or 'dsdiff'
+# Returns: format name, None if there is no usable native DSD format
+def pickformat(formats, dsdtype):
+	for name in dsdprefer[dsdtype]:
+		if name in formats:
+			return name
+	return None
+
+# Walk through available sound cards and check DSD sample format support
 # This only works for USB based soundcards
 def checksndcards():
 	cards = alsaaudio.cards()
@@ -109,13 +184,14 @@ def checksndcards():
 			print("'%s'\t:" % cards[i],)
 		dsd = checkdsd(cards[i])
 		if dsd == 0:
-			print("USB device with native DSD support")
+			names = [name for name in dsdformats if name in checkformats(cards[i])]
+			print("USB device with native DSD support (%s)" % ", ".join(names))
 		elif dsd == 1:
 			print("Not a (UAC2) USB sound card")
 		elif dsd == 2:
 			print("No proc entry for '%s'" % cards[i])
 		elif dsd == 3:
-			print("USB device, no native DSD support")
+			print("USB device, no native DSD support (DoP only)")
 		else:
 			print("Unhandled value '%d' " % dsd)
 			exit (1)
@@ -123,129 +199,1388 @@ def checksndcards():
 
 # dsdxmos
 # Convert input DSDIFF DSD data to correct order for XMOS native DSD playback
-def dsdxmos(size, indata, outdata):
-
-	for i in range(0, size, 8):
-#		outdata[i+0x00] = indata[i+0x01]
-#		outdata[i+0x01] = indata[i+0x03]
-#		outdata[i+0x02] = indata[i+0x05]
-#		outdata[i+0x03] = indata[i+0x07]
-
-#		outdata[i+0x04] = indata[i+0x00]
-#		outdata[i+0x05] = indata[i+0x02]
-#		outdata[i+0x06] = indata[i+0x04]
-#		outdata[i+0x07] = indata[i+0x06]
-
-		outdata[i+0x00] = indata[i+0x07]
-		outdata[i+0x01] = indata[i+0x05]
-		outdata[i+0x02] = indata[i+0x03]
-		outdata[i+0x03] = indata[i+0x01]
+# DSDIFF data is byte interleaved (L R L R ..), DSD_U32_BE frames hold 4 bytes
+# of data per channel, one channel after the other.
+# The channels are split with one strided copy each, after which the 4 byte
+# words are interleaved into the output buffer. A final partial frame is
+# padded with DSD silence.
+# Input: nr of input bytes, input data, output buffer (size rounded up to a
+# whole frame), optional scratch buffer of at least size bytes for the
+# channel split, nr of channels
+def dsdxmos(size, indata, outdata, scratch=None, channels=2):
+
+	frame = 4 * channels
+	full = size - size % frame
+	perchan = full // channels
+	src = memoryview(indata)
+	if scratch is None:
+		scratch = bytearray(full)
+	tmp = memoryview(scratch)
+	dst = memoryview(outdata).cast('I')
+	words = full // 4
+	for c in range(0, channels):
+		tmp[c*perchan:(c+1)*perchan] = src[c:full:channels]
+		dst[c:words:channels] = tmp[c*perchan:(c+1)*perchan].cast('I')
+
+	dst = memoryview(outdata)
+
+	if size != full:
+		tail = bytearray(b'\x69' * frame)
+		tail[0:size-full] = src[full:size]
+		dsdxmos(frame, tail, dst[full:full+frame], None, channels)
 
-		outdata[i+0x04] = indata[i+0x06]
-		outdata[i+0x05] = indata[i+0x04]
-		outdata[i+0x06] = indata[i+0x02]
-		outdata[i+0x07] = indata[i+0x00]
-
-#		outdata[i+0x00] = revbits(indata[i+0x01])
-#		outdata[i+0x01] = revbits(indata[i+0x03])
-#		outdata[i+0x02] = revbits(indata[i+0x05])
-#		outdata[i+0x03] = revbits(indata[i+0x07])
+	return outdata
 
-#		outdata[i+0x04] = revbits(indata[i+0x00])
-#		outdata[i+0x05] = revbits(indata[i+0x02])
-#		outdata[i+0x06] = revbits(indata[i+0x04])
-#		outdata[i+0x07] = revbits(indata[i+0x06])
+# dsdiffpack
+# Convert input DSDIFF DSD data to DSD frames of width bytes per channel,
+# with one strided copy per channel and byte of the sample word. Used for the
+# formats dsdxmos() does not handle, DSD_U8 needs no conversion at all.
+# A final partial frame is padded with DSD silence.
+# Input: nr of input bytes, input data, output buffer (size rounded up to a
+# whole frame), nr of channels, bytes per channel per frame, little endian
+# sample words
+# Returns: nr of bytes of output data
+def dsdiffpack(size, indata, outdata, channels, width, le):
+	frame = width * channels
+	full = size - size % frame
+	src = memoryview(indata)
+	dst = memoryview(outdata)
+	for c in range(0, channels):
+		for j in range(0, width):
+			b = width - 1 - j if le else j
+			dst[c*width+b:full:frame] = src[c+j*channels:full:frame]
+
+	if size != full:
+		tail = bytearray(b'\x69' * frame)
+		tail[0:size-full] = src[full:size]
+		dsdiffpack(frame, tail, dst[full:full+frame], channels, width, le)
+		full += frame
+
+	return full
+
+# dsfblocks
+# Convert a run of DSF block groups (one block per channel, each channel after
+# the other) to interleaved DSD frames in one pass, DSD_U32_BE by default.
+# For big endian formats and block sizes that are a multiple of the sample
+# width every block is moved with one strided memoryview copy of sample words
+# per channel, otherwise with a strided byte copy per byte of the sample word
+# per block. The bit reversal is done in place over the whole output in one
+# call.
+# Input: whole DSF block groups, output buffer, lsbfirst, nr of valid bytes
+# per channel in the last block, nr of bytes per channel to skip in the first
+# block (multiple of 4), nr of channels, block size, bytes per channel per
+# frame (1, 2 or 4), little endian sample words
+# Returns: nr of bytes of output data
+def dsfblocks(indata, outdata, lsbfirst, last=4096, first=0, channels=2, blocksize=4096,
+              width=4, le=False):
+	group = blocksize * channels
+	ngroups = len(indata) // group
+	step = width * channels
+	if not le and blocksize % width == 0:
+		code = {1: 'B', 2: 'H', 4: 'I'}[width]
+		src = memoryview(indata).cast(code)
+		dst = memoryview(outdata).cast(code)
+		bwords = blocksize // width
+		o = 0
+		for g in range(0, ngroups):
+			skip = 0
+			words = bwords
+			if g == 0:
+				skip = first // width
+			if g == ngroups - 1:
+				words = (last + width - 1) // width
+			words -= skip
+			for c in range(0, channels):
+				i = (g * channels + c) * bwords + skip
+				dst[o+c:o+words*channels:channels] = src[i:i+words]
+			o += words * channels
+		size = o * width
+		# The rest of the last word is the zero padding of the DSF block
+		pad = -last % width if ngroups else 0
+	else:
+		src = memoryview(indata)
+		dst = memoryview(outdata)
+		pos = 0
+		for g in range(0, ngroups):
+			skip = 0
+			n = blocksize
+			if g == 0:
+				skip = first
+			if g == ngroups - 1:
+				n = last
+			n -= skip
+			for c in range(0, channels):
+				i = (g * channels + c) * blocksize + skip
+				for j in range(0, width):
+					t = (j - pos) % width
+					if t >= n:
+						continue
+					b = width - 1 - j if le else j
+					o = ((pos + t) // width * channels + c) * width + b
+					count = len(range(t, n, width))
+					dst[o:o+count*step:step] = src[i+t:i+n:width]
+			pos += n
+		size = (pos + width - 1) // width * step
+		pad = -pos % width
 
-	#outdata = str(outdata)
+	if lsbfirst == 1:
+		dst = memoryview(outdata)[0:size]
+		dsdlib.revbytes(dst, dst)
 
-	return outdata
+	# Pad the last partial word of every channel with DSD silence
+	if pad:
+		dst = memoryview(outdata)
+		for c in range(0, channels):
+			o = size - step + c * width
+			if le:
+				dst[o:o+pad] = b'\x69' * pad
+			else:
+				dst[o+width-pad:o+width] = b'\x69' * pad
 
-# revbits
-# Reverse bits if needed for DSF
-def revbits(x):
-	x = ((x & 0x55) << 1) | ((x & 0xaa) >> 1)
-	x = ((x & 0x33) << 2) | ((x & 0xcc) >> 2)
-	x = ((x & 0x0f) << 4) | ((x & 0xf0) >> 4)
-	return x
+	return size
 
 # dsfxmos
 # Convert input DSF DSD data to correct order for XMOS native DSD playback
+# Converts 'size' bytes of output from a single DSF block
 def dsfxmos(size, indata, outdata, lsbfirst):
 
-	if lsbfirst == 1:
+	dsfblocks(indata[:8192], outdata, lsbfirst, size // 2)
 
-		j = 0
-		for i in range(0, size, 8):
-			outdata[i+0x00] = revbits(indata[j+0x00])
-			outdata[i+0x01] = revbits(indata[j+0x01])
-			outdata[i+0x02] = revbits(indata[j+0x02])
-			outdata[i+0x03] = revbits(indata[j+0x03])
-			j += 4
-		j = 0
-		for i in range(0, size, 8):
-			outdata[i+0x04] = revbits(indata[j+4096+0x00])
-			outdata[i+0x05] = revbits(indata[j+4096+0x01])
-			outdata[i+0x06] = revbits(indata[j+4096+0x02])
-			outdata[i+0x07] = revbits(indata[j+4096+0x03])
-			j += 4
+	return outdata
 
-	else:
-		j = 0
-		for i in range(0, size, 8):
-			outdata[i+0x00] = indata[j+0x00]
-			outdata[i+0x01] = indata[j+0x01]
-			outdata[i+0x02] = indata[j+0x02]
-			outdata[i+0x03] = indata[j+0x03]
-			j += 4
-		j = 0
-		for i in range(0, size, 8):
-			outdata[i+0x04] = indata[j+4096+0x00]
-			outdata[i+0x05] = indata[j+4096+0x01]
-			outdata[i+0x06] = indata[j+4096+0x02]
-			outdata[i+0x07] = indata[j+4096+0x03]
-			j += 4	
-
-	#outdata = str(outdata)
+# dopmarkers
+# Fill in the DoP marker bytes of an output buffer. The marker is the most
+# significant byte of each sample and alternates between 0x05 and 0xFA per
+# frame. Chunks always hold an even nr of DoP frames so the markers are at the
+# same offsets in every chunk and ring buffers only need this once.
+# Input: output buffer, channels, sample width (3 or 4)
+def dopmarkers(outdata, channels, width):
+	frame = channels * width
+	end = (len(outdata) // frame) * frame
+	dst = memoryview(outdata)
+	for c in range(0, channels):
+		o = c * width + width - 1
+		n = len(range(o, end, 2 * frame))
+		dst[o:end:2*frame] = b'\x05' * n
+		n = len(range(o + frame, end, 2 * frame))
+		dst[o+frame:end:2*frame] = b'\xfa' * n
+
+# doppack
+# Pack DSD_U32_BE frames into DoP frames (16 DSD bits per channel per sample).
+# Every DSD_U32_BE frame holds 4 DSD bytes per channel and gives two DoP
+# frames, the older DSD byte goes in the middle byte of the sample and the
+# newer one below it. The bytes are moved with strided memoryview copies over
+# the whole chunk, the markers are left to dopmarkers().
+# Input: DSD_U32_BE data, nr of bytes, output buffer, channels, sample width
+# Returns: nr of bytes of output data
+def doppack(indata, size, outdata, channels, width):
+	instep = 4 * channels
+	outstep = 2 * channels * width
+	frames = size // instep
+	size = frames * instep
+	end = frames * outstep
+	src = memoryview(indata)
+	dst = memoryview(outdata)
+	for c in range(0, channels):
+		for h in range(0, 2):
+			i = c * 4 + h * 2
+			o = (h * channels + c) * width + width - 3
+			dst[o:end:outstep] = src[i+1:size:instep]
+			dst[o+1:end:outstep] = src[i:size:instep]
+	return end
+
+# periodframes
+# Nr of frames per ALSA period for about 100 ms of audio, in whole DSF
+# blocks (4096 bytes per channel = 1024 DSD_U32_BE frames)
+def periodframes(rate):
+	blocks = max(1, rate // 8 // 4 // 10 // 1024)
+	return blocks * 1024
+
+# dsdring
+# Fixed ring of preallocated output buffers, passed from the reader to the
+# writer thread and back again
+#
+# dsdring.count         - nr of preallocated buffers, the scratch buffer included
+# dsdring.scratch       - scratch buffer for use by the converter
+#
+# init is called once on every ring buffer, e.g. to fill in DoP markers
+class dsdring(object):
+
+	def __init__(self, count, size, init=None):
+		self.size = size
+		self.count = count + 1
+		self.scratch = bytearray(size)
+		self.free = queue.Queue()
+		for i in range(0, count):
+			buf = bytearray(size)
+			if init is not None:
+				init(buf)
+			self.free.put(buf)
+
+	def get(self):
+		return self.free.get()
+
+	def put(self, buf):
+		self.free.put(buf)
+
+# dsfchunks
+# Generator converting DSF data to chunks of DSD frames, starting at the
+# block group at the read position of the dsdmap
+# Input: dsdmap of the file, dsdfile, nr of DSF blocks per channel per chunk
+# (nblocks * block size must be a multiple of 4), buffer ring, dsdstats, nr
+# of bytes per channel to skip in the first block (multiple of 4), native DSD
+# sample format
+# Yields: output buffer from the ring, nr of bytes of data in it
+def dsfchunks(dsd, dsdfile, nblocks, ring, stats, first=0, fmt='DSD_U32_BE'):
+	width, le = dsdformats[fmt]
+	channels = dsdfile.channels
+	blocksize = dsdfile.blocksize
+	group = blocksize * channels
+	perchan = dsdfile.datasize // channels
+	total = (perchan + blocksize - 1) // blocksize
+	last = perchan - (total - 1) * blocksize
+	remain = total - dsd.pos // group
+
+	while remain > 0:
+		n = min(nblocks, remain)
+		t0 = time.perf_counter_ns()
+		data = dsd.read(n * group)
+		if len(data) < n * group:
+			print("DSF: unexpected end of file")
+			break
+		dsd.fault(data)
+		stats.add('read', time.perf_counter_ns() - t0)
+		remain -= n
+
+		newdata = ring.get()
+		t0 = time.perf_counter_ns()
+		if remain == 0:
+			size = dsfblocks(data, newdata, dsdfile.lsbfirst, last, first,
+			                 channels, blocksize, width, le)
+		else:
+			size = dsfblocks(data, newdata, dsdfile.lsbfirst, blocksize, first,
+			                 channels, blocksize, width, le)
+		stats.add('convert', time.perf_counter_ns() - t0)
+		first = 0
+		dsd.release()
+		yield newdata, size
+
+# dsdiffchunks
+# Generator converting DSDIFF data to chunks of DSD frames
+# Input: dsdmap of the file, dsdfile, nr of bytes per chunk, buffer ring,
+# dsdstats, native DSD sample format (not DSD_U8, see rawchunks())
+# Yields: output buffer from the ring, nr of bytes of data in it
+def dsdiffchunks(dsd, dsdfile, rdsize, ring, stats, fmt='DSD_U32_BE'):
+	width, le = dsdformats[fmt]
+	frame = width * dsdfile.channels
+	while True:
+		t0 = time.perf_counter_ns()
+		data = dsd.read(rdsize)
+		if len(data) == 0:
+			break
+		dsd.fault(data)
+		stats.add('read', time.perf_counter_ns() - t0)
+
+		newdata = ring.get()
+		t0 = time.perf_counter_ns()
+		if fmt == 'DSD_U32_BE':
+			dsdxmos(len(data), data, newdata, ring.scratch, dsdfile.channels)
+		else:
+			dsdiffpack(len(data), data, newdata, dsdfile.channels, width, le)
+		stats.add('convert', time.perf_counter_ns() - t0)
+		dsd.release()
+		yield newdata, (len(data) + frame - 1) // frame * frame
+
+# rawchunks
+# Generator reading DSD data that is already in the output format (DSDIFF
+# as DSD_U8) straight into the ring buffers, without any conversion
+# Input: dsdmap of the file, nr of bytes per frame, nr of bytes per chunk,
+# buffer ring, dsdstats
+# Yields: output buffer from the ring, nr of bytes of data in it
+def rawchunks(dsd, frame, rdsize, ring, stats):
+	while True:
+		newdata = ring.get()
+		t0 = time.perf_counter_ns()
+		size = dsd.readinto(newdata, rdsize)
+		if size == 0:
+			ring.put(newdata)
+			break
+		stats.add('read', time.perf_counter_ns() - t0)
+		dsd.release()
+		if size % frame:
+			# Pad a final partial frame with DSD silence
+			pad = frame - size % frame
+			newdata[size:size+pad] = b'\x69' * pad
+			size += pad
+		yield newdata, size
+
+# dopchunks
+# Generator packing chunks of DSD_U32_BE frames into DoP frames
+# Input: DSD_U32_BE chunk generator, the ring it takes its buffers from,
+# ring of DoP output buffers, channels, sample width, dsdstats
+# Yields: output buffer from the DoP ring, nr of bytes of data in it
+def dopchunks(chunks, ring, dopring, channels, width, stats):
+	for data, size in chunks:
+		newdata = dopring.get()
+		t0 = time.perf_counter_ns()
+		size = doppack(data, size, newdata, channels, width)
+		stats.add('convert', time.perf_counter_ns() - t0)
+		ring.put(data)
+		yield newdata, size
+
+# dsdstats
+# Low overhead playback instrumentation. Read, convert and write times are
+# kept per period in histograms with power of 2 microsecond buckets. The
+# headroom is the part of the real time budget of a period that was not
+# needed to read and convert it. Underruns are detected when more time has
+# passed since the start of playback than there is audio written to ALSA.
+#
+# dsdstats.periods      - nr of periods read and converted
+# dsdstats.underruns    - nr of detected underruns
+# dsdstats.shortwrites  - nr of writes that did not take all frames
+# dsdstats.interval     - seconds between stats lines, 0 for none
+class dsdstats(object):
+
+	stages = ('read', 'convert', 'write')
+	buckets = 32
+
+	def __init__(self, interval=0, tracefile=None):
+		self.hist = {}
+		self.total = {}
+		self.count = {}
+		self.max = {}
+		for stage in self.stages:
+			self.hist[stage] = [0] * self.buckets
+			self.total[stage] = 0
+			self.count[stage] = 0
+			self.max[stage] = 0
+		# Headroom in 10% steps, index 0 is for negative headroom
+		self.headroom = [0] * 11
+		self.minheadroom = 100.0
+		self.busy = 0
+		self.periods = 0
+		self.underruns = 0
+		self.shortwrites = 0
+		self.interval = interval
+		self.lastline = time.time()
+		self.trace = None
+		if tracefile is not None:
+			self.trace = open(tracefile, 'w')
+			self.trace.write("time,stage,usec,headroom\n")
+		self.begin(1, 1)
+
+	# Set the output format for a new PCM: bytes per second and per frame
+	def begin(self, bps, framebytes):
+		self.bps = bps
+		self.framebytes = framebytes
+		self.start = 0
+		self.written = 0
+		self.lost = 0.0
+
+	# Add the time of a read, convert or write of one period
+	def add(self, stage, ns):
+		us = ns // 1000
+		self.hist[stage][min(us.bit_length(), self.buckets - 1)] += 1
+		self.total[stage] += us
+		self.count[stage] += 1
+		if us > self.max[stage]:
+			self.max[stage] = us
+		if stage != 'write':
+			self.busy += ns
+		if self.trace is not None:
+			self.trace.write("%.6f,%s,%d,\n" % (time.time(), stage, us))
+
+	# A period of size bytes has been read and converted
+	def period(self, size):
+		budget = size * 1e9 / self.bps
+		headroom = 100.0 * (1.0 - self.busy / budget)
+		self.headroom[max(0, min(10, int(headroom // 10) + 1))] += 1
+		if headroom < self.minheadroom:
+			self.minheadroom = headroom
+		self.periods += 1
+		self.busy = 0
+		if self.trace is not None:
+			self.trace.write("%.6f,period,,%.2f\n" % (time.time(), headroom))
+
+	# A period of size bytes has been written in ns nanoseconds, ALSA
+	# returned ret (nr of frames written)
+	def write(self, ns, size, ret):
+		now = time.perf_counter()
+		if self.start == 0:
+			self.start = now - ns / 1e9
+		self.add('write', ns)
+		if isinstance(ret, int) and ret < size // self.framebytes:
+			self.shortwrites += 1
+		self.written += size
+		lag = now - self.start - self.lost - self.written / self.bps
+		if lag > 0.002:
+			self.underruns += 1
+			self.lost += lag
+		if self.interval and time.time() - self.lastline >= self.interval:
+			self.lastline = time.time()
+			print(self.line())
+
+	# Upper bound in us of the bucket holding the given fraction of counts
+	def percentile(self, stage, fraction):
+		need = fraction * self.count[stage]
+		seen = 0
+		for i in range(0, self.buckets):
+			seen += self.hist[stage][i]
+			if seen >= need and seen > 0:
+				return (1 << i) - 1 if i else 0
+		return 0
 
-	return outdata
+	def line(self):
+		parts = ["Stats: %d periods" % self.periods]
+		for stage in self.stages:
+			parts.append("%s p99 %.1f ms" % (stage, self.percentile(stage, 0.99) / 1000.0))
+		parts.append("headroom min %.1f%%" % self.minheadroom)
+		parts.append("underruns %d, short writes %d" % (self.underruns, self.shortwrites))
+		return ", ".join(parts)
+
+	def report(self):
+		report = {
+			'periods' : self.periods,
+			'underruns' : self.underruns,
+			'short_writes' : self.shortwrites,
+			'headroom' : {
+				'min_pct' : round(self.minheadroom, 2),
+				'hist_pct' : dict(zip(['<0'] + ["%d-%d" % (i, i + 10) for i in range(0, 100, 10)],
+				                      self.headroom))
+			},
+			'stages' : {}
+		}
+		for stage in self.stages:
+			count = self.count[stage]
+			report['stages'][stage] = {
+				'count' : count,
+				'mean_us' : self.total[stage] // count if count else 0,
+				'max_us' : self.max[stage],
+				'p50_us' : self.percentile(stage, 0.5),
+				'p99_us' : self.percentile(stage, 0.99),
+				'hist_us' : dict(("<%d" % (1 << i), n)
+				                 for i, n in enumerate(self.hist[stage]) if n)
+			}
+		return report
+
+	# Write the report as JSON to a file, '-' for stdout
+	def dump(self, filename):
+		if filename == '-':
+			print(json.dumps(self.report(), indent=1))
+			return
+		with open(filename, 'w') as f:
+			json.dump(self.report(), f, indent=1)
+
+	def close(self):
+		if self.trace is not None:
+			self.trace.close()
+			self.trace = None
+
+# dsdpipe
+# Read/convert and write pipeline. A reader thread converts chunks of DSD
+# data and fills a bounded queue, a writer thread feeds the ALSA PCM object.
+#
+# dsdpipe.high          - highest nr of queued chunks (high water mark)
+# dsdpipe.low           - lowest nr of queued chunks while playing (low water
+#                         mark), None before the first chunk was written
+# dsdpipe.error         - exception raised by the reader or the writer
+# dsdpipe.stop          - set by the writer on a write error, stops the reader
+# dsdpipe.starved       - nr of times the writer had to wait for data
+# dsdpipe.ring          - ring of output buffers, depth + 2 buffers
+# dsdpipe.rings         - all rings used for playback, for the buffer stats
+# dsdpipe.blocks        - growth of the nr of allocated memory blocks while
+#                         playing (sys.getallocatedblocks())
+# dsdpipe.allocs        - nr of blocks allocated while playing, the sum of the
+#                         growth of all periods that grew
+# dsdpipe.blocksmax     - largest growth in a single period
+# dsdpipe.periods       - nr of periods measured
+# dsdpipe.allocperiods  - nr of periods in which the nr of blocks grew
+# dsdpipe.peakbytes     - largest nr of bytes allocated on top of the live
+#                         memory within a period, only measured while
+#                         tracemalloc is tracing (python3 -X tracemalloc)
+# dsdpipe.tempbytes     - sum of those bytes over all periods
+# dsdpipe.start         - time the writer started playing
+# dsdpipe.end           - time the writer wrote the last chunk
+# dsdpipe.timings       - dsdstats with the per period timings
+class dsdpipe(object):
+
+	def __init__(self, out, depth, bufsize, init=None, timings=None):
+		self.out = out
+		if timings is None:
+			timings = dsdstats()
+		self.timings = timings
+		self.depth = depth
+		self.ring = dsdring(depth + 2, bufsize, init)
+		self.rings = [self.ring]
+		self.queue = queue.Queue(depth)
+		self.done = False
+		self.error = None
+		self.stop = False
+		self.high = 0
+		self.low = None
+		self.starved = 0
+		self.chunks = 0
+		self.periods = 0
+		self.blocks = 0
+		self.allocs = 0
+		self.blocksmax = 0
+		self.allocperiods = 0
+		self.peakbytes = None
+		self.tempbytes = 0
+		self.start = 0
+		self.end = 0
+
+	def reader(self, chunks):
+		blocks = self.sample()
+		try:
+			for data in chunks:
+				if self.stop:
+					break
+				self.timings.period(data[1])
+				self.queue.put(data)
+				self.high = max(self.high, self.queue.qsize())
+				blocks = self.measure(blocks)
+		except Exception as e:
+			self.error = e
+		self.done = True
+		self.queue.put(None)
+
+	def writer(self):
+		# Wait until the queue is filled before starting playback
+		while not self.done and not self.queue.full():
+			time.sleep(0.005)
+		self.start = time.time()
+
+		while True:
+			level = self.queue.qsize()
+			if level == 0 and not self.done:
+				self.starved += 1
+			elif not self.done:
+				self.low = level if self.low is None else min(self.low, level)
+			item = self.queue.get()
+			if item is None:
+				break
+			data, size = item
+			t0 = time.perf_counter_ns()
+			try:
+				if size == len(data):
+					ret = self.out.write(data)
+				else:
+					ret = self.out.write(memoryview(data)[0:size])
+			except Exception as e:
+				self.error = e
+				self.stop = True
+				self.ring.put(data)
+				break
+			self.timings.write(time.perf_counter_ns() - t0, size, ret)
+			self.ring.put(data)
+			self.chunks += 1
+		self.end = time.time()
+
+		# After a write error hand the queued buffers back until the reader
+		# has seen the stop flag, so it does not block on a full queue or
+		# an empty ring
+		if self.stop:
+			while True:
+				item = self.queue.get()
+				if item is None:
+					break
+				self.ring.put(item[0])
+
+	# Play all chunks, returns when the last chunk has been written or
+	# writing failed
+	# Input: generator yielding (ring buffer, size) tuples
+	# Returns: the read or write error, None if ok
+	def run(self, chunks):
+		rd = threading.Thread(target=self.reader, args=(chunks,))
+		wr = threading.Thread(target=self.writer)
+		rd.daemon = True
+		wr.daemon = True
+		rd.start()
+		wr.start()
+		# Join with a timeout so signals are still handled
+		while wr.is_alive():
+			wr.join(0.2)
+		if self.error is not None and self.stop:
+			print("Error while writing DSD data: %s" % self.error)
+		elif self.error is not None:
+			print("Error while reading DSD data: %s" % self.error)
+		return self.error
+
+	# Start of the allocation measurement, returns the nr of allocated blocks
+	def sample(self):
+		if tracemalloc.is_tracing():
+			tracemalloc.reset_peak()
+			self.peakbytes = 0
+		return sys.getallocatedblocks()
+
+	# Allocation delta of the period that ends now, from the nr of allocated
+	# blocks at its start. The blocks of both threads count, so whatever the
+	# writer allocates shows up as well.
+	# Returns: the nr of allocated blocks, the start of the next period
+	def measure(self, start):
+		blocks = sys.getallocatedblocks()
+		delta = blocks - start
+		self.periods += 1
+		self.blocks += delta
+		if delta > 0:
+			self.allocperiods += 1
+			self.allocs += delta
+			self.blocksmax = max(self.blocksmax, delta)
+		if self.peakbytes is not None and tracemalloc.is_tracing():
+			# Temporaries freed again within the period only show in the peak
+			current, peak = tracemalloc.get_traced_memory()
+			self.peakbytes = max(self.peakbytes, peak - current)
+			self.tempbytes += peak - current
+			tracemalloc.reset_peak()
+		return blocks
+
+	def stats(self):
+		low = '-' if self.low is None else str(self.low)
+		print("Buffer: %d chunks, high water %d, low water %s, writer waited %d times"
+		      % (self.depth, self.high, low, self.starved))
+		print("Buffers: %d preallocated, %d KB"
+		      % (sum(ring.count for ring in self.rings),
+		         sum(ring.count * ring.size for ring in self.rings) // 1024))
+		elapsed = max(self.end - self.start, 0.001)
+		print("Allocations: %d blocks while playing (%.1f/s), net %+d, grew in %d of %d periods, max %d blocks per period"
+		      % (self.allocs, self.allocs / elapsed, self.blocks, self.allocperiods,
+		         self.periods, self.blocksmax))
+		if self.peakbytes is not None:
+			print("Temporaries: %d bytes while playing (%.1f KB/s), max %d bytes per period (tracemalloc)"
+			      % (self.tempbytes, self.tempbytes / elapsed / 1024, self.peakbytes))
+		else:
+			print("Temporaries: not measured, run with 'python3 -X tracemalloc' to see them")
 
 # playdsdsilence
 # Play DSD silence data
-# Input: dsdfile, nr of ms to play
-# TODO: Need to double the amount of bytes => stereo?
-def playdsdsilence(rate, ms):
+# Input: ALSA PCM, DSD_U32_BE frame rate, nr of ms to play, DoP sample width
+# (0 for native DSD), nr of channels
+def playdsdsilence(out, rate, ms, dop=0, channels=2):
 	#print "Requested %d ms of DSD silence playback" % ms
-	silsize = (ms * rate // 1000) * 2
-	print("Silsize: %d" % silsize)
-	#print "Size for silence data = %d" % silsize
-	sildata = bytearray(silsize)
-	for i in range(0, silsize):
-		sildata[i] = 0x69
-	#sildata = str(sildata)
+	frames = max(1, ms * rate // 1000)
+	sildata = bytearray(b'\x69' * (frames * 4 * channels))
+	if dop:
+		dopdata = bytearray(frames * 2 * channels * dop)
+		dopmarkers(dopdata, channels, dop)
+		doppack(sildata, len(sildata), dopdata, channels, dop)
+		sildata = dopdata
 	out.write(sildata)
 
+# wavheader
+# WAV header for PCM data, used to write DoP frames to a file
+# Input: sample rate, channels, bytes per sample, nr of data bytes
+def wavheader(rate, channels, width, datasize):
+	return struct.pack('<4sL4s4sLHHLLHH4sL', b'RIFF', 36 + datasize, b'WAVE',
+	                   b'fmt ', 16, 1, channels, rate, rate * channels * width,
+	                   channels * width, width * 8, b'data', datasize)
+
+# dsdsink
+# Base class of the playback outputs. Like an ALSA PCM a sink is opened for
+# one sample format and rate and written with whole frames. The nr of bytes
+# written and the time since the first write give the throughput.
+#
+# dsdsink.bytes         - nr of bytes written
+# dsdsink.bps           - bytes per second of real time audio
+class dsdsink(object):
+
+	def __init__(self, name, rate, framebytes):
+		self.name = name
+		self.bps = rate * framebytes
+		self.framebytes = framebytes
+		self.bytes = 0
+		self.start = 0
+		self.paused = 0
+
+	# Write frames, returns the nr of frames written
+	def write(self, data):
+		if self.start == 0:
+			self.start = time.perf_counter()
+		size = self.put(data)
+		self.bytes += size
+		return size // self.framebytes
+
+	# Write data, returns the nr of bytes written
+	def put(self, data):
+		return len(data)
+
+	# Pause or resume the output, time spent paused does not count
+	def pause(self, on):
+		now = time.perf_counter()
+		if on and not self.paused:
+			self.paused = now
+		elif not on and self.paused:
+			if self.start:
+				self.start += now - self.paused
+			self.paused = 0
+
+	# Throw away data that has been written but not played yet
+	def drop(self):
+		self.pause(False)
+
+	# Throughput since the first write
+	def report(self):
+		elapsed = max(time.perf_counter() - self.start, 1e-6) if self.start else 1e-6
+		return ("%s: %d bytes in %.3f s, %.1f MB/s, %.1fx real time"
+		        % (self.name, self.bytes, elapsed, self.bytes / elapsed / 1e6,
+		           self.bytes / self.bps / elapsed))
+
+	def close(self):
+		print(self.report())
+
+# alsasink
+# ALSA PCM of a card, the sample format is given by name (e.g. DSD_U32_BE)
+class alsasink(dsdsink):
+
+	def __init__(self, audiodev, rate, channels, periodsize, fmt, framebytes):
+		dsdsink.__init__(self, "ALSA", rate, framebytes)
+		# Marantz: front:CARD=HDDAC1,DEV=0
+		# iFi: front:CARD=Audio,DEV=0
+		self.pcm = alsaaudio.PCM(alsaaudio.PCM_PLAYBACK, device="front:CARD='%s',DEV=0" % audiodev,\
+		                         rate=rate, channels=channels, periodsize=periodsize,\
+		                         format=getattr(alsaaudio, 'PCM_FORMAT_' + fmt))
+
+	# Returns what ALSA returns, the nr of frames written
+	def write(self, data):
+		return self.pcm.write(data)
+
+	def pause(self, on):
+		dsdsink.pause(self, on)
+		try:
+			self.pcm.pause(1 if on else 0)
+		except Exception:
+			# Not every device can pause, it underruns while paused instead
+			pass
+
+	def drop(self):
+		dsdsink.drop(self)
+		# python-alsaaudio 0.9 and newer, the next write prepares the PCM
+		if hasattr(self.pcm, 'drop'):
+			self.pcm.drop()
+
+	def close(self):
+		self.pcm.close()
+
+# nullsink
+# Drops all data. With realtime set it behaves like a blocking ALSA write:
+# a write returns when no more than buffered seconds of audio are left to
+# play, and the clock starts again when all audio has been played.
+class nullsink(dsdsink):
+
+	buffered = 0.05
+
+	def __init__(self, rate, framebytes, realtime=False):
+		dsdsink.__init__(self, "Null output", rate, framebytes)
+		self.realtime = realtime
+
+	def put(self, data):
+		if self.realtime:
+			now = time.perf_counter()
+			if self.start + self.bytes / self.bps < now:
+				# Underrun, the audio written so far has been played
+				self.start = now - self.bytes / self.bps
+			wait = self.start + (self.bytes + len(data)) / self.bps - self.buffered - now
+			if wait > 0:
+				time.sleep(wait)
+		return len(data)
+
+	def drop(self):
+		dsdsink.drop(self)
+		if self.start:
+			self.start = time.perf_counter() - self.bytes / self.bps
+
+# fdsink
+# Writes the frames to a file descriptor: a raw or WAV file, a FIFO or
+# stdout. A WAV header gets its sizes filled in on close.
+class fdsink(dsdsink):
+
+	def __init__(self, name, fd, rate, framebytes, closefd=True, wav=None):
+		dsdsink.__init__(self, name, rate, framebytes)
+		self.fd = fd
+		self.closefd = closefd
+		self.wav = wav
+		if wav is not None:
+			self.put(wavheader(rate, wav[0], wav[1], 0))
+
+	def put(self, data):
+		data = memoryview(data).cast('B')
+		done = 0
+		while done < len(data):
+			done += os.write(self.fd, data[done:])
+		return done
+
+	def close(self):
+		if self.wav is not None:
+			os.pwrite(self.fd, wavheader(self.bps // self.framebytes, self.wav[0],
+			                             self.wav[1], self.bytes), 0)
+		if self.closefd:
+			os.close(self.fd)
+		dsdsink.close(self)
+
+# dsdoutput
+# Where playback goes, from the -o option:
+#   alsa          - the ALSA card (default)
+#   file:<path>   - raw frames, or DoP frames in a WAV file for a .wav path
+#   null          - nowhere, as fast as possible
+#   null:rt       - nowhere, throttled to real time
+#   pipe:<path>   - a FIFO, '-' for stdout (messages then go to stderr)
+# A file is written from the start for the first PCM opened and appended to
+# for every following one (a WAV file only holds a single format).
+class dsdoutput(object):
+
+	def __init__(self, spec):
+		kind, sep, arg = spec.partition(':')
+		if (kind not in ('alsa', 'file', 'null', 'pipe') or
+		    (kind in ('file', 'pipe') and arg == '') or
+		    (kind == 'null' and arg not in ('', 'rt')) or
+		    (kind == 'alsa' and arg != '')):
+			raise ValueError("Unknown output '%s'" % spec)
+		self.kind = kind
+		self.arg = arg
+		self.opened = 0
+		self.stdout = -1
+		if kind == 'pipe' and arg == '-':
+			# Keep stdout for the audio data, messages go to stderr
+			sys.stdout.flush()
+			self.stdout = os.dup(1)
+			os.dup2(2, 1)
+
+	# A WAV file holds PCM data, so DSD goes in as DoP
+	def wav(self):
+		return self.kind == 'file' and self.arg.lower().endswith('.wav')
+
+	# Open a sink for a sample format (ALSA name) and rate
+	# Returns: dsdsink, raises an exception if that is not possible
+	def open(self, audiodev, rate, channels, periodsize, fmt, framebytes):
+		self.opened += 1
+		if self.kind == 'alsa':
+			return alsasink(audiodev, rate, channels, periodsize, fmt, framebytes)
+		if self.kind == 'null':
+			return nullsink(rate, framebytes, self.arg == 'rt')
+		if self.kind == 'pipe':
+			if self.stdout >= 0:
+				return fdsink("Pipe output", self.stdout, rate, framebytes, False)
+			# Opening a FIFO waits for a reader
+			return fdsink("Pipe output", os.open(self.arg, os.O_WRONLY), rate, framebytes)
+		wav = None
+		if self.wav():
+			if self.opened > 1:
+				raise ValueError("WAV file '%s' cannot hold a second format (%s at %d Hz)"
+				                 % (self.arg, fmt, rate))
+			wav = (channels, framebytes // channels)
+		flags = os.O_WRONLY | os.O_CREAT | (os.O_APPEND if self.opened > 1 else os.O_TRUNC)
+		return fdsink("File output '%s'" % self.arg, os.open(self.arg, flags, 0o644),
+		              rate, framebytes, True, wav)
+
+# dsdtrack
+# A DSD file that has been checked and mapped for playback
+#
+# dsdtrack.myfile       - dsdfile with the properties of the file
+# dsdtrack.dsdtype      - 'dsf' or 'dsdiff'
+# dsdtrack.dsd          - dsdmap of the DSD data
+# dsdtrack.start        - sample position to start playback at
+class dsdtrack(object):
+
+	def __init__(self, filename, myfile, dsd):
+		self.filename = filename
+		self.myfile = myfile
+		self.dsdtype = myfile.type.decode("UTF-8")
+		self.dsd = dsd
+		self.start = 0
+		self.perchan = 0
+
+	# Tracks with the same format are played on the same PCM without a gap
+	def sameformat(self, other):
+		return (self.myfile.rate == other.myfile.rate and
+		        self.myfile.channels == other.myfile.channels)
+
+	# Nr of DSF blocks per channel per chunk for a period, the chunks must
+	# hold whole DSD_U32_BE frames
+	def periodblocks(self, periodsize):
+		blocksize = self.myfile.blocksize
+		step = 4 // math.gcd(blocksize, 4)
+		nblocks = periodsize * 4 // blocksize
+		return nblocks - nblocks % step
+
+	# Start reading the first periods from the start position into the page
+	# cache, so the first chunks do not wait for the disk
+	def prefetch(self, periods=4):
+		offset, phase = dsdlib.dsdseek(self.myfile).sample(self.start)
+		size = periods * periodframes(self.myfile.rate) * 4 * self.myfile.channels
+		if self.dsdtype == "dsf":
+			# DSF data is read in whole block groups
+			group = self.myfile.blocksize * self.myfile.channels
+			size = (size + phase // 8 * self.myfile.channels + group - 1) // group * group
+		self.dsd.willneed(offset, size)
+
+	# Set the start position to a time in seconds, and prefetch from there
+	def seektime(self, seconds):
+		self.start = int(round(seconds * self.myfile.rate))
+		self.prefetch()
+
+	# Set the start position to a DSDIFF marker (1 = first marker), and
+	# prefetch from there
+	# Returns: 0 if ok, 1 if there is no such marker
+	def seekmark(self, nr):
+		marks = []
+		if self.dsdtype == "dsdiff":
+			marks = dsdlib.dsdiffmarks(self.filename, self.myfile)
+		if nr < 1 or nr > len(marks):
+			return 1
+		self.start = marks[nr - 1][0]
+		self.prefetch()
+		return 0
+
+	# Chunk generator converting one period (periodsize DSD_U32_BE frames) of
+	# frames in the given native DSD format per chunk, starting at the start
+	# position rounded down to a DSD_U32_BE frame. Sets dsdtrack.perchan to
+	# the nr of bytes per channel the chunks hold, padding not included.
+	def chunks(self, ring, periodsize, stats, fmt='DSD_U32_BE'):
+		if self.start >= self.myfile.samples:
+			# Started at or past the end, there is nothing left to play
+			self.perchan = 0
+			return iter(())
+		offset, phase = dsdlib.dsdseek(self.myfile).sample(self.start)
+		self.dsd.seek(offset)
+		channels = self.myfile.channels
+		rdsize = periodsize * 4 * channels
+		if self.dsdtype == "dsdiff":
+			self.perchan = (self.dsd.size - self.dsd.pos) // channels
+		if self.dsdtype == "dsdiff" and fmt == 'DSD_U8':
+			return rawchunks(self.dsd, channels, rdsize, ring, stats)
+		if self.dsdtype == "dsdiff":
+			return dsdiffchunks(self.dsd, self.myfile, rdsize, ring, stats, fmt)
+		first = (phase // 8) & ~3
+		self.perchan = max(self.myfile.datasize // channels - offset // channels - first, 0)
+		return dsfchunks(self.dsd, self.myfile, self.periodblocks(periodsize),
+		                 ring, stats, first, fmt)
+
+	def close(self):
+		self.dsd.close()
+
+# opentrack
+# Check a file and map its DSD data for playback. The page cache is told the
+# data is read sequentially and starts reading the first periods right away.
+# Messages go to log.
+# Returns: dsdtrack, None if the file cannot be played
+def opentrack(audiofile, log=print):
+	# Check if file to play is a proper DSDIFF or DSF file.
+	# If so, get its properties
+	myfile = dsdlib.dsdfile()
+
+	# The probe keeps the file open for playback
+	try:
+		probe = dsdlib.dsdprobe(audiofile)
+	except OSError as e:
+		log("\nError: Cannot open '%s', %s\n" % (audiofile, e))
+		return None
+	with probe:
+		ret = dsdlib.checkdsdfile(audiofile, myfile, probe)
+		log("DEBUG: myfile.valid: %s" % myfile.valid)
+
+		#print "Got: myfile.valid = %d, myfile.type = %s" % (myfile.valid, myfile.type)
+
+		if myfile.valid == 2:
+			log("'%s': Not a DSD file" % audiofile)
+			return None
+
+		dsdtype = myfile.type.decode("UTF-8")
+		valid = myfile.valid
+		channels = myfile.channels
+
+		log("DEBUG: valid: %d, dsdtype: %s" % (valid, dsdtype))
+
+		if valid == 0 and (dsdtype != 'dsdiff' and dsdtype != 'dsf'):
+			log("'%s': Unsupported or invalid DSD file" % audiofile)
+			return None
+
+		if valid == 0 and (dsdtype == 'dsdiff' or dsdtype == 'dsf'):
+			log("'%s': Invalid %s file" % (audiofile, dsdtype.upper()))
+			return None
+
+		if dsdtype == "dsdiff" and myfile.compress == 1:
+			log("'%s': This DSDIFF file uses compressed DSD data samples, playback is not supported" % audiofile)
+			return None
+
+		if channels < 1 or channels > 6:
+			log("'%s': File with %d channels,  only 1 to 6 channel files are supported" % (audiofile, channels))
+			return None
+
+		log("File: '%s'" % audiofile)
+		log("DSD file type: %s" % dsdtype.upper())
+		log("channels = %d" % channels)
+		log("rate = %d Hz [%s]" % (myfile.rate, dsdlib.rate_to_string(myfile.rate)))
+		log("Total file size: %d" % myfile.fsize)
+		log("DSD data start at: %d" % myfile.datastart)
+		log("DSD data size: %d" % myfile.datasize)
+
+		# Map the DSD data of the file, DSF data is read in whole blocks
+		try:
+			dsd = dsdlib.dsdmap(audiofile, myfile, dsdlib.mapsize(myfile), probe.fd)
+		except Exception as e:
+			log("\nError: Cannot read DSD data of '%s', %s\n" % (audiofile, e))
+			return None
+		dsd.advise()
+
+	track = dsdtrack(audiofile, myfile, dsd)
+	if track.dsdtype == 'dsf' and track.periodblocks(periodframes(myfile.rate)) == 0:
+		log("'%s': DSF block size %d is too large for playback" % (audiofile, myfile.blocksize))
+		track.close()
+		return None
+	track.prefetch()
+	return track
+
+# dsdplaylist
+# Files to play. The next playable track is opened ahead of time, so its
+# header is checked and the start of its data is read while the current
+# track is still playing. Files that cannot be played are skipped.
+#
+# dsdplaylist.skipped   - nr of files skipped
+class dsdplaylist(object):
+
+	def __init__(self, files):
+		self.files = list(files)
+		self.pos = 0
+		self.ahead = None
+		self.skipped = 0
+
+	# Next track without taking it from the playlist, None at the end
+	def peek(self):
+		while self.ahead is None and self.pos < len(self.files):
+			self.ahead = opentrack(self.files[self.pos])
+			if self.ahead is None:
+				self.skipped += 1
+			self.pos += 1
+		return self.ahead
+
+	# Take the next track from the playlist, None at the end
+	def pop(self):
+		track = self.peek()
+		self.ahead = None
+		return track
+
+# shiftframes
+# Move the DSD data of every channel k bytes (0 < k < width) further into the
+# sample words: the carried bytes go in front of the first frame and the last
+# k bytes of every channel move out into a new carry frame
+# Input: whole frames, nr of bytes, output buffer, carry frame with k bytes
+# per channel at the start of each sample word, k, nr of channels, bytes per
+# channel per frame, little endian sample words
+# Returns: the new carry frame
+def shiftframes(indata, size, outdata, carry, k, channels, width, le):
+	frame = width * channels
+	src = memoryview(indata)[0:size]
+	dst = memoryview(outdata)[0:size]
+	new = bytearray(frame)
+	for j in range(0, width):
+		b = width - 1 - j if le else j
+		if j >= k:
+			a = width - 1 - (j - k) if le else j - k
+			dst[b::width] = src[a::width]
+		else:
+			a = k - 1 - j if le else width - k + j
+			dst[b:frame:width] = carry[b::width]
+			dst[frame+b::width] = src[a:size-frame:width]
+			new[b::width] = src[size-frame+a::width]
+	return new
+
+# dsdjoin
+# Joins the DSD data of consecutive tracks with the same format without any
+# silence in between. A track whose data does not end on a whole frame of
+# the output format leaves a partial frame, which is carried over to the
+# start of the next track instead of being padded: the data of that track is
+# then shifted by the carried bytes per channel. Only the partial frame at
+# the end of the run of tracks is padded with DSD silence, by flush().
+#
+# dsdjoin.carry         - partial frame carried to the next track
+# dsdjoin.k             - nr of bytes per channel in the carried frame
+class dsdjoin(object):
+
+	def __init__(self, fmt='DSD_U32_BE'):
+		self.fmt = fmt
+		self.width, self.le = dsdformats[fmt]
+		self.carry = None
+		self.k = 0
+
+	# Chunk generator for the next track, see dsdtrack.chunks()
+	def chunks(self, track, ring, periodsize, stats):
+		width = self.width
+		channels = track.myfile.channels
+		frame = width * channels
+		k = self.k
+		chunks = track.chunks(ring, periodsize, stats, self.fmt)
+		# Bytes of padded frames the track yields, and how many bytes per
+		# channel the shifted data holds beyond them
+		remain = (track.perchan + width - 1) // width * frame
+		extra = k + track.perchan - remain // channels
+		for data, size in chunks:
+			remain -= size
+			if k:
+				out = ring.scratch
+				self.carry = shiftframes(data, size, out, self.carry, k, channels,
+				                         width, self.le)
+				ring.scratch = data
+				data = out
+			if remain <= 0:
+				# Last chunk of the track, a partial last frame is carried over
+				if extra < 0:
+					self.carry = bytes(memoryview(data)[size-frame:size])
+					self.k = width + extra
+					size -= frame
+				else:
+					self.k = extra
+			if size == 0:
+				ring.put(data)
+				continue
+			yield data, size
+
+	# Generator yielding the carried partial frame padded with DSD silence, at
+	# the end of a run of tracks
+	def flush(self, ring, channels):
+		if self.k == 0:
+			return
+		width = self.width
+		frame = width * channels
+		data = ring.get()
+		data[0:frame] = self.carry
+		for j in range(self.k, width):
+			b = width - 1 - j if self.le else j
+			data[b:frame:width] = b'\x69' * channels
+		self.carry = None
+		self.k = 0
+		yield data, frame
+
+# playlistchunks
+# Generator chaining the chunks of consecutive tracks with the same format,
+# the data of the next track directly follows the data of the current one
+# (see dsdjoin) so there is no silence or gap between them. Stops before a
+# track with a different format, which stays in the playlist.
+# Input: playlist, first track, buffer ring, nr of frames per period, dsdstats,
+# native DSD sample format
+# Yields: output buffer from the ring, nr of bytes of data in it
+def playlistchunks(playlist, track, ring, periodsize, stats, fmt='DSD_U32_BE'):
+	join = dsdjoin(fmt)
+	while True:
+		print("Playing '%s'" % track.filename)
+		first = True
+		for item in join.chunks(track, ring, periodsize, stats):
+			yield item
+			if first:
+				# Get the next track ready while this one plays
+				playlist.peek()
+				first = False
+		track.close()
+		nexttrack = playlist.peek()
+		if nexttrack is None or not track.sameformat(nexttrack):
+			for item in join.flush(ring, track.myfile.channels):
+				yield item
+			return
+		track = playlist.pop()
+
+# pcmformat
+# PCM format for playing a track: the native DSD sample format picked for
+# the track (DoP is packed from DSD_U32_BE frames) and the resulting PCM
+# parameters
+#
+# pcmformat.fmt         - native DSD sample format of the converted chunks
+# pcmformat.dop         - DoP sample width, 0 for native DSD
+# pcmformat.name        - sample format of the PCM (ALSA name)
+# pcmformat.rate        - PCM rate in frames per second
+# pcmformat.period      - PCM period size in frames
+# pcmformat.framebytes  - bytes per PCM frame
+# pcmformat.periodsize  - nr of DSD_U32_BE frames per period
+# pcmformat.dsdrate     - DSD_U32_BE frame rate
+class pcmformat(object):
+
+	def __init__(self, track, dop, formats):
+		self.dop = dop
+		self.channels = track.myfile.channels
+		self.periodsize = periodframes(track.myfile.rate)
+		self.dsdrate = track.myfile.rate // 8 // 4
+		if dop:
+			# Two DoP frames per DSD_U32_BE frame
+			self.fmt = 'DSD_U32_BE'
+			self.name = "S24_3LE" if dop == 3 else "S32_LE"
+			self.rate = self.dsdrate * 2
+			self.period = self.periodsize * 2
+			self.framebytes = self.channels * dop
+		else:
+			self.fmt = pickformat(formats, track.dsdtype)
+			width = dsdformats[self.fmt][0]
+			self.name = self.fmt
+			self.rate = self.dsdrate * 4 // width
+			self.period = self.periodsize * 4 // width
+			self.framebytes = self.channels * width
+
+	# Formats that can be played on the same open PCM
+	def __eq__(self, other):
+		return (isinstance(other, pcmformat) and self.name == other.name and
+		        self.rate == other.rate and self.channels == other.channels)
+
+	def __ne__(self, other):
+		return not self.__eq__(other)
+
+	def describe(self):
+		if self.dop:
+			return "Output: DoP, %s at %d Hz" % (self.name, self.rate)
+		return "Output: native DSD, %s at %d Hz" % (self.name, self.rate)
+
+# playtracks
+# Open the ALSA PCM for the format of track and play it, and all following
+# tracks in the playlist with the same format, without gaps. The native DSD
+# sample format is picked for the first track, following tracks of the other
+# file type are converted to it.
+# Input: card, playlist, first track, DoP sample width (0 for native DSD),
+# buffer size in ms, dsdstats, native DSD sample formats to pick from,
+# dsdoutput
+# Returns: 0 if ok, 1 if the PCM could not be opened or writing to it failed
+def playtracks(audiodev, playlist, track, dop, bufferms, stats, formats=('DSD_U32_BE',),
+               output=None):
+	if output is None:
+		output = dsdoutput('alsa')
+	pcm = pcmformat(track, dop, formats)
+	print(pcm.describe())
+
+	# Setup ALSA, periods are counted in DSD_U32_BE frames
+	fmt = pcm.fmt
+	periodsize = pcm.periodsize
+	rate = pcm.dsdrate
+	channels = pcm.channels
+	try:
+		out = output.open(audiodev, pcm.rate, channels, pcm.period, pcm.name, pcm.framebytes)
+	except Exception as e:
+		print("\nError: Cannot play, %s\n" % e)
+		return 1
+
+	# Start with a few ms of DSD silence data
+	playdsdsilence(out, rate, 10, dop, channels)
+
+	# Queue depth in periods for the requested buffer time
+	depth = max(2, (bufferms * rate + periodsize * 1000 - 1) // (periodsize * 1000))
+	if dop:
+		# The pipe holds DoP frames, DSD_U32_BE frames are converted into
+		# one extra buffer first
+		pipe = dsdpipe(out, depth, periodsize * 2 * channels * dop,
+		               lambda buf: dopmarkers(buf, channels, dop), stats)
+		ring = dsdring(1, periodsize * 4 * channels)
+		pipe.rings.append(ring)
+	else:
+		pipe = dsdpipe(out, depth, periodsize * 4 * channels, None, stats)
+		ring = pipe.ring
+
+	chunks = playlistchunks(playlist, track, ring, periodsize, stats, fmt)
+	if dop:
+		chunks = dopchunks(chunks, ring, pipe.ring, channels, dop, stats)
+	stats.begin(pcm.rate * pcm.framebytes, pcm.framebytes)
+
+	# Play!
+	pipe.run(chunks)
+	pipe.stats()
+	if pipe.stop:
+		# Writing to the PCM failed, no silence at the end
+		try:
+			out.close()
+		except Exception:
+			pass
+		return 1
+
+	# Play a few ms of DSD silence at the end
+	playdsdsilence(out, rate, 10, dop, channels)
+	out.close()
+	return 0
+
+# checkoutput
+# Check if the chosen card supports native DSD playback, fall back to DoP
+# (DSD over PCM) if it does not. Other outputs take every format. Exits if
+# the card does not exist.
+# Input: dsdoutput, card, force DoP, forced native DSD sample format or None
+# Returns: DoP sample width (0 for native DSD), native DSD sample formats
+def checkoutput(output, audiodev, usedop=False, forcefmt=None):
+	dop = 0
+	if output.kind == 'alsa':
+		res = checkdsd(audiodev)
+		formats = set(name for name in checkformats(audiodev) if dsdformat(name) == 0)
+	else:
+		res = -1
+		formats = set(dsdformats)
+	if res == -1:
+		if usedop or output.wav():
+			dop = 4
+		elif forcefmt is not None:
+			formats = set([forcefmt])
+	elif res == 2:
+		print("\nAudio card '%s' does not exist." % audiodev)
+		checksndcards()
+		exit (1)
+	elif usedop:
+		dop = dopwidth(formats)
+	elif forcefmt is not None:
+		if dsdformat(forcefmt) != 0:
+			print("Your python-alsaaudio installation does not support %s" % forcefmt)
+			exit (1)
+		formats = set([forcefmt])
+	elif res == 1:
+		print("\n'%s' is not a (UAC2) USB device, using DoP" % audiodev)
+		dop = 4
+	elif res == 3:
+		print("\n'%s' is a USB sound card without native DSD support, using DoP" % audiodev)
+		dop = dopwidth(formats)
+	elif res != 0:
+		print("Res is %d" % res)
+		exit (1)
+	elif pickformat(formats, 'dsf') is None:
+		# Native DSD needs a python-alsaaudio with DSD sample format support
+		print("Your python-alsaaudio installation does not support the DSD sample formats of '%s', using DoP" % audiodev)
+		dop = dopwidth(formats)
+	return dop, formats
+
 def usage(errstring):
 	if errstring != "":
 		print(errstring)
 	print("\nUsage:\n")
 	print("\tPlay a DSD DSDIFF file:")
-	print("\tplaydsd.py -c <audiocard> -f <file>")
+	print("\tplaydsd.py -c <audiocard> -f <file> [-b <buffer ms>] [-d | -F <format>] [-s <time> | -m <marker>] [<file> ...]")
+	print("\n\tMultiple files are played gapless, the ALSA device is only")
+	print("\treopened when the DSD rate changes")
+	print("\n\t-s [[hh:]mm:]ss[.fff] starts the first file at the given time,")
+	print("\t-m <nr> at the given marker of a DSDIFF file")
+	print("\n\t--stats <seconds> prints a timing stats line every <seconds>,")
+	print("\t--json <file> writes the timing histograms as JSON on exit and on")
+	print("\tSIGUSR1, --trace <file> writes a CSV trace of all periods")
+	print("\n\tThe native DSD sample format of the card that needs the least")
+	print("\twork is used, DSDIFF files are played as DSD_U8 without any")
+	print("\tconversion. -F <format> forces one of DSD_U8, DSD_U16_LE,")
+	print("\tDSD_U16_BE, DSD_U32_LE or DSD_U32_BE")
+	print("\n\t-d forces DoP (DSD over PCM) output, which is also used when")
+	print("\tthe card or python-alsaaudio has no native DSD support")
+	print("\n\tPlay to another output instead of an ALSA card (no -c needed):")
+	print("\tplaydsd.py -o <output> -f <file> ...")
+	print("\n\t-o file:<path> writes the frames to a raw file (DoP in a WAV")
+	print("\tfile for a .wav path), -o null drops them and reports the")
+	print("\tthroughput, -o null:rt does so in real time, -o pipe:<path>")
+	print("\twrites to a FIFO or with '-' to stdout")
 	print("\n\tList usable audio cards:")
 	print("\tplaydsd.py -l\n")
 
 #-- Main
 if __name__ == "__main__":
     audiodev = ''
-    audiofile = ''
+    audiofiles = []
+    bufferms = 500
+    usedop = False
+    forcefmt = None
+    output = dsdoutput('alsa')
+    starttime = None
+    startmark = 0
+    statsinterval = 0
+    jsonfile = None
+    tracefile = None
     argv = sys.argv[1:]
 
-    # Check if the python-alsaaudio is updated with DSD sample format support
-    if dsdformat() != 0:
-	    print("Your python-alsaaudio installation does not support the needed DSD sample format")
-	    exit (1)
-
     try:
-	    opts, args = getopt.getopt(argv,"hlc:f:",["card=","file=", "list"])
+	    opts, args = getopt.getopt(argv,"hlc:f:b:dF:o:s:m:",["card=","file=", "list", "buffer=", "dop", "format=",
+	                                                           "output=", "start=", "mark=", "stats=", "json=",
+	                                                           "trace="])
 	    #print "Opts = %s" % opts
 	    #print "Args = %s" % args
 	    if len(opts) == 0 and len(args) == 0:
@@ -262,170 +1597,111 @@ if __name__ == "__main__":
 	    elif opt in ("-c", "--card"):
 		    audiodev = arg
 	    elif opt in ("-f", "--file"):
-		    audiofile = arg
+		    audiofiles.append(arg)
 		    #print "Arg for file is %s" % arg
 		    if arg == "":
 			    print("Missing filename for -f option")
 			    sys.exit(1)
+	    elif opt in ("-b", "--buffer"):
+		    try:
+			    bufferms = int(arg)
+		    except ValueError:
+			    bufferms = 0
+		    if bufferms <= 0:
+			    usage("Wrong buffer size '%s'" % arg)
+			    sys.exit(2)
+	    elif opt in ("-d", "--dop"):
+		    usedop = True
+	    elif opt in ("-F", "--format"):
+		    forcefmt = arg.upper()
+		    if forcefmt not in dsdformats:
+			    usage("Unknown DSD sample format '%s'" % arg)
+			    sys.exit(2)
+	    elif opt in ("-o", "--output"):
+		    try:
+			    output = dsdoutput(arg)
+		    except ValueError as e:
+			    usage(str(e))
+			    sys.exit(2)
+	    elif opt in ("-s", "--start"):
+		    try:
+			    starttime = dsdlib.parsetime(arg)
+		    except ValueError:
+			    usage("Wrong start time '%s'" % arg)
+			    sys.exit(2)
+	    elif opt in ("-m", "--mark"):
+		    try:
+			    startmark = int(arg)
+		    except ValueError:
+			    usage("Wrong marker number '%s'" % arg)
+			    sys.exit(2)
+	    elif opt == "--stats":
+		    try:
+			    statsinterval = float(arg)
+		    except ValueError:
+			    usage("Wrong stats interval '%s'" % arg)
+			    sys.exit(2)
+	    elif opt == "--json":
+		    jsonfile = arg
+	    elif opt == "--trace":
+		    tracefile = arg
 	    elif opt in ("-l", "--list"):
+		    if alsaaudio is None:
+			    print("Failed to import 'alsaaudio'")
+			    sys.exit(1)
 		    checksndcards()
 		    sys.exit(0)
 		    
-    if audiodev == "":
+    if output.kind == 'alsa' and alsaaudio is None:
+	    print("Failed to import 'alsaaudio', only -o file:, null and pipe: outputs can be used")
+	    sys.exit(1)
+    if output.kind == 'alsa' and audiodev == "":
 	    usage("Missing audio device")
 	    sys.exit(1)
-    if audiofile == "":
+    audiofiles += args
+    if len(audiofiles) == 0:
 	    usage("Missing file name")
 	    sys.exit(1)
 
-    print("Chosen audio device is: '%s'" % audiodev)
-    print("File to play: '%s'" % audiofile)
-
-    # Check if the chosen card supports native DSD playback
-    res = checkdsd(audiodev)
-    if res == 1:
-	    print("\n'%s' is not a (UAC2) USB device" % audiodev)
-	    checksndcards()
-	    exit (1)
-    elif res == 2:
-	    print("\nAudio card '%s' does not exist." % audiodev)
-	    checksndcards()
-	    exit (1)
-    elif res == 3:
-	    print("\nSorry, '%s' is a USB sound card without native DSD support" % audiodev)
-	    checksndcards()
-	    exit (1)
-    elif res != 0:
-	    print("Res is %d" % res)
-	    exit (1)
+    if output.kind == 'alsa':
+	    print("Chosen audio device is: '%s'" % audiodev)
+    for audiofile in audiofiles:
+	    print("File to play: '%s'" % audiofile)
+
+    # Check if the chosen card supports native DSD playback, fall back to DoP
+    # (DSD over PCM) if it does not
+    dop, formats = checkoutput(output, audiodev, usedop, forcefmt)
 
     # Install signal handler
     signal.signal(signal.SIGINT, signal_handler)
 
-    # Check if given file exists and is readable
-
-    # Check if file to play is a proper DSDIFF or DSF file.
-    # If so, get its properties
-    myfile = dsdlib.dsdfile()
-
-    ret = dsdlib.checkdsdfile(audiofile, myfile)
-    print("DEBUG: myfile.valid: %s" % myfile.valid)
-
-    #print "Got: myfile.valid = %d, myfile.type = %s" % (myfile.valid, myfile.type)
-
-    if myfile.valid == 2:
-	    print("Not a DSD file")
-	    sys.exit(1)
-
-    dsdtype = myfile.type.decode("UTF-8")
-    valid = myfile.valid
-    rate = myfile.rate
-    channels = myfile.channels
-
-    print("DEBUG: valid: %d, dsdtype: %s" % (valid, dsdtype))
-	
-    if valid == 0 and (dsdtype != 'dsdiff' and dsdtype != 'dsf'):
-	    print("Unsupported or invalid DSD file")
-	    sys.exit(1)
-
-    if valid == 0 and (dsdtype == 'dsdiff' or dsdtype == 'dsf'):
-	    print("Invalid %s file" % dsdtype.upper())
-	    sys.exit(1)
-
-    if dsdtype == "dsdiff" and myfile.compress == 1:
-	    print("This DSDIFF file uses compressed DSD data samples, playback is not supported")
-	    sys.exit(1)
-
-    if channels != 2:
-	    print("File with %d channels,  only 2 channel (stereo) files are supported" % channels)
-	    sys.exit(1)
-
-    print("DSD file type: %s" % dsdtype.upper())
-    print("channels = %d" % channels)
-    print("rate = %d Hz [%s]" % (rate, dsdlib.rate_to_string(rate)))
-    print("Total file size: %d" % myfile.fsize)
-    print("DSD data start at: %d" % myfile.datastart)
-    print("DSD data size: %d" % myfile.datasize)
-
-    # Open file
-    f = open(audiofile, 'rb')
-    # Seek to start of DSD data
-    f.seek(myfile.datastart)
-
-    # Setup ALSA
+    # Timing statistics, SIGUSR1 dumps them as JSON (to stdout without --json)
+    stats = dsdstats(statsinterval, tracefile)
+    signal.signal(signal.SIGUSR1, lambda signum, frame: stats.dump(jsonfile or '-'))
+
+    # Play the files, a run of tracks with the same format is played on
+    # one PCM
+    playlist = dsdplaylist(audiofiles)
+    track = playlist.pop()
+    if track is not None and starttime is not None:
+	    track.seektime(starttime)
+	    print("Start at %.3f s" % starttime)
+    elif track is not None and startmark != 0:
+	    if track.seekmark(startmark) != 0:
+		    print("'%s' has no marker %d" % (track.filename, startmark))
+		    sys.exit(1)
+	    print("Start at marker %d, %.3f s" % (startmark, track.start / track.myfile.rate))
     try:
-        rate = myfile.rate//8//4
-        # Marantz: front:CARD=HDDAC1,DEV=0
-        # iFi: front:CARD=Audio,DEV=0
-        out = alsaaudio.PCM(alsaaudio.PCM_PLAYBACK, device="front:CARD='%s',DEV=0" % audiodev,\
-                            rate=rate, channels=2, periodsize=11025,\
-                            format=alsaaudio.PCM_FORMAT_DSD_U32_BE)    
-
-#               device="front:CARD='%s',DEV=0" % audiodev)
-
-    except Exception as e:
-	    print("\nError: Cannot play, %s\n" % e)
-	    sys.exit(1)
-
-    # Start with a few ms of DSD silence data
-    playdsdsilence(rate, 10)
-
-    if myfile.type == "dsdiff":
-	    # DSDIFF playback	
-
-	    # Play!
-	    print("Playing '%s' using card '%s'" % (audiofile, audiodev))
-	    rdsize=320
-
-	    data = f.read(rdsize)
-	    newdata = bytearray(rdsize)
-
-	    # Convert first block of DSD data
-	    newdata = dsdxmos(rdsize, data, newdata)
-	    datasize = myfile.datasize - rdsize
-	    remain = datasize
-
-	    while data:
-		    out.write(newdata)
-
-		    remain -= rdsize	
-		    if remain < rdsize:
-			    print("Nearing the end, todo: %d" % remain)
-			    rdsize = remain
-
-		    data = f.read(rdsize)
-		    newdata = bytearray(rdsize)         # todo: move this to dsdxmos
-
-		    newdata = dsdxmos(rdsize, data, newdata)
-
-    # DSF playback
-    else:
-	    rdsize = 8192
-	    data = f.read(rdsize)
-	    data = bytearray(data)
-	    newdata = bytearray(data)
-
-	    # Convert first block of DSD data
-	    newdata = dsfxmos(rdsize, data, newdata, myfile.lsbfirst)
-	    datasize = myfile.datasize - rdsize
-	    remain = datasize
-
-	    while data:
-		    out.write(newdata)
-		    remain -= rdsize
-
-		    if remain < rdsize:
-			    print("DSF: nearing the end, todo: %d" % remain)
-			    rdsize = remain
-		    data = f.read(rdsize)
-		    data = bytearray(data)
-		    newdata = bytearray(rdsize)         # todo: move this to dsdxmos
-
-		    newdata = dsfxmos(rdsize, data, newdata, myfile.lsbfirst)
-
-
-    # Play a few ms of DSD silence at the end
-    playdsdsilence(rate, 10)
-
-    f.close()
-    sys.exit(0)
+	    while track is not None:
+		    if playtracks(audiodev, playlist, track, dop, bufferms, stats, formats, output) != 0:
+			    sys.exit(1)
+		    track = playlist.pop()
+    finally:
+	    stats.close()
+	    print(stats.line())
+	    if jsonfile is not None:
+		    stats.dump(jsonfile)
+
+    if playlist.skipped:
+	    print("Skipped %d of %d files" % (playlist.skipped, len(audiofiles)))
+    sys.exit(0 if playlist.skipped < len(audiofiles) else 1)